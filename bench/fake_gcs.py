@@ -0,0 +1,268 @@
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+
+# In-memory stand-in for the parts of the GCS JSON API that
+# google-cloud-storage uses when pointed at it with STORAGE_EMULATOR_HOST:
+# object metadata, ranged media downloads, multipart and resumable uploads,
+# generation preconditions, compose, copy, delete and prefix listings.
+#
+# `bandwidth` caps each connection's throughput in bytes per second, which is
+# what parallel transfers are meant to get around.
+class FakeGCS:
+    def __init__(self, latency: float = 0.0, bandwidth: float | None = None) -> None:
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.lock = threading.RLock()
+        self.calls: Counter[str] = Counter()
+        self.objects: dict[tuple[str, str], dict[str, Any]] = {}
+        self.uploads: dict[str, dict[str, Any]] = {}
+        self._generation = 0
+        self.server = _Server(("127.0.0.1", 0), _handler(self))
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._routes = [
+            ("GET", r"/storage/v1/b/(?P<bucket>[^/]+)/o", self._list),
+            ("GET", r"/storage/v1/b/(?P<bucket>[^/]+)/o/(?P<name>.+)", self._get),
+            ("DELETE", r"/storage/v1/b/(?P<bucket>[^/]+)/o/(?P<name>.+)", self._delete),
+            ("PATCH", r"/storage/v1/b/(?P<bucket>[^/]+)/o/(?P<name>.+)", self._patch),
+            ("POST", r"/upload/storage/v1/b/(?P<bucket>[^/]+)/o", self._upload),
+            ("PUT", r"/upload/storage/v1/b/(?P<bucket>[^/]+)/o", self._resume),
+            ("POST", r"/storage/v1/b/(?P<bucket>[^/]+)/o/(?P<name>.+)/compose", self._compose),
+            (
+                "POST",
+                r"/storage/v1/b/(?P<bucket>[^/]+)/o/(?P<name>.+)/(?:copyTo|rewriteTo)/b/(?P<dest_bucket>[^/]+)/o/(?P<dest>.+)",
+                self._copy,
+            ),
+        ]
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def names(self, bucket: str, prefix: str = ""):
+        with self.lock:
+            return sorted(n for b, n in self.objects if b == bucket and n.startswith(prefix))
+
+    def data(self, bucket: str, name: str) -> bytes:
+        with self.lock:
+            return self.objects[bucket, name]["data"]
+
+    def dispatch(self, method: str, path: str, query: dict[str, str], headers, body: bytes):
+        for route_method, pattern, handler in self._routes:
+            if route_method != method:
+                continue
+            m = re.fullmatch(pattern, path)
+            if m:
+                params = {k: unquote(v) for k, v in m.groupdict().items()}
+                self.calls[f"{method} {handler.__name__.strip('_')}"] += 1
+                with self.lock:
+                    return handler(query=query, headers=headers, body=body, **params)
+        return 404, {"error": {"code": 404, "message": "Not Found"}}, {}
+
+    def _get(self, bucket, name, query, headers, **_):
+        obj = self.objects.get((bucket, name))
+        if obj is None:
+            return _error(404, "No such object")
+        if query.get("alt") != "media":
+            return 200, self._resource(bucket, name), {}
+        data = obj["data"]
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", headers.get("Range") or "")
+        if match:
+            start = int(match[1])
+            end = int(match[2]) if match[2] else len(data) - 1
+            chunk = data[start : end + 1]
+            return 206, chunk, {"Content-Range": f"bytes {start}-{start + len(chunk) - 1}/{len(data)}"}
+        return 200, data, {}
+
+    def _list(self, bucket, query, **_):
+        prefix = query.get("prefix", "")
+        items = [self._resource(bucket, n) for n in self.names(bucket, prefix)]
+        return 200, {"kind": "storage#objects", "items": items}, {}
+
+    def _delete(self, bucket, name, query, **_):
+        if (bucket, name) not in self.objects:
+            return _error(404, "No such object")
+        if not self._precondition(bucket, name, query):
+            return _error(412, "Precondition Failed")
+        del self.objects[bucket, name]
+        return 204, None, {}
+
+    def _patch(self, bucket, name, body, **_):
+        obj = self.objects.get((bucket, name))
+        if obj is None:
+            return _error(404, "No such object")
+        obj["metadata"] = json.loads(body).get("metadata") or obj["metadata"]
+        return 200, self._resource(bucket, name), {}
+
+    def _upload(self, bucket, query, headers, body, **_):
+        kind = query.get("uploadType")
+        if kind == "media":
+            return self._put(bucket, {"name": query["name"]}, body, query)
+        if kind == "multipart":
+            (meta_headers, meta), (media_headers, media) = _multipart(
+                headers["Content-Type"], body
+            )
+            resource = json.loads(meta)
+            resource.setdefault("contentType", media_headers.get("content-type"))
+            return self._put(bucket, resource, media, query)
+        if kind == "resumable":
+            upload_id = str(len(self.uploads))
+            resource = json.loads(body) if body else {"name": query.get("name")}
+            if "X-Upload-Content-Type" in headers:
+                resource.setdefault("contentType", headers["X-Upload-Content-Type"])
+            self.uploads[upload_id] = {"bucket": bucket, "resource": resource, "data": b"", "query": query}
+            location = f"{self.url}/upload/storage/v1/b/{bucket}/o?uploadType=resumable&upload_id={upload_id}"
+            return 200, None, {"Location": location}
+        return _error(400, f"Unsupported uploadType {kind}")
+
+    def _resume(self, bucket, query, headers, body, **_):
+        upload = self.uploads[query["upload_id"]]
+        upload["data"] += body
+        total = re.search(r"/(\d+|\*)$", headers.get("Content-Range", ""))
+        if total and total[1] != "*" and len(upload["data"]) >= int(total[1]):
+            del self.uploads[query["upload_id"]]
+            return self._put(upload["bucket"], upload["resource"], upload["data"], upload["query"])
+        return 308, None, {"Range": f"bytes=0-{len(upload['data']) - 1}"}
+
+    def _compose(self, bucket, name, query, body, **_):
+        request = json.loads(body)
+        data = b"".join(
+            self.objects[bucket, source["name"]]["data"] for source in request["sourceObjects"]
+        )
+        return self._put(bucket, {**request.get("destination", {}), "name": name}, data, query)
+
+    def _copy(self, bucket, name, dest_bucket, dest, query, **_):
+        obj = self.objects.get((bucket, name))
+        if obj is None:
+            return _error(404, "No such object")
+        resource = {"name": dest, "contentType": obj["content_type"], "metadata": obj["metadata"]}
+        status, created, headers = self._put(dest_bucket, resource, obj["data"], query)
+        if status != 200 or "rewriteTo" not in query.get("_path", ""):
+            return status, created, headers
+        return status, {"kind": "storage#rewriteResponse", "done": True, "resource": created}, headers
+
+    def _put(self, bucket, resource, data, query):
+        name = resource["name"]
+        if not self._precondition(bucket, name, query):
+            return _error(412, "Precondition Failed")
+        self._generation += 1
+        self.objects[bucket, name] = {
+            "data": data,
+            "generation": self._generation,
+            "content_type": resource.get("contentType") or "application/octet-stream",
+            "metadata": resource.get("metadata"),
+            "created": time.time(),
+        }
+        return 200, self._resource(bucket, name), {}
+
+    def _precondition(self, bucket, name, query):
+        if "ifGenerationMatch" not in query:
+            return True
+        obj = self.objects.get((bucket, name))
+        generation = obj["generation"] if obj else 0
+        return int(query["ifGenerationMatch"]) == generation
+
+    def _resource(self, bucket, name):
+        obj = self.objects[bucket, name]
+        resource = {
+            "kind": "storage#object",
+            "bucket": bucket,
+            "name": name,
+            "id": f"{bucket}/{name}/{obj['generation']}",
+            "selfLink": f"{self.url}/storage/v1/b/{bucket}/o/{quote(name, safe='')}",
+            "mediaLink": f"{self.url}/download/storage/v1/b/{bucket}/o/{quote(name, safe='')}?alt=media",
+            "generation": str(obj["generation"]),
+            "metageneration": "1",
+            "size": str(len(obj["data"])),
+            "contentType": obj["content_type"],
+            "timeCreated": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(obj["created"])),
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(obj["created"])),
+        }
+        if obj["metadata"]:
+            resource["metadata"] = obj["metadata"]
+        return resource
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def _handler(gcs: FakeGCS):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately; without this every
+        # response waits out a delayed ACK.
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self._handle()
+
+        do_POST = do_PUT = do_PATCH = do_DELETE = do_GET
+
+        def _handle(self):
+            if gcs.latency:
+                time.sleep(gcs.latency)
+            url = urlsplit(self.path)
+            path = url.path
+            if path.startswith("/download/"):
+                path = path[len("/download") :]
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            query["_path"] = path
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            status, payload, headers = gcs.dispatch(self.command, path, query, self.headers, body)
+            if isinstance(payload, bytes):
+                data, content_type = payload, "application/octet-stream"
+            elif payload is None:
+                data, content_type = b"", "application/json"
+            else:
+                data, content_type = json.dumps(payload).encode(), "application/json"
+            if gcs.bandwidth:
+                time.sleep((len(body) + len(data)) / gcs.bandwidth)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *_):
+            pass
+
+    return Handler
+
+
+def _multipart(content_type: str, body: bytes):
+    # multipart/related with a JSON resource part and a media part, split by
+    # hand: the email parser takes longer than the transfer on large parts.
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type)[1].encode()
+    parts = []
+    for part in body.split(b"--" + boundary)[1:-1]:
+        head, _, content = part.partition(b"\r\n\r\n")
+        headers = dict(
+            (k.strip().lower(), v.strip())
+            for k, _, v in (line.partition(":") for line in head.decode().split("\r\n") if line)
+        )
+        parts.append((headers, content[: -len(b"\r\n")]))
+    return parts
+
+
+def _error(status: int, message: str):
+    return status, {"error": {"code": status, "message": message}}, {}
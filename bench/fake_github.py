@@ -0,0 +1,379 @@
+import io
+import json
+import random
+import re
+import ssl
+import threading
+import time
+from base64 import b64decode, b64encode
+from collections import Counter
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, unquote, urlsplit
+from zipfile import ZipFile
+
+
+# In-memory stand-in for the parts of the GitHub REST API we use. Repos are
+# flat maps of path -> blob, which is all the config repos ever contain, and
+# every request sleeps for `latency` seconds to approximate the round-trip
+# to api.github.com. Responses carry X-RateLimit-* headers for a quota of
+# `rate_limit` requests per `rate_window` seconds, and a `fault_rate`
+# fraction of requests is refused with a secondary-rate-limit 403 or a 429.
+class FakeGitHub:
+    def __init__(
+        self,
+        org: str = "blueform",
+        latency: float = 0.0,
+        tls: tuple[str, str] | None = None,
+        rate_limit: int = 5000,
+        rate_window: float = 3600.0,
+        fault_rate: float = 0.0,
+        retry_after: float = 1.0,
+    ) -> None:
+        self.org = org
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.fault_rate = fault_rate
+        self.retry_after = retry_after
+        self.remaining = rate_limit
+        self.reset = time.time() + rate_window
+        self.lock = threading.RLock()
+        self.calls: Counter[str] = Counter()
+        self.faults: Counter[int] = Counter()
+        self.not_modified = 0
+        self.blobs: dict[str, bytes] = {}
+        self.trees: dict[str, dict[str, str]] = {}
+        self.commits: dict[str, dict[str, Any]] = {}
+        self.refs: dict[str, dict[str, str]] = {}
+        self.server = _Server(("127.0.0.1", 0), _handler(self))
+        self.scheme = "http"
+        if tls:
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(*tls)
+            context.set_alpn_protocols(["http/1.1"])
+            self.server.socket = context.wrap_socket(
+                self.server.socket, server_side=True
+            )
+            self.scheme = "https"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._routes = [
+            ("POST", r"/app/installations/[^/]+/access_tokens", self._access_token),
+            ("POST", r"/orgs/[^/]+/repos", self._create_repo),
+            ("GET", r"/repos/[^/]+/(?P<repo>[^/]+)/zipball/(?P<ref>.+)", self._zipball),
+            ("GET", r"/repos/[^/]+/(?P<repo>[^/]+)/commits/(?P<ref>.+)", self._get_sha),
+            ("GET", r"/repos/[^/]+/(?P<repo>[^/]+)/git/ref/heads/(?P<name>.+)", self._get_ref),
+            ("POST", r"/repos/[^/]+/(?P<repo>[^/]+)/git/refs", self._create_ref),
+            ("PATCH", r"/repos/[^/]+/(?P<repo>[^/]+)/git/refs/heads/(?P<name>.+)", self._update_ref),
+            ("DELETE", r"/repos/[^/]+/(?P<repo>[^/]+)/git/refs/heads/(?P<name>.+)", self._delete_ref),
+            ("GET", r"/repos/[^/]+/(?P<repo>[^/]+)/git/commits/(?P<sha>\w+)", self._get_commit),
+            ("POST", r"/repos/[^/]+/(?P<repo>[^/]+)/git/commits", self._create_commit),
+            ("GET", r"/repos/[^/]+/(?P<repo>[^/]+)/git/trees/(?P<sha>\w+)", self._get_tree),
+            ("POST", r"/repos/[^/]+/(?P<repo>[^/]+)/git/trees", self._create_tree),
+            ("GET", r"/repos/[^/]+/(?P<repo>[^/]+)/contents/(?P<path>.+)", self._get_content),
+            ("PUT", r"/repos/[^/]+/(?P<repo>[^/]+)/contents/(?P<path>.+)", self._put_content),
+            ("DELETE", r"/repos/[^/]+/(?P<repo>[^/]+)/contents/(?P<path>.+)", self._delete_content),
+            ("POST", r"/repos/[^/]+/(?P<repo>[^/]+)/merges", self._merge),
+        ]
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"{self.scheme}://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def seed(self, repo: str, files: dict[str, bytes | str], branch: str = "main"):
+        with self.lock:
+            tree = {path: self._put_blob(_bytes(data)) for path, data in files.items()}
+            commit = self._put_commit(self._put_tree(tree), [], "seed")
+            self.refs.setdefault(repo, {})[branch] = commit
+            return commit
+
+    def files(self, repo: str, ref: str = "main"):
+        with self.lock:
+            tree = self.trees[self.commits[self._resolve(repo, ref)]["tree"]]
+            return {path: self.blobs[sha] for path, sha in tree.items()}
+
+    def limit(self, path: str):
+        # Rate-limit headers for a request, and the fault to answer it with
+        # instead of handling it, if any. Token exchanges are exempt.
+        if path.endswith("/access_tokens"):
+            return {}, None
+        with self.lock:
+            now = time.time()
+            if now >= self.reset:
+                self.remaining = self.rate_limit
+                self.reset = now + self.rate_window
+            fault = None
+            if self.remaining <= 0:
+                fault = 403, {"message": "API rate limit exceeded"}
+            else:
+                self.remaining -= 1
+                if random.random() < self.fault_rate:
+                    status = random.choice([403, 429])
+                    fault = status, {"message": "You have exceeded a secondary rate limit."}
+            headers = {
+                "X-RateLimit-Limit": str(self.rate_limit),
+                "X-RateLimit-Remaining": str(self.remaining),
+                "X-RateLimit-Reset": str(int(self.reset)),
+            }
+            if fault:
+                self.faults[fault[0]] += 1
+                if self.remaining > 0:
+                    headers["Retry-After"] = f"{self.retry_after:g}"
+            return headers, fault
+
+    def dispatch(self, method: str, path: str, query: dict[str, list[str]], body: Any):
+        for route_method, pattern, handler in self._routes:
+            if route_method != method:
+                continue
+            m = re.fullmatch(pattern, path)
+            if m:
+                self.calls[f"{method} {handler.__name__.strip('_')}"] += 1
+                with self.lock:
+                    return handler(body=body, query=query, **m.groupdict())
+        return 404, {"message": "Not Found"}
+
+    def _access_token(self, **_):
+        expires = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600))
+        return 201, {"token": "ghs_fake", "expires_at": expires}
+
+    def _create_repo(self, body, **_):
+        self.seed(body["name"], {})
+        return 201, {"name": body["name"]}
+
+    def _zipball(self, repo, ref, **_):
+        sha = self._resolve(repo, ref)
+        if sha is None:
+            return 404, {"message": "Not Found"}
+        prefix = f"{self.org}-{repo}-{sha[:7]}/"
+        buf = io.BytesIO()
+        with ZipFile(buf, "w") as zf:
+            zf.writestr(prefix, b"")
+            for path, blob in sorted(self.trees[self.commits[sha]["tree"]].items()):
+                zf.writestr(prefix + path, self.blobs[blob])
+        return 200, buf.getvalue()
+
+    def _get_sha(self, repo, ref, **_):
+        sha = self._resolve(repo, ref)
+        if sha is None:
+            return 404, {"message": "Not Found"}
+        return 200, sha
+
+    def _get_ref(self, repo, name, **_):
+        sha = self.refs.get(repo, {}).get(name)
+        if sha is None:
+            return 404, {"message": "Not Found"}
+        return 200, {"ref": f"refs/heads/{name}", "object": {"sha": sha, "type": "commit"}}
+
+    def _create_ref(self, repo, body, **_):
+        name = body["ref"].removeprefix("refs/heads/")
+        if name in self.refs[repo]:
+            return 422, {"message": "Reference already exists"}
+        self.refs[repo][name] = body["sha"]
+        return 201, {"ref": body["ref"], "object": {"sha": body["sha"]}}
+
+    def _update_ref(self, repo, name, body, **_):
+        current = self.refs[repo].get(name)
+        if current is None:
+            return 422, {"message": "Reference does not exist"}
+        if not body.get("force") and current not in self._ancestors(body["sha"]):
+            return 422, {"message": "Update is not a fast forward"}
+        self.refs[repo][name] = body["sha"]
+        return 200, {"ref": f"refs/heads/{name}", "object": {"sha": body["sha"]}}
+
+    def _delete_ref(self, repo, name, **_):
+        if self.refs[repo].pop(name, None) is None:
+            return 422, {"message": "Reference does not exist"}
+        return 204, None
+
+    def _get_commit(self, sha, **_):
+        commit = self.commits.get(sha)
+        if commit is None:
+            return 404, {"message": "Not Found"}
+        return 200, {
+            "sha": sha,
+            "tree": {"sha": commit["tree"]},
+            "parents": [{"sha": p} for p in commit["parents"]],
+        }
+
+    def _create_commit(self, body, **_):
+        sha = self._put_commit(body["tree"], body["parents"], body["message"])
+        return 201, {"sha": sha, "tree": {"sha": body["tree"]}}
+
+    def _get_tree(self, sha, **_):
+        tree = self.trees.get(sha)
+        if tree is None:
+            return 404, {"message": "Not Found"}
+        entries = [
+            {"path": path, "mode": "100644", "type": "blob", "sha": blob, "size": len(self.blobs[blob])}
+            for path, blob in sorted(tree.items())
+        ]
+        return 200, {"sha": sha, "tree": entries, "truncated": False}
+
+    def _create_tree(self, body, **_):
+        tree = dict(self.trees[body["base_tree"]]) if body.get("base_tree") else {}
+        for entry in body["tree"]:
+            if "content" in entry:
+                tree[entry["path"]] = self._put_blob(entry["content"].encode())
+            elif entry.get("sha") is None:
+                if tree.pop(entry["path"], None) is None:
+                    return 422, {"message": f"path '{entry['path']}' does not exist"}
+            else:
+                tree[entry["path"]] = entry["sha"]
+        return 201, {"sha": self._put_tree(tree)}
+
+    def _get_content(self, repo, path, query, **_):
+        sha = self._resolve(repo, query.get("ref", ["main"])[0])
+        blob = self.trees[self.commits[sha]["tree"]].get(unquote(path)) if sha else None
+        if blob is None:
+            return 404, {"message": "Not Found"}
+        content = b64encode(self.blobs[blob]).decode()
+        return 200, {"path": path, "sha": blob, "content": content, "encoding": "base64"}
+
+    def _put_content(self, repo, path, body, **_):
+        path = unquote(path)
+        head = self.refs[repo][body["branch"]]
+        tree = dict(self.trees[self.commits[head]["tree"]])
+        if path in tree and body.get("sha") != tree[path]:
+            return 422, {"message": '"sha" wasn\'t supplied.'}
+        status = 200 if path in tree else 201
+        tree[path] = self._put_blob(b64decode(body["content"]))
+        commit = self._put_commit(self._put_tree(tree), [head], body["message"])
+        self.refs[repo][body["branch"]] = commit
+        return status, {"content": {"path": path, "sha": tree[path]}, "commit": {"sha": commit}}
+
+    def _delete_content(self, repo, path, body, **_):
+        path = unquote(path)
+        head = self.refs[repo][body["branch"]]
+        tree = dict(self.trees[self.commits[head]["tree"]])
+        if path not in tree:
+            return 404, {"message": "Not Found"}
+        if body.get("sha") != tree.pop(path):
+            return 409, {"message": "sha does not match"}
+        commit = self._put_commit(self._put_tree(tree), [head], body["message"])
+        self.refs[repo][body["branch"]] = commit
+        return 200, {"content": None, "commit": {"sha": commit}}
+
+    def _merge(self, repo, body, **_):
+        base = self.refs[repo][body["base"]]
+        head = self._resolve(repo, body["head"])
+        base_ancestors = self._ancestors(base)
+        if head in base_ancestors:
+            return 204, None
+        head_ancestors = self._ancestors(head)
+        merge_base = next(sha for sha in base_ancestors if sha in head_ancestors)
+        original = self.trees[self.commits[merge_base]["tree"]]
+        ours = dict(self.trees[self.commits[base]["tree"]])
+        theirs = self.trees[self.commits[head]["tree"]]
+        for path in set(original) | set(theirs):
+            if original.get(path) == theirs.get(path):
+                continue
+            if ours.get(path) not in (original.get(path), theirs.get(path)):
+                return 409, {"message": "Merge conflict"}
+            if path in theirs:
+                ours[path] = theirs[path]
+            else:
+                ours.pop(path, None)
+        commit = self._put_commit(self._put_tree(ours), [base, head], f"Merge {body['head']}")
+        self.refs[repo][body["base"]] = commit
+        return 201, {"sha": commit}
+
+    def _resolve(self, repo: str, ref: str):
+        if ref in self.commits:
+            return ref
+        return self.refs.get(repo, {}).get(ref)
+
+    def _ancestors(self, sha: str):
+        # Breadth-first, so the first hit is the nearest common ancestor.
+        seen, queue = [], [sha]
+        while queue:
+            current = queue.pop(0)
+            if current not in seen:
+                seen.append(current)
+                queue.extend(self.commits[current]["parents"])
+        return seen
+
+    def _put_blob(self, data: bytes):
+        sha = sha1(b"blob %d\0" % len(data) + data).hexdigest()
+        self.blobs[sha] = data
+        return sha
+
+    def _put_tree(self, tree: dict[str, str]):
+        sha = sha1(json.dumps(tree, sort_keys=True).encode()).hexdigest()
+        self.trees[sha] = tree
+        return sha
+
+    def _put_commit(self, tree: str, parents: list[str], message: str):
+        data = json.dumps([tree, parents, message, len(self.commits)]).encode()
+        sha = sha1(data).hexdigest()
+        self.commits[sha] = {"tree": tree, "parents": parents, "message": message}
+        return sha
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def _handler(github: FakeGitHub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self._handle()
+
+        do_POST = do_PUT = do_PATCH = do_DELETE = do_GET
+
+        def _handle(self):
+            if github.latency:
+                time.sleep(github.latency)
+            url = urlsplit(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            body = json.loads(raw) if raw else None
+            limit_headers, fault = github.limit(url.path)
+            status, payload = fault or github.dispatch(
+                self.command, url.path, parse_qs(url.query), body
+            )
+            if isinstance(payload, bytes):
+                data, content_type = payload, "application/zip"
+            elif isinstance(payload, str):
+                data, content_type = payload.encode(), "text/plain"
+            elif payload is None:
+                data, content_type = b"", "application/json"
+            else:
+                data, content_type = json.dumps(payload).encode(), "application/json"
+            if self.command == "GET" and status == 200:
+                # Like GitHub, unchanged GETs revalidate to an empty 304.
+                etag = f'"{sha1(data).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    github.not_modified += 1
+                    status, data = 304, b""
+                self.send_response(status)
+                self.send_header("ETag", etag)
+            else:
+                self.send_response(status)
+            for name, value in limit_headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *_):
+            pass
+
+    return Handler
+
+
+def _bytes(data: bytes | str):
+    return data.encode() if isinstance(data, str) else data
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# Stands in for the terraform binary (TF_EXE) in benchmarks. plan/apply emit
+# FAKE_TF_LINES planned_change/apply_complete lines (plus some resource_drift
+# and a change_summary, as `-json` does) on stdout while writing FAKE_TF_STDERR_BYTES of
+# noise to stderr, interleaved so a runner that drains stdout before stderr
+# deadlocks once the stderr pipe fills. FAKE_TF_SLEEP delays each command,
+# FAKE_TF_INIT_SLEEP additionally delays init, FAKE_TF_EXIT sets the exit
+# code and FAKE_TF_LOG names a file every command line is appended to.
+# With -target, plan only covers the targeted addresses, and
+# FAKE_TF_RESOURCE_SLEEP is spent per resource refreshed and planned.
+#
+# Workspaces behave like Terraform's: init fails when TF_WORKSPACE names one
+# that doesn't exist, and `workspace select`/`new` refuse to run with it set.
+# With a gcs backend and STORAGE_EMULATOR_HOST (see fake_gcs.py) they are
+# state objects in the bucket, otherwise directories in terraform.tfstate.d.
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+ACTIONS = ("create", "update", "delete", "replace")
+LOCK_FILE = """provider "registry.terraform.io/hashicorp/null" {
+  version = "3.2.2"
+  hashes = []
+}
+"""
+
+
+def main(args: list[str]):
+    if "FAKE_TF_LOG" in os.environ:
+        with open(os.environ["FAKE_TF_LOG"], "a") as f:
+            f.write(" ".join(args) + "\n")
+    time.sleep(float(os.environ.get("FAKE_TF_SLEEP", "0")))
+    command = args[0] if args else ""
+    workspace = os.environ.get("TF_WORKSPACE")
+    if command == "init":
+        os.makedirs(".terraform", exist_ok=True)
+        if not os.path.exists(".terraform.lock.hcl"):
+            with open(".terraform.lock.hcl", "w") as f:
+                f.write(LOCK_FILE)
+        time.sleep(float(os.environ.get("FAKE_TF_INIT_SLEEP", "0")))
+        if workspace and not _workspace_exists(workspace):
+            return _fail(f'Currently selected workspace "{workspace}" does not exist')
+    elif command in ("plan", "apply"):
+        _run(command, args[1:])
+    elif command == "workspace" and args[1:2] == ["list"]:
+        print("* default")
+    elif command == "workspace" and args[1:2] in (["select"], ["new"]):
+        if workspace:
+            return _fail("The selected workspace is currently overridden using TF_WORKSPACE")
+        exists = _workspace_exists(args[2])
+        if args[1] == "select" and not exists:
+            return _fail(f'Workspace "{args[2]}" does not exist')
+        if args[1] == "new":
+            if exists:
+                return _fail(f'Workspace "{args[2]}" already exists')
+            _create_workspace(args[2])
+    return int(os.environ.get("FAKE_TF_EXIT", "0"))
+
+
+def _workspace_exists(name: str):
+    if name == "default":
+        return True
+    backend = _gcs_backend()
+    if backend is None:
+        return os.path.isdir(os.path.join("terraform.tfstate.d", name))
+    try:
+        urlopen(_state_url(backend, name))
+        return True
+    except HTTPError as e:
+        if e.code == 404:
+            return False
+        raise
+
+
+def _create_workspace(name: str):
+    backend = _gcs_backend()
+    if backend is None:
+        os.makedirs(os.path.join("terraform.tfstate.d", name))
+        return
+    bucket, prefix = backend
+    host = os.environ["STORAGE_EMULATOR_HOST"]
+    object_name = quote(f"{prefix}/{name}.tfstate", safe="")
+    url = f"{host}/upload/storage/v1/b/{bucket}/o?uploadType=media&name={object_name}"
+    urlopen(Request(url, data=b"{}", method="POST"))
+
+
+def _gcs_backend():
+    if "STORAGE_EMULATOR_HOST" not in os.environ:
+        return None
+    for name in sorted(os.listdir(".")):
+        if name.endswith(".tf.json"):
+            with open(name) as f:
+                gcs = (json.load(f).get("terraform") or {}).get("backend", {}).get("gcs")
+            if gcs:
+                return gcs["bucket"], gcs.get("prefix", "")
+    return None
+
+
+def _state_url(backend: tuple[str, str], name: str):
+    bucket, prefix = backend
+    object_name = quote(f"{prefix}/{name}.tfstate", safe="")
+    return f"{os.environ['STORAGE_EMULATOR_HOST']}/storage/v1/b/{bucket}/o/{object_name}"
+
+
+def _fail(message: str):
+    print(f"Error: {message}", file=sys.stderr)
+    return 1
+
+
+def _run(command: str, args: list[str]):
+    targets = [arg[len("-target=") :] for arg in args if arg.startswith("-target=")]
+    addresses = targets or [
+        f"fake_resource.r{i}" for i in range(int(os.environ.get("FAKE_TF_LINES", "1000")))
+    ]
+    lines = len(addresses)
+    time.sleep(float(os.environ.get("FAKE_TF_RESOURCE_SLEEP", "0")) * lines)
+    noise = int(os.environ.get("FAKE_TF_STDERR_BYTES", str(1 << 20)))
+    per_line = -(-noise // max(lines, 1))
+    counts = {"add": 0, "change": 0, "remove": 0}
+    for i, address in enumerate(addresses):
+        action = ACTIONS[i % len(ACTIONS)]
+        counts["add"] += action in ("create", "replace")
+        counts["change"] += action == "update"
+        counts["remove"] += action in ("delete", "replace")
+        change = {
+            "resource": {"addr": address, "resource_type": address.split(".")[-2]},
+            "action": action,
+        }
+        if command == "plan" and i % 10 == 0:
+            drift = {**change, "action": "update"}
+            _emit(_ui(f"{address}: Drift detected (update)", "resource_drift", change=drift))
+        if command == "plan":
+            _emit(_ui(f"{address}: Plan to {action}", "planned_change", change=change))
+        else:
+            _emit(_ui(f"{address}: {action} complete", "apply_complete", hook=change))
+        if noise > 0:
+            sys.stderr.buffer.write(b"x" * (min(per_line, noise) - 1) + b"\n")
+            sys.stderr.buffer.flush()
+            noise -= per_line
+    for arg in args:
+        if arg.startswith("-out="):
+            with open(arg[len("-out=") :], "wb") as f:
+                f.write(b"fake plan\n")
+    _emit(_ui(f"{command} complete", "change_summary", changes={**counts, "operation": command}))
+
+
+def _ui(message: str, type_: str, **fields):
+    return {
+        "@level": "info",
+        "@message": message,
+        "@module": "terraform.ui",
+        "@timestamp": datetime.now(timezone.utc).isoformat(),
+        "type": type_,
+        **fields,
+    }
+
+
+def _emit(line: dict):
+    sys.stdout.write(json.dumps(line) + "\n")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
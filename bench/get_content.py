@@ -0,0 +1,92 @@
+import argparse
+import json
+import time
+
+from fake_github import FakeGitHub
+from harness import MainClient, load_main
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with FakeGitHub() as github:
+        files = _files(args.files)
+        first = github.seed("bench", files)
+        files[_path(0)] = json.dumps(_body(0, "EU"))
+        second = github.seed("bench", files)
+        main = load_main(
+            github.url,
+            ELEMENT_PARSE_WORKERS=str(args.workers),
+            # Keep archives on disk only, so cold reads still unzip.
+            ARCHIVE_CACHE_MEMORY_BYTES="0",
+        )
+        client = MainClient(main.app)
+
+        def get(sha: str, expected: int = args.files, **filters):
+            start = time.perf_counter()
+            r = client.post(
+                "/get_content", json={"repo": "bench", "sha": sha, **filters}
+            )
+            body = r.get_data()
+            elapsed = time.perf_counter() - start
+            assert r.status_code == 200, body
+            assert len(json.loads(body)) == expected
+            return round(elapsed, 3)
+
+        results = {"workers": args.workers, "files": args.files}
+        # Every parse is forced by dropping the element cache between reads;
+        # the archives themselves stay cached after the first download.
+        get(first)
+        get(second)
+        results["uncached"] = min(_uncached(main, get, first) for _ in range(args.rounds))
+        main.elements.__init__(main.elements.max_bytes)
+        get(first)
+        results["same_sha"] = min(get(first) for _ in range(args.rounds))
+        results["one_file_changed"] = get(second)
+        # Only the listed members are decompressed and parsed.
+        main.elements.__init__(main.elements.max_bytes)
+        results["uncached_one_address"] = get(
+            first, expected=1, addresses=[_path(7).removesuffix(".tf.json")]
+        )
+        results["uncached_page_of_100"] = get(
+            first, expected=100, match=["resource.google_storage_bucket.*"], limit=100
+        )
+        results["elements"] = main.elements.stats()
+        client.close()
+    print(json.dumps(results, indent=2))
+
+
+def _uncached(main, get, sha: str):
+    main.elements.__init__(main.elements.max_bytes)
+    return get(sha)
+
+
+def _files(n: int):
+    return {_path(i): json.dumps(_body(i, "US"), indent=2) for i in range(n)}
+
+
+def _path(i: int):
+    return f"resource.google_storage_bucket.bucket_{i}.tf.json"
+
+
+def _body(i: int, location: str):
+    return {
+        "resource": {
+            "google_storage_bucket": {
+                f"bucket_{i}": {
+                    "name": f"bucket-{i}",
+                    "location": location,
+                    "labels": {"team": "platform", "index": str(i)},
+                    "versioning": [{"enabled": True}],
+                }
+            }
+        }
+    }
+
+
+if __name__ == "__main__":
+    main()
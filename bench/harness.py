@@ -0,0 +1,146 @@
+import asyncio
+import ipaddress
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from importlib import import_module
+from tempfile import gettempdir
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def private_key() -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode()
+
+
+def self_signed_cert(directory: str) -> tuple[str, str]:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(minutes=1))
+        .not_valid_after(now + timedelta(days=1))
+        .add_extension(
+            x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+            critical=False,
+        )
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    with open(certfile, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, "wb") as f:
+        f.write(
+            key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.NoEncryption(),
+            )
+        )
+    return certfile, keyfile
+
+
+def github_env(github_url: str, org: str = "blueform") -> dict[str, str]:
+    return {
+        "GITHUB_API_URL": github_url,
+        "GITHUB_ORG": org,
+        "GITHUB_APP_ID": "1",
+        "GITHUB_APP_INSTALLATION_ID": "1",
+        "GITHUB_APP_PRIVATE_KEY": private_key(),
+    }
+
+
+def load_main(github_url: str, **env: str):
+    # main/ and provisioner/ both ship a top-level `app` package, so a
+    # process can only ever import one of them.
+    os.environ.update(github_env(github_url), STATE_BUCKET="bench-state", **env)
+    sys.path.insert(0, os.path.join(ROOT, "main"))
+    return import_module("app")
+
+
+class MainClient:
+    # Synchronous client for main's Quart app. The app runs with its startup
+    # and shutdown hooks on one long-lived event loop in a background thread,
+    # as it does under an ASGI server.
+    def __init__(self, app) -> None:
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self._app = app.test_app()
+        self._run(self._app.startup())
+        self._client = self._app.test_client()
+
+    def get(self, path: str, **kwargs):
+        return self._run(self._request("GET", path, **kwargs))
+
+    def post(self, path: str, **kwargs):
+        return self._run(self._request("POST", path, **kwargs))
+
+    def close(self):
+        self._run(self._app.shutdown())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    async def _request(self, method: str, path: str, **kwargs):
+        r = await self._client.open(path, method=method, **kwargs)
+        return _Response(r.status_code, r.headers, await r.get_data())
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+class _Response:
+    def __init__(self, status_code: int, headers, data: bytes) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+    def get_data(self, as_text=False):
+        return self.data.decode() if as_text else self.data
+
+    @property
+    def json(self):
+        return json.loads(self.data)
+
+
+def load_provisioner(github_url: str, **env: str):
+    # The GCS client only needs an endpoint to be constructed; benchmarks
+    # that touch buckets point STORAGE_EMULATOR_HOST at a real fake.
+    os.environ.setdefault("STORAGE_EMULATOR_HOST", "http://127.0.0.1:9")
+    os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "bench")
+    os.environ.update(
+        github_env(github_url),
+        TMP_DIR=env.pop("TMP_DIR", os.path.join(gettempdir(), "blueform-bench")),
+        TF_EXE=os.path.join(ROOT, "bench", "fake_terraform.py"),
+        PLAN_BUCKET="bench-plans",
+        OUTPUT_SINK="memory",
+        **env,
+    )
+    os.makedirs(os.environ["TMP_DIR"], exist_ok=True)
+    sys.path.insert(0, os.path.join(ROOT, "provisioner"))
+    return import_module("app")
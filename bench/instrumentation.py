@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_gcs import FakeGCS
+from fake_github import FakeGitHub
+from harness import MainClient, load_main, load_provisioner
+
+REQUEST_ID = "bench-request-1"
+
+
+def main():
+    # main/ and provisioner/ can't share a process, or in general a venv
+    # (main's Quart needs a newer Flask than the provisioner pins), so each
+    # service runs in a child of this script under its own interpreter.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--service", choices=["main", "provisioner"])
+    parser.add_argument("--main-python", default=sys.executable)
+    parser.add_argument("--provisioner-python", default=sys.executable)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--spans", type=int, default=200000)
+    args = parser.parse_args()
+    if args.service:
+        results = {"main": _main, "provisioner": _provisioner}[args.service](args)
+        print(json.dumps(results))
+        return
+    results = {}
+    for service in ("main", "provisioner"):
+        for enabled in ("0", "1"):
+            out = subprocess.run(
+                [
+                    getattr(args, f"{service}_python"),
+                    __file__,
+                    "--service",
+                    service,
+                    *sys.argv[1:],
+                ],
+                env={**os.environ, "METRICS": enabled},
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            results[f"{service} metrics={enabled}"] = json.loads(out.splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+def _main(args):
+    with FakeGitHub() as github:
+        files = {
+            f"resource.null_resource.r{i}.tf.json": json.dumps(
+                {"resource": {"null_resource": {f"r{i}": {"triggers": {"i": str(i)}}}}}
+            )
+            for i in range(args.files)
+        }
+        github.seed("bench", files)
+        app = load_main(github.url, ARCHIVE_CACHE_DIR=tempfile.mkdtemp())
+        results = {"span_overhead_ns": _span_overhead(app.metrics, args.spans)}
+        with MainClient(app.app) as client:
+            start = time.perf_counter()
+            r = client.post(
+                "/get_content",
+                json={"repo": "bench", "sha": "main"},
+                headers={"X-Request-ID": REQUEST_ID},
+            )
+            results["get_content_seconds"] = round(time.perf_counter() - start, 3)
+            assert r.status_code == 200 and len(r.json) == args.files
+            assert r.headers["X-Request-ID"] == REQUEST_ID
+            results["server_timing"] = r.headers.get("Server-Timing")
+            r = client.get("/metrics")
+            results["metrics_status"] = r.status_code
+            results["families"] = _families(r.get_data(as_text=True))
+    return results
+
+
+def _provisioner(args):
+    with FakeGitHub() as github, FakeGCS() as gcs, tempfile.TemporaryDirectory() as td:
+        os.environ.update(
+            STORAGE_EMULATOR_HOST=gcs.url, FAKE_TF_LINES="100", FAKE_TF_STDERR_BYTES="0"
+        )
+        app = load_provisioner(github.url, TMP_DIR=td)
+        github.seed("bench", {"main.tf.json": "{}"})
+        results = {"span_overhead_ns": _span_overhead(app.metrics, args.spans)}
+        client = app.app.test_client()
+        r = client.post(
+            "/plan",
+            json={"repo": "bench", "ref": "main", "workspace": "default", "plan_id": "p"},
+            headers={"X-Request-ID": REQUEST_ID},
+        )
+        assert r.headers["X-Request-ID"] == REQUEST_ID
+        results["server_timing"] = r.headers.get("Server-Timing")
+        job = list(app.jobs.wait([r.json["job_id"]]))[0]
+        assert job["status"] == "succeeded", job
+        assert job["request_id"] == REQUEST_ID
+        r = client.get("/metrics")
+        results["metrics_status"] = r.status_code
+        results["families"] = _families(r.get_data(as_text=True))
+    return results
+
+
+def _span_overhead(metrics, n: int):
+    # Per span, over an empty loop; near zero with METRICS unset.
+    start = time.perf_counter()
+    for _ in range(n):
+        pass
+    empty = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n):
+        with metrics.span("bench", kind="overhead"):
+            pass
+    return round((time.perf_counter() - start - empty) / n * 1e9)
+
+
+def _families(text: str):
+    # Observations per histogram, e.g. {"blueform_terraform_seconds": 3}.
+    counts: dict[str, int] = {}
+    for line in text.splitlines():
+        if "_count" in line and not line.startswith("#"):
+            metric, value = line.rsplit(" ", 1)
+            family = metric.split("{")[0].removesuffix("_count")
+            counts[family] = counts.get(family, 0) + int(value)
+    return counts
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from statistics import quantiles
+
+import httpx
+
+from fake_github import FakeGitHub
+from harness import ROOT, github_env
+from set_content import _elements
+
+# Serves main the way it is deployed. Compare against another revision with
+# e.g. --cwd /path/to/old/main --server "gunicorn -w 1 --threads 8 -b 127.0.0.1:{port} app:app"
+SERVER = "hypercorn --workers 1 --bind 127.0.0.1:{port} app:app"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", default=SERVER)
+    parser.add_argument("--cwd", default=os.path.join(ROOT, "main"))
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--elements", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with FakeGitHub(latency=args.latency) as github:
+        sha = github.seed("bench", {})
+        port = _free_port()
+        env = {**os.environ, **github_env(github.url), "STATE_BUCKET": "bench-state"}
+        server = subprocess.Popen(
+            args.server.format(port=port).split(),
+            cwd=args.cwd,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            url = f"http://127.0.0.1:{port}"
+            _wait_for(url)
+            elements = _elements(args.elements)
+            # Seed the repo through the service so both workloads have content.
+            body = {"repo": "bench", "branch": "main", "elements": elements}
+            httpx.post(f"{url}/set_content", json=body, timeout=60).raise_for_status()
+            sha = github.refs["bench"]["main"]
+            workloads = {
+                # Served from main's caches, no GitHub calls once warm.
+                "get_content": ("/get_content", {"repo": "bench", "sha": sha}),
+                # Three GitHub round-trips each, nothing to write.
+                "set_content_unchanged": ("/set_content", body),
+            }
+            results = {"server": args.server, "clients": args.clients}
+            for name, (path, payload) in workloads.items():
+                results[name] = asyncio.run(
+                    _load(url + path, payload, args.clients, args.seconds)
+                )
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=2))
+
+
+async def _load(url: str, payload, clients: int, seconds: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as http:
+
+        async def client():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    r = await http.post(url, json=payload)
+                    r.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    cuts = quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(cuts[49] * 1000, 1),
+        "p99_ms": round(cuts[98] * 1000, 1),
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{url}/stats", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    sys.exit(f"server at {url} did not start")
+
+
+if __name__ == "__main__":
+    main()
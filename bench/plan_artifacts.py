@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from shutil import make_archive
+from zipfile import ZipFile
+
+from fake_gcs import FakeGCS
+from harness import load_provisioner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", type=int, default=50)
+    parser.add_argument("--plan-bytes", type=int, default=8 << 20)
+    parser.add_argument("--part-bytes", type=int, default=1 << 20)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--bandwidth", type=float, default=20 << 20)
+    args = parser.parse_args()
+
+    with FakeGCS(latency=args.latency, bandwidth=args.bandwidth) as gcs, tempfile.TemporaryDirectory() as td:
+        os.environ["STORAGE_EMULATOR_HOST"] = gcs.url
+        app = load_provisioner("http://127.0.0.1:9", ARTIFACT_PART_BYTES=str(args.part_bytes))
+        from app import artifacts
+
+        bucket = app.runs.gcs.bucket("bench-plans")
+        tfdir = os.path.join(td, "tf")
+        _tfdir(tfdir, args)
+        _plan_file(tfdir, args.plan_bytes)
+        results = {}
+
+        # What /plan and /apply used to do: one zip of the whole directory
+        # (providers were deleted first).
+        start = time.perf_counter()
+        archive = make_archive(os.path.join(td, "plan"), "zip", tfdir)
+        bucket.blob("zip").upload_from_filename(archive)
+        uploaded = time.perf_counter()
+        bucket.blob("zip").download_to_filename(archive)
+        with ZipFile(archive) as zf:
+            zf.extractall(os.path.join(td, "unzipped"))
+        results["zip"] = {
+            "bytes": os.path.getsize(archive),
+            "upload_seconds": round(uploaded - start, 3),
+            "download_seconds": round(time.perf_counter() - uploaded, 3),
+        }
+
+        for n in range(2):
+            # The second plan only changes the plan file; everything else is
+            # already in the bucket.
+            if n:
+                _plan_file(tfdir, args.plan_bytes)
+            upload = artifacts.upload(bucket, f"plan-{n}", tfdir, {})
+            download = artifacts.download(
+                bucket.get_blob(f"plan-{n}"), os.path.join(td, f"plan-{n}")
+            )
+            results[f"manifest-{n}"] = {"upload": upload, "download": download}
+    print(json.dumps(results, indent=2))
+
+
+def _tfdir(tfdir: str, args):
+    # Configuration and modules, all compressible text.
+    for m in range(args.modules):
+        path = os.path.join(tfdir, ".terraform", "modules", f"m{m}", "main.tf")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            for r in range(200):
+                f.write(f'resource "null_resource" "r{r}" {{\n  triggers = {{ m = "{m}" }}\n}}\n')
+    with open(os.path.join(tfdir, "main.tf"), "w") as f:
+        for m in range(args.modules):
+            f.write(f'module "m{m}" {{\n  source = "./modules/m{m}"\n}}\n')
+    with open(os.path.join(tfdir, ".terraform.lock.hcl"), "w") as f:
+        f.write('provider "registry.terraform.io/hashicorp/null" {}\n')
+
+
+def _plan_file(tfdir: str, size: int):
+    # Plan files are zip archives already, so they barely compress.
+    with open(os.path.join(tfdir, "tfplan"), "wb") as f:
+        f.write(os.urandom(size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from fake_gcs import FakeGCS
+from fake_github import FakeGitHub
+from harness import load_provisioner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workspaces", type=int, default=12)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--init-seconds", type=float, default=2)
+    parser.add_argument("--plan-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with FakeGitHub(latency=0.05) as github, FakeGCS() as gcs, tempfile.TemporaryDirectory() as td:
+        log = os.path.join(td, "terraform.log")
+        os.environ.update(
+            STORAGE_EMULATOR_HOST=gcs.url,
+            FAKE_TF_INIT_SLEEP=str(args.init_seconds),
+            FAKE_TF_SLEEP=str(args.plan_seconds),
+            FAKE_TF_LINES="10",
+            FAKE_TF_STDERR_BYTES="0",
+            FAKE_TF_LOG=log,
+        )
+        app = load_provisioner(github.url, TMP_DIR=td, JOB_CONCURRENCY=str(args.concurrency))
+        backend = {"terraform": {"backend": {"gcs": {"bucket": "bench-state", "prefix": "bench"}}}}
+        files = {"terraform.backend.gcs.tf.json": json.dumps(backend)}
+        for i in range(100):
+            files[f"null_resource.r{i}.tf.json"] = json.dumps(
+                {"resource": {"null_resource": {f"r{i}": {}}}}
+            )
+        github.seed("bench", files)
+        client = app.app.test_client()
+        results = {}
+        # The first batch after a merge creates the workspaces; the next one
+        # finds them and warm directories.
+        for name in ("first", "second"):
+            open(log, "w").close()
+            github.calls.clear()
+            plans = [
+                {"plan_id": f"{name}-{w}", "repo": "bench", "ref": "main", "workspace": f"ws{w}"}
+                for w in range(args.workspaces)
+            ]
+            start = time.perf_counter()
+            r = client.post("/plan/batch", json={"plans": plans})
+            finished = []
+            for line in r.response:
+                update = json.loads(line)
+                if update["status"] != "queued":
+                    assert update["status"] == "succeeded", update
+                    finished.append(round(time.perf_counter() - start, 2))
+            with open(log) as f:
+                commands = [line.split()[0] for line in f]
+            results[name] = {
+                "seconds": finished[-1],
+                "first_result": finished[0],
+                "zipball_downloads": github.calls["GET zipball"],
+                "inits": commands.count("init"),
+                "processes": len(commands),
+            }
+        results["jobs"] = app.jobs.stats()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
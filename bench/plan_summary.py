@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from fake_gcs import FakeGCS
+from fake_github import FakeGitHub
+from harness import load_provisioner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with FakeGitHub() as github, FakeGCS(latency=0.005) as gcs, tempfile.TemporaryDirectory() as td:
+        os.environ.update(
+            STORAGE_EMULATOR_HOST=gcs.url,
+            FAKE_TF_LINES=str(args.resources),
+            FAKE_TF_STDERR_BYTES="0",
+        )
+        app = load_provisioner(github.url, TMP_DIR=td)
+        github.seed("bench", {"main.tf.json": "{}"})
+        start = time.perf_counter()
+        result = app.runs.plan({"repo": "bench", "ref": "main", "workspace": "default", "plan_id": "p"})
+        results = {"plan_seconds": round(time.perf_counter() - start, 3), "counts": result["summary"]}
+
+        client = app.app.test_client()
+        r = client.get("/plan/p/summary")
+        summary = r.json
+        assert summary["counts"] == result["summary"]
+        assert len(summary["changes"]) == args.resources
+        assert sum(map(len, summary["by_action"].values())) == args.resources
+        results["summary_bytes"] = len(r.data)
+
+        for name, path in (
+            ("full", "/plan/p/summary"),
+            ("deletes only", "/plan/p/summary?action=delete"),
+        ):
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                r = client.get(path)
+                assert r.status_code == 200
+            results[name] = {
+                "ms_per_request": round((time.perf_counter() - start) / args.requests * 1000, 2),
+                "bytes": len(r.data),
+            }
+        etag = r.headers["ETag"]
+        assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+        assert client.get("/plan/missing/summary").status_code == 404
+        results["cache"] = app.summaries.stats()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import json
+import time
+
+from fake_github import FakeGitHub
+from harness import MainClient, load_main
+from set_content import _elements
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--elements", type=int, default=100)
+    parser.add_argument("--fault-rate", type=float, default=0.1)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--rate-limit", type=int, default=200)
+    parser.add_argument("--rate-window", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with FakeGitHub(
+        latency=0.01,
+        fault_rate=args.fault_rate,
+        retry_after=args.retry_after,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+    ) as github:
+        main = load_main(github.url, GITHUB_BACKOFF="0.05")
+        client = MainClient(main.app)
+        results = {}
+        for batch in (False, True):
+            repo = f"bench-{'batch' if batch else 'per-file'}"
+            github.seed(repo, {})
+            github.faults.clear()
+            start = time.perf_counter()
+            r = client.post(
+                "/set_content",
+                json={
+                    "repo": repo,
+                    "branch": "main",
+                    "batch": batch,
+                    "elements": _elements(args.elements),
+                },
+            )
+            elapsed = time.perf_counter() - start
+            assert r.status_code == 200, r.get_data(as_text=True)
+            assert len(github.files(repo)) == args.elements
+            # Every ephemeral branch was cleaned up.
+            assert list(github.refs[repo]) == ["main"], list(github.refs[repo])
+            results["batch" if batch else "per-file"] = {
+                "seconds": round(elapsed, 3),
+                "faults": dict(github.faults),
+                "scheduler": main.scheduler.stats(),
+            }
+        client.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+from harness import load_main
+
+# Values the json module and orjson write differently, or that orjson can't
+# write at all; the serializer must still match the json module byte for byte.
+TRICKY = {
+    "unicode": "zürich-ß-東京",
+    "delete": "a\x7fb",
+    "control": "tab\tnew\nline\x00",
+    "none": None,
+    "nan": math.nan,
+    "inf": [math.inf, -math.inf],
+    "floats": [1e-05, 1e-07, 0.0001, 1.5e-10, 123456789.123, -0.0, 0.1, 1e15],
+    "exponents": [1e16, 1e20, -3e21, 1e22, 1.5e300, 5e-324, 1.2345678901234568e17],
+    "exponent_nested": {"k": [1e17]},
+    "exponent_alone": 1e20,
+    "big": 2**64 + 1,
+    "surrogate": "\ud800",
+    "negative_big": -(2**63) - 1,
+    "empty": [{}, [], ""],
+    "looks_small": "1.00001 e-5",
+    "nested": {"b": [1, {"z": True, "a": False}], "a": "x"},
+}
+
+
+def main():
+    # Each backend runs in a child, since JSON_BACKEND is read at import.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--elements", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(_run(args)))
+        return
+    results = {}
+    for backend in ("json", "orjson"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", *sys.argv[1:]],
+            env={**os.environ, "JSON_BACKEND": backend},
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results[backend] = json.loads(out.splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+def _run(args):
+    serializer = load_main("http://127.0.0.1:9").serializer
+    for value in (TRICKY, *TRICKY.values()):
+        assert serializer.dumps(value) == json.dumps(value, **serializer.COMPACT), value
+        assert serializer.dumps_pretty(value) == json.dumps(value, **serializer.PRETTY), value
+        text = json.dumps(value)
+        assert json.dumps(serializer.loads(text)) == text, value
+
+    elements = [
+        {
+            "resource": {
+                "google_compute_instance": {
+                    f"vm{i}": {
+                        "name": f"vm-{i}",
+                        "machine_type": "e2-small",
+                        "zone": "europe-west1-b",
+                        "labels": {"team": "infra", "index": str(i)},
+                        "boot_disk": [{"initialize_params": [{"size": 20, "image": "debian-12"}]}],
+                        "network_interface": [{"network": "default", "access_config": [{}]}],
+                    }
+                }
+            }
+        }
+        for i in range(args.elements)
+    ]
+    pretty = [serializer.dumps_pretty(e) for e in elements]
+    assert pretty == [json.dumps(e, **serializer.PRETTY) for e in elements]
+    results = {"backend": serializer.BACKEND}
+    for name, fn, inputs in (
+        ("dumps_pretty_ms", serializer.dumps_pretty, elements),
+        ("dumps_ms", serializer.dumps, elements),
+        ("loads_ms", serializer.loads, pretty),
+    ):
+        best = math.inf
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            for value in inputs:
+                fn(value)
+            best = min(best, time.perf_counter() - start)
+        results[name] = round(best * 1000, 1)
+    return results
+
+
+if __name__ == "__main__":
+    main()
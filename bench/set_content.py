@@ -0,0 +1,75 @@
+import argparse
+import json
+import time
+
+from fake_github import FakeGitHub
+from harness import MainClient, load_main
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--elements", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with FakeGitHub(latency=args.latency) as github:
+        app = load_main(github.url).app
+        client = MainClient(app)
+        results = {}
+        for batch in (False, True):
+            repo = f"bench-{'batch' if batch else 'per-file'}"
+            github.seed(repo, {})
+            github.calls.clear()
+            start = time.perf_counter()
+            r = client.post(
+                "/set_content",
+                json={
+                    "repo": repo,
+                    "branch": "main",
+                    "batch": batch,
+                    "elements": _elements(args.elements),
+                },
+            )
+            elapsed = time.perf_counter() - start
+            assert r.status_code == 200, r.get_data(as_text=True)
+            assert len(github.files(repo)) == args.elements
+            results["batch" if batch else "per-file"] = {
+                "calls": sum(github.calls.values()),
+                "seconds": round(elapsed, 3),
+            }
+
+            # Submitting the same elements again should write nothing.
+            github.calls.clear()
+            start = time.perf_counter()
+            r = client.post(
+                "/set_content",
+                json={
+                    "repo": repo,
+                    "branch": "main",
+                    "batch": batch,
+                    "elements": _elements(args.elements),
+                },
+            )
+            elapsed = time.perf_counter() - start
+            assert r.status_code == 200, r.get_data(as_text=True)
+            assert len(r.json["skipped"]) == args.elements
+            results[("batch" if batch else "per-file") + " (unchanged)"] = {
+                "calls": sum(github.calls.values()),
+                "seconds": round(elapsed, 3),
+            }
+        client.close()
+    print(json.dumps(results, indent=2))
+
+
+def _elements(n: int):
+    return [
+        {
+            "address": f"resource.google_storage_bucket.bucket_{i}",
+            "body": {"name": f"bucket-{i}", "location": "US"},
+        }
+        for i in range(n)
+    ]
+
+
+if __name__ == "__main__":
+    main()
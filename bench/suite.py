@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from statistics import quantiles
+
+from fake_gcs import FakeGCS
+from fake_github import FakeGitHub
+from harness import ROOT, MainClient, load_main, load_provisioner
+
+# Runs every scenario against the fakes (fake_github.py, fake_gcs.py,
+# fake_terraform.py as TF_EXE, Terraform output kept in memory instead of
+# Firestore) and writes throughput and latency percentiles to a JSON file:
+#
+#   python suite.py --out before.json
+#   git checkout my-branch
+#   python suite.py --out after.json --compare before.json
+#
+# Each scenario runs in its own process, since main/ and provisioner/ both
+# ship a top-level `app` package and a process can only import one of them.
+# The two services' requirements can't be installed side by side (main's
+# Quart needs a newer Flask than the provisioner pins), so each scenario
+# runs with its service's interpreter:
+#
+#   python suite.py --main-python main-venv/bin/python \
+#       --provisioner-python provisioner-venv/bin/python
+SCENARIOS = {
+    "set_content": "main",
+    "get_content": "main",
+    "plan_apply": "provisioner",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", help="an earlier --out file to compare with")
+    parser.add_argument("--latency", type=float, default=0.01, help="per GitHub/GCS call")
+    parser.add_argument("--rate-limit", type=int, default=5000)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--elements", type=int, default=1000, help="per /set_content")
+    parser.add_argument("--files", type=int, default=10000, help="per /get_content")
+    parser.add_argument("--workspaces", type=int, default=8, help="plans, then applies")
+    parser.add_argument("--main-python", default=sys.executable)
+    parser.add_argument("--provisioner-python", default=sys.executable)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        scenario = {
+            "set_content": _set_content,
+            "get_content": _get_content,
+            "plan_apply": _plan_apply,
+        }[args.scenario[0]]
+        with open(args.child, "w") as f:
+            json.dump(scenario(args), f)
+        return
+
+    results = {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("child", "out", "compare")},
+        "scenarios": {},
+    }
+    for scenario in args.scenario or SCENARIOS:
+        print(f"running {scenario}", file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix=".json") as out:
+            argv = [
+                f"--{k.replace('_', '-')}={v}"
+                for k, v in results["args"].items()
+                if k != "scenario"
+            ]
+            python = getattr(args, f"{SCENARIOS[scenario]}_python")
+            subprocess.run(
+                [python, __file__, *argv, f"--scenario={scenario}", f"--child={out.name}"],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            results["scenarios"][scenario] = json.load(out)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results["scenarios"], indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            _compare(json.load(f), results)
+
+
+def _set_content(args):
+    # Commits of --elements elements, every round changing all of them.
+    with FakeGitHub(
+        latency=args.latency, rate_limit=args.rate_limit, fault_rate=args.fault_rate
+    ) as github:
+        github.seed("bench", {})
+        with MainClient(load_main(github.url).app) as client:
+            latencies = []
+            start = time.perf_counter()
+            for round_ in range(args.rounds):
+                elements = [
+                    {
+                        "address": f"resource.google_storage_bucket.b{i}",
+                        "body": {"name": f"b{i}", "labels": {"round": str(round_)}},
+                    }
+                    for i in range(args.elements)
+                ]
+                began = time.perf_counter()
+                r = client.post(
+                    "/set_content",
+                    json={"repo": "bench", "branch": "main", "batch": True, "elements": elements},
+                )
+                assert r.status_code == 200, r.get_data(as_text=True)
+                assert len(r.json["changed"]) == args.elements
+                latencies.append(time.perf_counter() - began)
+            seconds = time.perf_counter() - start
+    return {
+        **_summary(latencies, seconds),
+        "elements_per_second": round(args.elements * args.rounds / seconds, 1),
+        "github_calls": sum(github.calls.values()),
+    }
+
+
+def _get_content(args):
+    # One cold read of --files files, then --rounds reads per client from
+    # --concurrency clients at once.
+    with FakeGitHub(
+        latency=args.latency, rate_limit=args.rate_limit, fault_rate=args.fault_rate
+    ) as github:
+        files = {
+            f"resource.google_storage_bucket.b{i}.tf.json": json.dumps(
+                {"resource": {"google_storage_bucket": {f"b{i}": {"name": f"b{i}"}}}},
+                indent=2,
+            )
+            for i in range(args.files)
+        }
+        sha = github.seed("bench", files)
+        app = load_main(github.url, ARCHIVE_CACHE_DIR=tempfile.mkdtemp())
+        with MainClient(app.app) as client:
+
+            def get():
+                began = time.perf_counter()
+                r = client.post("/get_content", json={"repo": "bench", "sha": sha})
+                assert r.status_code == 200 and len(r.json) == args.files
+                return time.perf_counter() - began
+
+            cold = get()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                latencies = list(
+                    pool.map(lambda _: get(), range(args.rounds * args.concurrency))
+                )
+            seconds = time.perf_counter() - start
+    return {
+        **_summary(latencies, seconds),
+        "cold_ms": round(cold * 1000, 1),
+        "github_calls": sum(github.calls.values()),
+    }
+
+
+def _plan_apply(args):
+    # --workspaces plans submitted at once, then an apply of each, on
+    # --concurrency job workers. Latency is submission to finish.
+    with FakeGitHub(
+        latency=args.latency, rate_limit=args.rate_limit, fault_rate=args.fault_rate
+    ) as github, FakeGCS(latency=args.latency) as gcs, tempfile.TemporaryDirectory() as td:
+        os.environ.update(
+            STORAGE_EMULATOR_HOST=gcs.url,
+            FAKE_TF_SLEEP="0.2",
+            FAKE_TF_INIT_SLEEP="0.5",
+            FAKE_TF_LINES="200",
+            FAKE_TF_STDERR_BYTES="0",
+        )
+        app = load_provisioner(github.url, TMP_DIR=td, JOB_CONCURRENCY=str(args.concurrency))
+        files = {
+            f"resource.null_resource.r{i}.tf.json": json.dumps(
+                {"resource": {"null_resource": {f"r{i}": {}}}}
+            )
+            for i in range(100)
+        }
+        github.seed("bench", files)
+        results = {}
+        for phase in ("plan", "apply"):
+            requests = [
+                {"plan_id": f"p{w}", "repo": "bench", "ref": "main", "workspace": f"ws{w}"}
+                if phase == "plan"
+                else {"plan_id": f"p{w}"}
+                for w in range(args.workspaces)
+            ]
+            start = time.perf_counter()
+
+            def submit(request):
+                r = app.app.test_client().post(f"/{phase}", json=request)
+                assert r.status_code == 202, r.get_data(as_text=True)
+                return r.json["job_id"], time.perf_counter()
+
+            with ThreadPoolExecutor(args.workspaces) as pool:
+                submitted = dict(pool.map(submit, requests))
+            latencies = []
+            errors = 0
+            for job in app.jobs.wait(list(submitted)):
+                latencies.append(time.perf_counter() - submitted[job["id"]])
+                errors += job["status"] != "succeeded"
+            results[phase] = _summary(latencies, time.perf_counter() - start, errors)
+        results["github_calls"] = sum(github.calls.values())
+        results["gcs_calls"] = sum(gcs.calls.values())
+    return results
+
+
+def _summary(latencies: list[float], seconds: float, errors: int = 0):
+    cuts = quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 2),
+        "p50_ms": round(cuts[49] * 1000, 1),
+        "p90_ms": round(cuts[89] * 1000, 1),
+        "p99_ms": round(cuts[98] * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1),
+    }
+
+
+def _compare(before: dict, after: dict):
+    # Percent change of every figure both runs have; for latencies lower is
+    # better, for throughput higher.
+    print(f"\n{before['commit'][:10]} -> {after['commit'][:10]}")
+    for name, new in after["scenarios"].items():
+        old = before["scenarios"].get(name)
+        if old is not None:
+            _compare_figures(name, old, new)
+
+
+def _compare_figures(prefix: str, old: dict, new: dict):
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            _compare_figures(f"{prefix}.{key}", old[key], value)
+        elif key.endswith("_ms") or key == "throughput":
+            before = old.get(key)
+            change = f"{(value - before) / before:+.1%}" if before else "n/a"
+            print(f"  {prefix}.{key:<12} {before!s:>10} -> {value!s:>10}  {change}")
+
+
+def _git(*args: str):
+    return subprocess.run(
+        ["git", *args], cwd=ROOT, capture_output=True, text=True
+    ).stdout.strip()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from fake_gcs import FakeGCS
+from fake_github import FakeGitHub
+from harness import load_provisioner
+
+
+def configuration(resources: int, changed: set[int] = set(), networks=False):
+    # One element per file, as main writes it: a chain of networks each
+    # instance references, plus a shared variable only some of them use.
+    files = {"variable.region.tf.json": json.dumps({"variable": {"region": {}}})}
+    for i in range(resources):
+        network = {"name": f"net-{i}", "mtu": 1500 if networks and i in changed else 1460}
+        instance = {
+            "network": f"${{google_compute_network.n{i}.id}}",
+            "zone": "${var.region}" if i % 100 == 0 else "europe-west1-b",
+            "generation": 2 if i in changed else 1,
+        }
+        files[f"resource.google_compute_network.n{i}.tf.json"] = json.dumps(
+            {"resource": {"google_compute_network": {f"n{i}": network}}}
+        )
+        files[f"resource.google_compute_instance.i{i}.tf.json"] = json.dumps(
+            {"resource": {"google_compute_instance": {f"i{i}": instance}}}
+        )
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=1000)
+    parser.add_argument("--resource-sleep", type=float, default=0.002)
+    args = parser.parse_args()
+
+    with FakeGitHub() as github, FakeGCS() as gcs, tempfile.TemporaryDirectory() as td:
+        os.environ.update(
+            STORAGE_EMULATOR_HOST=gcs.url,
+            FAKE_TF_LINES=str(args.resources * 2),
+            FAKE_TF_STDERR_BYTES="0",
+            FAKE_TF_RESOURCE_SLEEP=str(args.resource_sleep),
+        )
+        app = load_provisioner(github.url, TMP_DIR=td)
+        base = configuration(args.resources)
+        github.seed("bench", base, branch="base")
+        cases = {
+            "three instances": configuration(args.resources, {1, 2, 3}),
+            "shared variable": {**base, "variable.region.tf.json": json.dumps({"variable": {"region": {"default": "x"}}})},
+            "provider": {**base, "provider.google.tf.json": json.dumps({"provider": {"google": {}}})},
+            "everything": configuration(args.resources, set(range(args.resources)), networks=True),
+        }
+        results = {}
+        for i, (name, files) in enumerate([("full", base), *cases.items()]):
+            github.seed("bench", files, branch=f"head{i}")
+            request = {"repo": "bench", "ref": f"head{i}", "workspace": "default", "plan_id": f"p{i}"}
+            if name != "full":
+                request["base_ref"] = "base"
+            start = time.perf_counter()
+            result = app.runs.plan(request)
+            scope = result["scope"]
+            seconds = time.perf_counter() - start
+            results[name] = {
+                "seconds": round(seconds, 3),
+                # What's left once the plan's artifact is stored.
+                "plan_seconds": round(seconds - result["artifact"]["seconds"], 3),
+                "partial": scope["partial"],
+                "targets": len(scope["targets"] or []),
+                "reason": scope["reason"],
+                "planned": sum(result["summary"][k] for k in ("add", "change", "remove")),
+            }
+        assert results["three instances"]["partial"] and results["three instances"]["targets"] == 3
+        assert results["shared variable"]["partial"]
+        assert not results["provider"]["partial"] and not results["everything"]["partial"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
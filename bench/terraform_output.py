@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from harness import load_provisioner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--stderr-bytes", type=int, default=4 << 20)
+    parser.add_argument("--timeout", type=float, default=2)
+    args = parser.parse_args()
+
+    load_provisioner("http://127.0.0.1:9", TF_RUN_TIMEOUT=str(args.timeout), TF_TERMINATE_GRACE="1")
+    from app.sinks import MemorySink
+    from app.terraform import Terraform, TerraformTimeout
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cwd:
+        # Enough stderr to fill the pipe many times over while stdout is
+        # still open; a runner that reads the pipes one after the other hangs.
+        os.environ.update(
+            FAKE_TF_LINES=str(args.lines), FAKE_TF_STDERR_BYTES=str(args.stderr_bytes)
+        )
+        sink = MemorySink()
+        start = time.perf_counter()
+        Terraform(cwd, sink=sink).plan()
+        output = sink.runs[0]["output"]
+        assert [o["seq"] for o in output] == list(range(len(output)))
+        results["flood"] = {
+            "seconds": round(time.perf_counter() - start, 3),
+            "stdout_lines": sum(o["stream"] == "stdout" for o in output),
+            "stderr_lines": sum(o["stream"] == "stderr" for o in output),
+        }
+
+        # A command that outlives TF_RUN_TIMEOUT is terminated, not waited on.
+        os.environ.update(FAKE_TF_SLEEP="60")
+        start = time.perf_counter()
+        try:
+            Terraform(cwd, sink=MemorySink()).plan()
+            raise AssertionError("expected a timeout")
+        except TerraformTimeout as e:
+            results["timeout"] = {
+                "seconds": round(time.perf_counter() - start, 3),
+                "error": str(e),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
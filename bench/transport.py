@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from statistics import median
+from tempfile import TemporaryDirectory
+
+from fake_github import FakeGitHub
+from harness import load_main, self_signed_cert
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as td:
+        certfile, keyfile = self_signed_cert(td)
+        # Trusted by both httpx and requests (token exchange).
+        os.environ["SSL_CERT_FILE"] = certfile
+        os.environ["REQUESTS_CA_BUNDLE"] = certfile
+        with FakeGitHub(tls=(certfile, keyfile)) as github:
+            github.seed("bench", {})
+            gh = load_main(github.url, GITHUB_HTTP2="0").github
+            results = asyncio.run(_run(gh, args.calls, args.concurrency))
+    print(json.dumps(results, indent=2))
+
+
+async def _run(gh, calls: int, concurrency: int):
+    async def fresh():
+        # What GitHubClient._request used to do: a new pool per call.
+        async with gh.GitHubClient() as client:
+            await client.get_branch(repo="bench", name="main")
+
+    async with gh.GitHubClient() as pooled:
+        async def shared():
+            await pooled.get_branch(repo="bench", name="main")
+
+        await shared()
+        return {
+            "fresh": await _measure(fresh, calls, concurrency),
+            "pooled": await _measure(shared, calls, concurrency),
+        }
+
+
+async def _measure(call, calls: int, concurrency: int):
+    latencies = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def timed():
+        async with limit:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed() for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "p50_ms": round(median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "calls_per_second": round(calls / elapsed, 1),
+    }
+
+
+if __name__ == "__main__":
+    main()
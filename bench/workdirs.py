@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from fake_gcs import FakeGCS
+from fake_github import FakeGitHub
+from harness import load_provisioner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=200)
+    parser.add_argument("--init-seconds", type=float, default=2)
+    args = parser.parse_args()
+
+    with FakeGitHub() as github, FakeGCS() as gcs, tempfile.TemporaryDirectory() as td:
+        log = os.path.join(td, "terraform.log")
+        os.environ.update(
+            STORAGE_EMULATOR_HOST=gcs.url,
+            FAKE_TF_INIT_SLEEP=str(args.init_seconds),
+            FAKE_TF_LINES="10",
+            FAKE_TF_STDERR_BYTES="0",
+            FAKE_TF_LOG=log,
+        )
+        app = load_provisioner(github.url, TMP_DIR=td)
+        files = {
+            f"null_resource.r{i}.tf.json": _resource(i, "v1") for i in range(args.resources)
+        }
+        steps = [
+            ("cold", files),
+            ("same commit", files),
+            ("one resource changed", {**files, "null_resource.r0.tf.json": _resource(0, "v2")}),
+            ("module added", {**files, "module.m.tf.json": json.dumps({"module": {"m": {"source": "./m"}}})}),
+        ]
+        results = {}
+        for n, (name, step_files) in enumerate(steps):
+            github.seed("bench", step_files)
+            start = time.perf_counter()
+            result = app.runs.plan({"repo": "bench", "ref": "main", "workspace": "dev", "plan_id": f"p{n}"})
+            results[name] = {
+                "seconds": round(time.perf_counter() - start, 3),
+                "warm": result["warm"],
+                "init_seconds": round(result["init_seconds"], 3),
+            }
+
+        # A failed run must not leave its directory behind for the next one.
+        os.environ["FAKE_TF_EXIT"] = "1"
+        try:
+            app.runs.plan({"repo": "bench", "ref": "main", "workspace": "dev", "plan_id": "failed"})
+        except Exception:
+            pass
+        del os.environ["FAKE_TF_EXIT"]
+        result = app.runs.plan({"repo": "bench", "ref": "main", "workspace": "dev", "plan_id": "after"})
+        results["after failure"] = {"warm": result["warm"]}
+
+        with open(log) as f:
+            results["inits"] = sum(line.startswith("init") for line in f)
+        results["workdirs"] = app.runs.workdirs.stats()
+    print(json.dumps(results, indent=2))
+
+
+def _resource(i: int, version: str):
+    return json.dumps({"resource": {"null_resource": {f"r{i}": {"triggers": {"v": version}}}}})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import json
+import os
+import tempfile
+
+from fake_gcs import FakeGCS
+from fake_github import FakeGitHub
+from harness import load_provisioner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with FakeGitHub() as github, FakeGCS() as gcs, tempfile.TemporaryDirectory() as td:
+        log = os.path.join(td, "terraform.log")
+        os.environ.update(
+            STORAGE_EMULATOR_HOST=gcs.url,
+            FAKE_TF_LINES="10",
+            FAKE_TF_STDERR_BYTES="0",
+            FAKE_TF_LOG=log,
+        )
+        app = load_provisioner(github.url, TMP_DIR=td)
+        backend = {"terraform": {"backend": {"gcs": {"bucket": "bench-state", "prefix": "bench"}}}}
+        github.seed("bench", {"terraform.backend.gcs.tf.json": json.dumps(backend)})
+
+        def commands(run):
+            open(log, "w").close()
+            run()
+            with open(log) as f:
+                return [line.split()[0] if line.startswith("init") else " ".join(line.split()[:2]) for line in f]
+
+        def plan(n):
+            # Cold directories, so every run has to init.
+            app.runs.workdirs.max_age = 0
+            app.runs.workdirs.evict()
+            app.runs.plan({"repo": "bench", "ref": "main", "workspace": "dev", "plan_id": f"p{n}"})
+
+        results = {"new workspace": commands(lambda: plan(0))}
+        results["existing workspace"] = [commands(lambda: plan(n)) for n in range(1, args.runs)]
+        results["apply"] = commands(lambda: app.runs.apply({"plan_id": "p1"}))
+        # Every run is cold, and one init each is all it takes.
+        for run in [results["new workspace"], *results["existing workspace"], results["apply"]]:
+            assert run.count("init") == 1, run
+        results["state objects"] = gcs.names("bench-state")
+        results["workspaces"] = app.runs.workspace_cache().stats()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,100 @@
 import os
 import json
+import asyncio
 from asyncio import TaskGroup
-from io import BytesIO
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from fnmatch import fnmatchcase
+from hashlib import sha256
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
-from typing import Any
+from typing import Any, AsyncIterator, BinaryIO
 from uuid import uuid4
 
-from flask import Flask, jsonify, request
+from quart import Quart, Response, jsonify, request
 from httpx import HTTPStatusError
 
-from . import model
-from .model import from_json
-from .github import GitHubClient
-from .env import STATE_BUCKET
+from . import metrics, model, serializer
+from .model import ValidationError, from_json
+from .github import GitHubClient, blob_sha, etags, scheduler, tokens
+from .cache import ArchiveCache
+from .elements import ElementCache, IndexEntry
+from .metrics import span
+from .env import (
+    STATE_BUCKET,
+    ARCHIVE_CACHE_DIR,
+    ARCHIVE_CACHE_MEMORY_BYTES,
+    ARCHIVE_CACHE_DISK_BYTES,
+    ELEMENT_CACHE_BYTES,
+    ELEMENT_PARSE_WORKERS,
+    METRICS,
+)
 
-app = Flask(__name__)
+# Members per parser task; small enough to keep the first bytes of a
+# response quick, large enough that pool overhead doesn't dominate.
+ELEMENT_PARSE_CHUNK = 64
+STREAM_CHUNK_BYTES = 64 << 10
+
+app = Quart(__name__)
+app.json = serializer.JSONProvider(app)
+# Flask's default; Quart's is 16MiB, which large /set_content batches exceed.
+app.config["MAX_CONTENT_LENGTH"] = None
+# Created at startup, on the server's event loop, and shared by all requests
+# so they share its connection pool.
+gh: GitHubClient | None = None
+archives = ArchiveCache(
+    ARCHIVE_CACHE_DIR,
+    max_memory_bytes=ARCHIVE_CACHE_MEMORY_BYTES,
+    max_disk_bytes=ARCHIVE_CACHE_DISK_BYTES,
+)
+elements = ElementCache(ELEMENT_CACHE_BYTES)
+# Members are decompressed, hashed and parsed here; zlib and hashlib release
+# the GIL, so this overlaps with streaming the response.
+parser = ThreadPoolExecutor(ELEMENT_PARSE_WORKERS, thread_name_prefix="element")
+
+
+@app.before_serving
+async def startup():
+    global gh
+    gh = GitHubClient()
+
+
+@app.after_serving
+async def shutdown():
+    await gh.aclose()
+
+
+@app.before_request
+async def start_request():
+    metrics.begin(request.headers.get("X-Request-ID"))
+
+
+@app.after_request
+async def finish_request(response: Response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    response.headers.update(
+        metrics.finish(request.method, route, response.status_code)
+    )
+    return response
 
 
 @app.route("/create_repo", methods=["POST"])
 async def create_repo():
-    req = from_json(model.CreateRepoRequest, request.json)
-    gh = GitHubClient()
+    req = from_json(model.CreateRepoRequest, await request.get_json())
     await gh.create_repo(req.name)
     await gh.set_content(
         repo=req.name,
         branch="main",
         path="terraform.backend.gcs.tf.json",
-        content=json.dumps(
+        content=serializer.dumps_pretty(
             {
                 "terraform": {
                     "backend": {
                         "gcs": {"bucket": STATE_BUCKET, "prefix": req.name}
                     }
                 }
-            },
-            indent=2,
-            sort_keys=True,
+            }
         ),
     )
     return jsonify(message=f"Created repo '{req.name}'"), 201
@@ -43,31 +102,257 @@ async def create_repo():
 
 @app.route("/get_content", methods=["POST"])
 async def get_content():
-    req = from_json(model.GetRepoRequest, request.json)
-    gh = GitHubClient()
-    r = await gh.get_repo_zip(req.repo, req.sha)
-    with ZipFile(BytesIO(r.content)) as zf:
-        elements = [
-            _element(member.filename, zf.read(member))
-            for member in zf.infolist()
-            if not member.is_dir()
-        ]
-    return jsonify(elements), 200
+    req = from_json(model.GetRepoRequest, await request.get_json())
+    _check_selection(req)
+    mimetype = request.accept_mimetypes.best_match(
+        ["application/json", "application/x-ndjson"], default="application/json"
+    )
+    # Free for commit SHAs, and a conditional request for refs.
+    sha = await gh.resolve_ref(req.repo, req.sha)
+    etag = _content_etag(req, sha, mimetype)
+    if request.if_none_match.contains(etag):
+        response = Response("", status=304)
+        response.set_etag(etag)
+        return response
+    index = elements.index(req.repo, sha)
+    if index is None:
+        with await _open_archive(gh, req.repo, sha) as archive:
+            index = await asyncio.to_thread(_address_index, archive)
+        elements.put_index(req.repo, sha, index)
+    page, cursor = _page(req, index)
+    encoded = elements.cached(page)
+    if encoded is None:
+        encoded = _encode_elements(req.repo, sha, page)
+    else:
+        encoded = _iterate(encoded)
+    ndjson = mimetype == "application/x-ndjson"
+    response = Response(_stream_elements(encoded, ndjson), mimetype=mimetype)
+    response.set_etag(etag)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return response, 200
 
 
 @app.route("/set_content", methods=["POST"])
 async def set_content():
-    req = from_json(model.SetContentRequest, request.json)
-    gh = GitHubClient()
+    req = from_json(model.SetContentRequest, await request.get_json())
+    if req.batch:
+        changed, skipped = await _commit_elements(gh, req)
+    else:
+        changed, skipped = await _set_elements(gh, req)
+    return (
+        jsonify(
+            message="Successfully set content",
+            changed=[_path_address(path) for path in changed],
+            skipped=[_path_address(path) for path in skipped],
+        ),
+        200,
+    )
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return (
+        jsonify(
+            token=tokens.stats(),
+            github=scheduler.stats(),
+            etags=etags.stats(),
+            archives=archives.stats(),
+            elements=elements.stats(),
+        ),
+        200,
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    if not METRICS:
+        return jsonify(message="Metrics are disabled"), 404
+    return Response(metrics.histograms.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.errorhandler(ValidationError)
+def handle_validation_error(e: ValidationError):
+    return jsonify(error=e.error), 400
+
+
+@app.errorhandler(HTTPStatusError)
+def handle_http_error(e: HTTPStatusError):
+    return (
+        jsonify(
+            message="HTTP Error",
+            response=e.response.content.decode(),
+            status=e.response.status_code,
+        ),
+        500,
+    )
+
+
+async def _open_archive(gh: GitHubClient, repo: str, sha: str) -> BinaryIO:
+    async def fetch(f: BinaryIO):
+        await gh.download_repo_zip(repo, sha, f)
+
+    return await archives.open(f"{repo}@{sha}", fetch)
+
+
+async def _stream_elements(encoded: AsyncIterator[str], ndjson: bool):
+    # Elements are sent in chunks of about STREAM_CHUNK_BYTES rather than one
+    # write each.
+    buffer = [] if ndjson else ["["]
+    size = 0
+    first = True
+    async for element in encoded:
+        if ndjson:
+            buffer.append(element + "\n")
+        else:
+            buffer.append(element if first else "," + element)
+        first = False
+        size += len(element)
+        if size >= STREAM_CHUNK_BYTES:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if not ndjson:
+        buffer.append("]")
+    if buffer:
+        yield "".join(buffer)
+
+
+def _content_etag(req: model.GetRepoRequest, sha: str, mimetype: str):
+    # A commit's content never changes, so the response is fully determined
+    # by the resolved sha and the request's selection and format.
+    identity = [req.repo, sha, req.addresses, req.match, req.limit, req.cursor, mimetype]
+    return sha256(json.dumps(identity).encode()).hexdigest()
+
+
+def _address_index(archive: BinaryIO):
+    # Only the archive's central directory is read; nothing is decompressed.
+    archive.seek(0)
+    with span("zip_index"), ZipFile(archive) as zf:
+        return [
+            IndexEntry(_member_address(m.filename), m.filename)
+            for m in zf.infolist()
+            if not m.is_dir()
+        ]
+
+
+def _check_selection(req: model.GetRepoRequest):
+    # Before anything is fetched for the request.
+    for name in ("addresses", "match"):
+        value = getattr(req, name)
+        if value is not None and not (
+            isinstance(value, list) and all(isinstance(v, str) for v in value)
+        ):
+            # A string would be taken a character at a time, and a lone "*"
+            # matches everything.
+            raise ValidationError(f"{name} must be a list of strings")
+    if req.limit is not None and type(req.limit) is not int:
+        raise ValidationError("limit must be an integer")
+    if req.limit is not None and req.limit < 1:
+        raise ValidationError("limit must be at least 1")
+    if req.cursor is not None and not isinstance(req.cursor, str):
+        raise ValidationError("cursor must be a string")
+
+
+def _page(req: model.GetRepoRequest, index: list[IndexEntry]):
+    # Index entries selected by the request's filters, starting after its
+    # cursor, and the cursor for the next page if there is one. Cursors are
+    # the last address returned, and index order is fixed per commit.
+    entries = index
+    if req.addresses is not None:
+        addresses = set(req.addresses)
+        entries = [e for e in entries if e.address in addresses]
+    if req.match is not None:
+        entries = [
+            e for e in entries if any(fnmatchcase(e.address, p) for p in req.match)
+        ]
+    start = 0
+    if req.cursor:
+        try:
+            after = urlsafe_b64decode(req.cursor.encode()).decode()
+        except (Base64Error, UnicodeDecodeError):
+            raise ValidationError(f"Invalid cursor: {req.cursor}")
+        positions = [i for i, e in enumerate(entries) if e.address == after]
+        if not positions:
+            raise ValidationError(f"Invalid cursor: {req.cursor}")
+        start = positions[0] + 1
+    if req.limit is None:
+        return entries[start:], None
+    page = entries[start : start + req.limit]
+    if start + req.limit >= len(entries) or not page:
+        return page, None
+    return page, urlsafe_b64encode(page[-1].address.encode()).decode()
+
+
+async def _encode_elements(repo: str, sha: str, entries: list[IndexEntry]):
+    # Members go to the parser pool in chunks, a bounded window ahead of the
+    # response, and come back in order, so memory stays flat however large
+    # the repo is and the event loop never decompresses or parses. The
+    # archive is opened here, not by the handler, so nothing is left open
+    # when the response fails or is never streamed.
+    loop = asyncio.get_running_loop()
+    with await _open_archive(gh, repo, sha) as archive:
+        zf = await asyncio.to_thread(ZipFile, archive)
+        with zf:
+            chunks = (
+                entries[i : i + ELEMENT_PARSE_CHUNK]
+                for i in range(0, len(entries), ELEMENT_PARSE_CHUNK)
+            )
+            pending = deque()
+            for chunk in chunks:
+                pending.append(loop.run_in_executor(parser, _encode_members, zf, chunk))
+                if len(pending) > ELEMENT_PARSE_WORKERS * 2:
+                    for element in await pending.popleft():
+                        yield element
+            while pending:
+                for element in await pending.popleft():
+                    yield element
+
+
+async def _iterate(encoded: list[str]):
+    for element in encoded:
+        yield element
+
+
+def _encode_members(zf: ZipFile, entries: list[IndexEntry]):
+    with span("element_encode"):
+        return [_encode_member(zf, entry) for entry in entries]
+
+
+def _encode_member(zf: ZipFile, entry: IndexEntry):
+    content = zf.read(entry.member)
+    # Recorded on the shared index entry, so the next read of this commit
+    # can find the element without the archive.
+    entry.blob = blob_sha(content)
+    element = elements.get(entry.path, entry.blob)
+    if element is None:
+        element = serializer.dumps(_element(entry.member, content))
+        elements.put(entry.path, entry.blob, element)
+    return element
+
+
+async def _commit_elements(gh: GitHubClient, req: model.SetContentRequest):
+    files = _element_files(req.elements)
+    if not files:
+        return [], []
+    result = await gh.commit_files(
+        repo=req.repo,
+        branch=req.branch,
+        files=files,
+        message=f"set {len(files)} elements",
+    )
+    return result["changed"], result["skipped"]
+
+
+async def _set_elements(gh: GitHubClient, req: model.SetContentRequest):
     branch = await gh.get_branch(repo=req.repo, name=req.branch)
     sha = branch.json()["object"]["sha"]
+    commit = await gh.get_commit(repo=req.repo, sha=sha)
+    changed, skipped = await gh.changed_files(
+        req.repo, commit.json()["tree"]["sha"], _element_files(req.elements)
+    )
     async with TaskGroup() as tg:
-        for element in req.elements:
-            address = element["address"]
-            path = address + ".tf.json"
-            body = element.get("body")
-            if body is not None:
-                content = _file_content(address, body)
+        for path, content in changed.items():
+            if content is not None:
                 tg.create_task(
                     _set_content_safe(
                         gh,
@@ -88,19 +373,20 @@ async def set_content():
                         path=path
                     )
                 )
-    return jsonify(message="Successfully set content"), 200
+    return list(changed), skipped
 
 
-@app.errorhandler(HTTPStatusError)
-def handle_http_error(e: HTTPStatusError):
-    return (
-        jsonify(
-            message="HTTP Error",
-            response=e.response.content.decode(),
-            status=e.response.status_code,
-        ),
-        500,
-    )
+def _element_files(elements: list[dict[str, Any]]):
+    # Path -> rendered file, or None for elements to delete.
+    files = {}
+    with span("element_render"):
+        for element in elements:
+            address = element["address"]
+            body = element.get("body")
+            files[address + ".tf.json"] = (
+                _file_content(address, body) if body is not None else None
+            )
+    return files
 
 
 async def _set_content_safe(
@@ -108,24 +394,37 @@ async def _set_content_safe(
 ):
     ephemeral = uuid4().hex
     await gh.create_branch(repo=repo, name=ephemeral, sha=sha)
-    await gh.set_content(repo=repo, path=path, branch=ephemeral, content=content)
-    await gh.merge_branch(repo=repo, head=ephemeral, base=base)
-    await gh.delete_branch(repo=repo, name=ephemeral)
+    try:
+        await gh.set_content(repo=repo, path=path, branch=ephemeral, content=content)
+        await gh.merge_branch(repo=repo, head=ephemeral, base=base)
+    finally:
+        await _delete_branch_quietly(gh, repo=repo, name=ephemeral)
 
 async def _delete_content_safe(
         gh: GitHubClient, repo: str, base: str, sha: str, path: str
 ):
     ephemeral = uuid4().hex
     await gh.create_branch(repo=repo, name=ephemeral, sha=sha)
-    await gh.delete_content(repo=repo, path=path, branch=ephemeral)
-    await gh.merge_branch(repo=repo, head=ephemeral, base=base)
-    await gh.delete_branch(repo=repo, name=ephemeral)
+    try:
+        await gh.delete_content(repo=repo, path=path, branch=ephemeral)
+        await gh.merge_branch(repo=repo, head=ephemeral, base=base)
+    finally:
+        await _delete_branch_quietly(gh, repo=repo, name=ephemeral)
+
+
+async def _delete_branch_quietly(gh: GitHubClient, repo: str, name: str):
+    # Runs while another error may be propagating (including the task being
+    # cancelled because a sibling failed), so it must not replace it.
+    try:
+        await asyncio.shield(gh.delete_branch(repo=repo, name=name))
+    except Exception as e:
+        print(f"Failed to delete branch {name} in {repo}: {e}")
 
 
 def _element(filename: str, content: bytes):
-    address = os.path.basename(filename).replace(".tf.json", "")
+    address = _member_address(filename)
     keys = _address_keys(address)
-    body = json.loads(content)
+    body = serializer.loads(content)
     for key in keys:
         body = body[key]
     return {"address": address, "body": body}
@@ -142,7 +441,15 @@ def _file_content(address: str, body: Any):
         else:
             child[key] = {}
             child = child[key]
-    return json.dumps(content, indent=2, sort_keys=True)
+    return serializer.dumps_pretty(content)
+
+
+def _member_address(filename: str):
+    return os.path.basename(filename).replace(".tf.json", "")
+
+
+def _path_address(path: str):
+    return path.removesuffix(".tf.json")
 
 
 def _address_keys(address: str):
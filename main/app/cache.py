@@ -0,0 +1,182 @@
+import asyncio
+import os
+import re
+from hashlib import sha256
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from typing import Awaitable, BinaryIO, Callable
+
+_HASH = re.compile(r"[0-9a-f]{64}")
+
+
+class ArchiveCache:
+    # Zipballs keyed by "{repo}@{commit sha}". The content behind a commit
+    # never changes, so entries are never invalidated, only evicted: a small
+    # in-memory LRU in front of a larger on-disk LRU, both bounded in bytes.
+    # Concurrent misses for the same key share a single fetch, which streams
+    # straight into the cache directory so archives are never held in memory
+    # unless they fit the memory tier.
+    def __init__(
+        self, directory: str, max_memory_bytes: int, max_disk_bytes: int
+    ) -> None:
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._inflight: dict[str, Future] = {}
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    async def open(
+        self, key: str, fetch: Callable[[BinaryIO], Awaitable[None]]
+    ) -> BinaryIO:
+        # Entries are kept by a hash of their key, since keys hold the repo
+        # name the caller sent and must not decide where files are written.
+        name = sha256(key.encode()).hexdigest()
+        waited = False
+        while True:
+            with self._lock:
+                found = self._lookup(name, count=not waited)
+                if found is None:
+                    future = self._inflight.get(name)
+                    leader = future is None
+                    if leader:
+                        future = self._inflight[name] = Future()
+                        self.misses += 1
+                    else:
+                        self.coalesced += 1
+            if isinstance(found, bytes):
+                return BytesIO(found)
+            if found is not None:
+                # On disk; read off the event loop. Gone if something removed
+                # the file meanwhile, in which case it's fetched again.
+                f = await asyncio.to_thread(self._open, name)
+                if f is not None:
+                    return f
+                continue
+            if not leader:
+                # Look the entry up again once the leader has stored it.
+                # Shielded: a follower going away mustn't cancel the future
+                # the others wait on.
+                await asyncio.shield(asyncio.wrap_future(future))
+                waited = True
+                continue
+            tmp = f"{self._path(name)}.{os.getpid()}.{id(future)}.tmp"
+            try:
+                with open(tmp, "wb") as f:
+                    await fetch(f)
+                with self._lock:
+                    self._store(name, tmp)
+                    del self._inflight[name]
+            except BaseException as e:
+                with self._lock:
+                    self._inflight.pop(name, None)
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    # The leader was cancelled (its client went away), which
+                    # says nothing about the download: followers look again
+                    # and one of them fetches it instead.
+                    future.set_result(None)
+                raise
+            future.set_result(None)
+            waited = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "entries": len(self._disk),
+            }
+
+    def _lookup(self, name: str, count=True) -> bytes | str | None:
+        # The entry's contents if it's in memory, its path if it's on disk.
+        if name in self._memory:
+            self._memory.move_to_end(name)
+            self.hits += count
+            return self._memory[name]
+        if name in self._disk:
+            self._disk.move_to_end(name)
+            self.disk_hits += count
+            return self._path(name)
+        return None
+
+    def _open(self, name: str) -> BinaryIO | None:
+        path = self._path(name)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            with self._lock:
+                if name in self._disk:
+                    self._disk_bytes -= self._disk.pop(name)
+            return None
+        os.utime(path)
+        if os.fstat(f.fileno()).st_size <= self.max_memory_bytes:
+            data = f.read()
+            f.seek(0)
+            with self._lock:
+                if name not in self._memory:
+                    self._remember(name, data)
+        return f
+
+    def _store(self, name: str, tmp: str):
+        os.replace(tmp, self._path(name))
+        size = os.path.getsize(self._path(name))
+        if name not in self._disk:
+            self._disk[name] = size
+            self._disk_bytes += size
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            evicted, evicted_size = self._disk.popitem(last=False)
+            self._disk_bytes -= evicted_size
+            self.evictions += 1
+            try:
+                os.remove(self._path(evicted))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, name: str, data: bytes):
+        self._memory[name] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _load(self):
+        # Pick up archives left by a previous process, oldest first.
+        entries = []
+        for filename in os.listdir(self.directory):
+            name = filename.removesuffix(".zip")
+            path = os.path.join(self.directory, filename)
+            if name != filename and _HASH.fullmatch(name):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+            elif name != filename:
+                # Named after its key, by an earlier version.
+                os.remove(path)
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+
+    def _path(self, name: str):
+        return os.path.join(self.directory, f"{name}.zip")
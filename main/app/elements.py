@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+
+
+@dataclass
+class IndexEntry:
+    address: str
+    # Archive member name, and the member's git blob sha once it was read.
+    member: str
+    blob: str | None = None
+
+    @property
+    def path(self):
+        # The member name without the zipball's "{org}-{repo}-{sha}/" prefix.
+        return self.member.split("/", 1)[-1]
+
+
+class ElementCache:
+    # Encoded /get_content elements keyed by (member path, git blob sha).
+    # A file that doesn't change between commits keeps its blob sha, so it is
+    # parsed once no matter how many commits contain it. Each commit also
+    # gets an address index built from the archive listing; entries learn
+    # their blob sha as members are read, which lets repeat reads of the same
+    # sha skip the archive altogether.
+    def __init__(self, max_bytes: int, max_commits: int = 64) -> None:
+        self.max_bytes = max_bytes
+        self.max_commits = max_commits
+        self.hits = 0
+        self.misses = 0
+        self.commit_hits = 0
+        self.evictions = 0
+        self._elements: OrderedDict[tuple[str, str], str] = OrderedDict()
+        self._bytes = 0
+        self._commits: OrderedDict[str, list[IndexEntry]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, path: str, blob: str) -> str | None:
+        with self._lock:
+            element = self._elements.get((path, blob))
+            if element is None:
+                self.misses += 1
+                return None
+            self._elements.move_to_end((path, blob))
+            self.hits += 1
+            return element
+
+    def put(self, path: str, blob: str, element: str):
+        with self._lock:
+            if (path, blob) in self._elements:
+                return
+            self._elements[path, blob] = element
+            self._bytes += len(element)
+            while self._bytes > self.max_bytes and len(self._elements) > 1:
+                _, evicted = self._elements.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def cached(self, entries: list[IndexEntry]) -> list[str] | None:
+        # The elements for `entries`, or None unless all of them are cached.
+        with self._lock:
+            keys = [(entry.path, entry.blob) for entry in entries]
+            if any(key not in self._elements for key in keys):
+                return None
+            self.commit_hits += 1
+            for key in keys:
+                self._elements.move_to_end(key)
+            return [self._elements[key] for key in keys]
+
+    def index(self, repo: str, sha: str) -> list[IndexEntry] | None:
+        with self._lock:
+            entries = self._commits.get(f"{repo}@{sha}")
+            if entries is not None:
+                self._commits.move_to_end(f"{repo}@{sha}")
+            return entries
+
+    def put_index(self, repo: str, sha: str, entries: list[IndexEntry]):
+        with self._lock:
+            self._commits[f"{repo}@{sha}"] = entries
+            while len(self._commits) > self.max_commits:
+                self._commits.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "commit_hits": self.commit_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self._bytes,
+                "entries": len(self._elements),
+                "commits": len(self._commits),
+            }
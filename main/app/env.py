@@ -1,8 +1,28 @@
-from os import environ
+from os import environ, path
+from tempfile import gettempdir
 
 GITHUB_ORG = environ["GITHUB_ORG"]
 GITHUB_APP_ID = environ["GITHUB_APP_ID"]
 GITHUB_APP_INSTALLATION_ID = environ["GITHUB_APP_INSTALLATION_ID"]
 GITHUB_APP_PRIVATE_KEY = environ["GITHUB_APP_PRIVATE_KEY"]
 STATE_BUCKET = environ["STATE_BUCKET"]
+GITHUB_API_URL = environ.get("GITHUB_API_URL", "https://api.github.com")
 
+GITHUB_HTTP2 = environ.get("GITHUB_HTTP2", "1") == "1"
+GITHUB_MAX_CONNECTIONS = int(environ.get("GITHUB_MAX_CONNECTIONS", "32"))
+GITHUB_MAX_KEEPALIVE = int(environ.get("GITHUB_MAX_KEEPALIVE", "16"))
+GITHUB_MAX_CONCURRENCY = int(environ.get("GITHUB_MAX_CONCURRENCY", "16"))
+GITHUB_TIMEOUT = float(environ.get("GITHUB_TIMEOUT", "30"))
+GITHUB_ETAG_CACHE_BYTES = int(environ.get("GITHUB_ETAG_CACHE_BYTES", 32 << 20))
+GITHUB_MAX_ATTEMPTS = int(environ.get("GITHUB_MAX_ATTEMPTS", "5"))
+GITHUB_BACKOFF = float(environ.get("GITHUB_BACKOFF", "0.5"))
+GITHUB_MAX_BACKOFF = float(environ.get("GITHUB_MAX_BACKOFF", "30"))
+ARCHIVE_CACHE_DIR = environ.get(
+    "ARCHIVE_CACHE_DIR", path.join(gettempdir(), "blueform-archives")
+)
+ARCHIVE_CACHE_MEMORY_BYTES = int(environ.get("ARCHIVE_CACHE_MEMORY_BYTES", 64 << 20))
+ARCHIVE_CACHE_DISK_BYTES = int(environ.get("ARCHIVE_CACHE_DISK_BYTES", 1 << 30))
+ELEMENT_CACHE_BYTES = int(environ.get("ELEMENT_CACHE_BYTES", 256 << 20))
+ELEMENT_PARSE_WORKERS = int(environ.get("ELEMENT_PARSE_WORKERS", "8"))
+METRICS = environ.get("METRICS", "0") == "1"
+JSON_BACKEND = environ.get("JSON_BACKEND", "auto")
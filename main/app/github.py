@@ -1,24 +1,250 @@
+import asyncio
+import re
+from collections import OrderedDict
+from hashlib import sha1
 from time import time
-from typing import Any
+from typing import Any, BinaryIO
 from base64 import b64encode
+from datetime import datetime
+from threading import Lock, Thread
 
 import jwt
 import requests
 import httpx
-import json
 
 from .env import (
+    GITHUB_API_URL,
     GITHUB_ORG,
     GITHUB_APP_ID,
     GITHUB_APP_PRIVATE_KEY,
     GITHUB_APP_INSTALLATION_ID,
+    GITHUB_HTTP2,
+    GITHUB_MAX_CONNECTIONS,
+    GITHUB_MAX_KEEPALIVE,
+    GITHUB_MAX_CONCURRENCY,
+    GITHUB_TIMEOUT,
+    GITHUB_ETAG_CACHE_BYTES,
+    GITHUB_MAX_ATTEMPTS,
+    GITHUB_BACKOFF,
+    GITHUB_MAX_BACKOFF,
 )
+from . import serializer
+from .metrics import span
+from .scheduler import IDEMPOTENT, scheduler_for
+
+
+# Installation tokens live for an hour. Requests keep using the cached token
+# until it is within EXPIRY_MARGIN seconds of expiring; once it is within
+# REFRESH_MARGIN a single background refresh is started so callers never
+# wait on the round-trip in the steady state.
+REFRESH_MARGIN = 600
+EXPIRY_MARGIN = 60
+
+COMMIT_SHA = re.compile(r"[0-9a-f]{40}")
+
+
+class InstallationTokenProvider:
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._lock = Lock()
+        self._refresh_lock = Lock()
+
+    def get(self) -> str:
+        token = self._cached()
+        if token is not None:
+            return token
+        with self._refresh_lock:
+            # Whoever held the lock before us may already have refreshed.
+            token = self._cached(count=False)
+            if token is not None:
+                return token
+            with self._lock:
+                self.misses += 1
+            return self._refresh()
+
+    async def aget(self) -> str:
+        token = self._cached()
+        if token is not None:
+            return token
+        return await asyncio.to_thread(self.get)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "expires_in": max(0, int(self._expires_at - time())),
+            }
+
+    def _cached(self, count=True) -> str | None:
+        now = time()
+        with self._lock:
+            if self._token is None or now >= self._expires_at - EXPIRY_MARGIN:
+                return None
+            if count:
+                self.hits += 1
+            stale = now >= self._expires_at - REFRESH_MARGIN and not self._refreshing
+            if stale:
+                self._refreshing = True
+            token = self._token
+        if stale:
+            Thread(target=self._refresh_in_background, daemon=True).start()
+        return token
+
+    def _refresh_in_background(self):
+        try:
+            with self._refresh_lock:
+                if time() < self._expires_at - REFRESH_MARGIN:
+                    return
+                self._refresh()
+        except Exception as e:
+            # The current token is still valid; the next caller retries.
+            print("GITHUB token refresh failed:", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh(self) -> str:
+        with span("github_token"):
+            return self._mint()
+
+    def _mint(self) -> str:
+        now = int(time())
+        app_jwt = jwt.encode(
+            {
+                "iat": now - 60,
+                "exp": now + 60,
+                "iss": GITHUB_APP_ID,
+            },
+            GITHUB_APP_PRIVATE_KEY,
+            algorithm="RS256",
+        )
+        r = requests.post(
+            f"{self.base_url}/app/installations/{GITHUB_APP_INSTALLATION_ID}/access_tokens",
+            headers={
+                "Accept": "application/vnd.github+json",
+                "Authorization": f"Bearer {app_jwt}",
+                "X-GitHub-Api-Version": "2022-11-28",
+            },
+        )
+        r.raise_for_status()
+        body = r.json()
+        expires_at = datetime.strptime(body["expires_at"], "%Y-%m-%dT%H:%M:%S%z")
+        with self._lock:
+            self._token = body["token"]
+            self._expires_at = expires_at.timestamp()
+            self.refreshes += 1
+        return body["token"]
+
+
+tokens = InstallationTokenProvider(GITHUB_API_URL)
+
+
+class ETagCache:
+    # Last 200 response of each GET, by URL, query and Accept header, with
+    # its ETag. Repeating the GET with If-None-Match turns an unchanged read
+    # into a 304, which GitHub doesn't count against the rate limit, and the
+    # stored response is handed back in its place. Bounded in bytes.
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[str, httpx.Headers, bytes]] = (
+            OrderedDict()
+        )
+        self._bytes = 0
+        self._lock = Lock()
+
+    def get(self, key: str) -> tuple[str, httpx.Headers, bytes] | None:
+        with self._lock:
+            return self._entries.get(key)
+
+    def update(
+        self,
+        key: str,
+        r: httpx.Response,
+        cached: tuple[str, httpx.Headers, bytes] | None,
+    ) -> httpx.Response:
+        # Returns the response to use in place of `r`; `cached` is the entry
+        # whose ETag the request was made with.
+        with self._lock:
+            if r.status_code == 304 and cached:
+                self.hits += 1
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                _, headers, content = cached
+                return httpx.Response(
+                    200, headers=headers, content=content, request=r.request
+                )
+            self.misses += 1
+            etag = r.headers.get("ETag")
+            if r.status_code != 200 or not etag or len(r.content) > self.max_bytes:
+                return r
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[2])
+            self._entries[key] = (etag, r.headers, r.content)
+            self._bytes += len(r.content)
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+            return r
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": self._bytes,
+                "entries": len(self._entries),
+            }
+
+
+etags = ETagCache(GITHUB_ETAG_CACHE_BYTES)
+scheduler = scheduler_for(
+    GITHUB_APP_INSTALLATION_ID,
+    max_concurrency=GITHUB_MAX_CONCURRENCY,
+    backoff=GITHUB_BACKOFF,
+    max_backoff=GITHUB_MAX_BACKOFF,
+)
+
+
+def http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        http2=GITHUB_HTTP2,
+        limits=httpx.Limits(
+            max_connections=GITHUB_MAX_CONNECTIONS,
+            max_keepalive_connections=GITHUB_MAX_KEEPALIVE,
+        ),
+        timeout=httpx.Timeout(GITHUB_TIMEOUT),
+    )
 
 
 class GitHubClient:
-    def __init__(self) -> None:
-        self.base_url = "https://api.github.com"
-        self.token = self._get_access_token()
+    def __init__(self, http: httpx.AsyncClient | None = None) -> None:
+        self.base_url = GITHUB_API_URL
+        self._owns_http = http is None
+        self._http = http or http_client()
+        self.scheduler = scheduler
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_http:
+            await self._http.aclose()
 
     async def create_repo(self, name: str):
         return await self._request(
@@ -39,6 +265,48 @@ class GitHubClient:
             url=f"{self._repo_url(repo)}/zipball/{sha}",
         )
 
+    async def resolve_ref(self, repo: str, ref: str) -> str:
+        if COMMIT_SHA.fullmatch(ref):
+            return ref
+        r = await self._request(
+            method="GET",
+            url=f"{self._repo_url(repo)}/commits/{ref}",
+            headers={"Accept": "application/vnd.github.sha"},
+        )
+        return r.text.strip()
+
+    async def download_repo_zip(self, repo: str, sha: str, f: BinaryIO):
+        with span("github_zipball"):
+            await self._download(f"{self._repo_url(repo)}/zipball/{sha}", f)
+
+    async def _download(self, url: str, f: BinaryIO):
+        headers = await self._headers()
+        for attempt in range(1, GITHUB_MAX_ATTEMPTS + 1):
+            f.seek(0)
+            f.truncate()
+            await self.scheduler.acquire()
+            r = None
+            try:
+                async with self._http.stream("GET", url, headers=headers) as r:
+                    if r.is_success:
+                        async for chunk in r.aiter_bytes():
+                            f.write(chunk)
+                        return
+                    # Read while the stream is open: the error raised below
+                    # carries it, and handle_http_error sends it back.
+                    await r.aread()
+            except httpx.TransportError:
+                r = None
+                if attempt == GITHUB_MAX_ATTEMPTS:
+                    raise
+            finally:
+                self.scheduler.release(r)
+            delay = self.scheduler.retry_delay("GET", r, attempt)
+            if delay is None or attempt == GITHUB_MAX_ATTEMPTS:
+                break
+            await asyncio.sleep(delay)
+        r.raise_for_status()
+
     async def set_content(self, repo: str, path: str, branch: str, content: str):
         body = {
             "branch": branch,
@@ -61,7 +329,7 @@ class GitHubClient:
             body=body,
             raise_for_status=False,
         )
-        print("GITHUB", json.dumps(r.json(), indent=2, sort_keys=True))
+        print("GITHUB", serializer.dumps_pretty(serializer.loads(r.content)))
         return r
 
     async def delete_content(self, repo: str, path: str, branch: str):
@@ -111,6 +379,101 @@ class GitHubClient:
             }
         )
 
+    async def get_commit(self, repo: str, sha: str):
+        return await self._request(
+            method="GET",
+            url=f"{self._repo_url(repo)}/git/commits/{sha}",
+        )
+
+    async def get_tree(self, repo: str, sha: str, recursive: bool = True):
+        return await self._request(
+            method="GET",
+            url=f"{self._repo_url(repo)}/git/trees/{sha}",
+            params={"recursive": "1"} if recursive else None,
+        )
+
+    async def changed_files(
+        self, repo: str, tree: str, files: dict[str, str | None]
+    ) -> tuple[dict[str, str | None], list[str]]:
+        # Splits `files` into the ones that would change `tree` and the ones
+        # already in place, by comparing git blob SHAs computed locally with
+        # those in the tree, so unchanged content never leaves the process.
+        r = await self.get_tree(repo=repo, sha=tree)
+        data = serializer.loads(r.content)
+        current = {e["path"]: e["sha"] for e in data["tree"] if e["type"] == "blob"}
+        changed, skipped = {}, []
+        for path, content in files.items():
+            if path in current:
+                unchanged = content is not None and blob_sha(content) == current[path]
+            else:
+                # A truncated listing can't prove a path is absent.
+                unchanged = content is None and not data.get("truncated")
+            if unchanged:
+                skipped.append(path)
+            else:
+                changed[path] = content
+        return changed, skipped
+
+    async def create_tree(
+        self, repo: str, base_tree: str, tree: list[dict[str, Any]]
+    ):
+        return await self._request(
+            method="POST",
+            url=f"{self._repo_url(repo)}/git/trees",
+            body={"base_tree": base_tree, "tree": tree},
+        )
+
+    async def create_commit(
+        self, repo: str, message: str, tree: str, parents: list[str]
+    ):
+        return await self._request(
+            method="POST",
+            url=f"{self._repo_url(repo)}/git/commits",
+            body={"message": message, "tree": tree, "parents": parents},
+        )
+
+    async def update_branch(self, repo: str, name: str, sha: str):
+        return await self._request(
+            method="PATCH",
+            url=f"{self._repo_url(repo)}/git/refs/heads/{name}",
+            body={"sha": sha, "force": False},
+            raise_for_status=False,
+        )
+
+    async def commit_files(
+        self,
+        repo: str,
+        branch: str,
+        files: dict[str, str | None],
+        message: str,
+        attempts: int = 3,
+    ):
+        # A None content deletes the path. The whole change set becomes one
+        # tree and one commit, and the branch is only fast-forwarded, so a
+        # concurrent push makes the ref update fail with 422 and we rebuild
+        # on top of the new head. Files already matching the head are left
+        # out, and when none are left no commit is made at all.
+        for _ in range(attempts):
+            r = await self.get_branch(repo=repo, name=branch)
+            parent = r.json()["object"]["sha"]
+            r = await self.get_commit(repo=repo, sha=parent)
+            base_tree = r.json()["tree"]["sha"]
+            changed, skipped = await self.changed_files(repo, base_tree, files)
+            result = {"commit": parent, "changed": list(changed), "skipped": skipped}
+            if not changed:
+                return result
+            tree = [_tree_entry(path, content) for path, content in changed.items()]
+            r = await self.create_tree(repo=repo, base_tree=base_tree, tree=tree)
+            r = await self.create_commit(
+                repo=repo, message=message, tree=r.json()["sha"], parents=[parent]
+            )
+            commit = r.json()["sha"]
+            r = await self.update_branch(repo=repo, name=branch, sha=commit)
+            if r.status_code != 422:
+                r.raise_for_status()
+                return {**result, "commit": commit}
+        r.raise_for_status()
+
     def _repo_url(self, repo: str):
         return f"{self.base_url}/repos/{GITHUB_ORG}/{repo}"
 
@@ -120,37 +483,84 @@ class GitHubClient:
         url: str,
         params: dict[str, Any] | None = None,
         body: dict[str, Any] | None = None,
+        headers: dict[str, str] | None = None,
         raise_for_status=True,
     ):
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Accept": "application/vnd.github.v3+json",
-        }
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            r = await client.request(
-                method=method, url=url, headers=headers, params=params, json=body
-            )
+        # Timed as a whole, retries and waiting for the scheduler included.
+        with span("github_request", method=method, endpoint=self._endpoint(url)):
+            r = await self._send(method, url, params, body, headers)
         if raise_for_status:
             r.raise_for_status()
         return r
 
-    def _get_access_token(self) -> str:
-        now = int(time())
-        app_jwt = jwt.encode(
-            {
-                "iat": now - 60,
-                "exp": now + 60,
-                "iss": GITHUB_APP_ID,
-            },
-            GITHUB_APP_PRIVATE_KEY,
-            algorithm="RS256",
-        )
-        r = requests.post(
-            f"{self.base_url}/app/installations/{GITHUB_APP_INSTALLATION_ID}/access_tokens",
-            headers={
-                "Accept": "application/vnd.github+json",
-                "Authorization": f"Bearer {app_jwt}",
-                "X-GitHub-Api-Version": "2022-11-28",
-            },
-        )
-        return r.json()["token"]
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        params: dict[str, Any] | None,
+        body: dict[str, Any] | None,
+        headers: dict[str, str] | None,
+    ):
+        headers = await self._headers(headers)
+        key = cached = None
+        if method == "GET":
+            key = str(httpx.URL(url, params=params)) + " " + headers["Accept"]
+            cached = etags.get(key)
+            if cached:
+                headers["If-None-Match"] = cached[0]
+        # Encoded once, however many attempts it takes; commits of large
+        # change sets carry every file's content.
+        content = None
+        if body is not None:
+            content = serializer.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in range(1, GITHUB_MAX_ATTEMPTS + 1):
+            await self.scheduler.acquire()
+            r = None
+            try:
+                r = await self._http.request(
+                    method=method, url=url, headers=headers, params=params, content=content
+                )
+            except httpx.TransportError:
+                if method not in IDEMPOTENT or attempt == GITHUB_MAX_ATTEMPTS:
+                    raise
+            finally:
+                self.scheduler.release(r)
+            delay = self.scheduler.retry_delay(method, r, attempt)
+            if delay is None or attempt == GITHUB_MAX_ATTEMPTS:
+                break
+            await asyncio.sleep(delay)
+        if key:
+            r = etags.update(key, r, cached)
+        return r
+
+    def _endpoint(self, url: str):
+        # The kind of call, without names or ids, e.g. "git/trees" for
+        # /repos/{org}/{repo}/git/trees/{sha}.
+        parts = url.removeprefix(self.base_url).strip("/").split("/")
+        if parts[0] == "repos":
+            parts = parts[3:]
+        return "/".join(parts[:2] if parts[:1] == ["git"] else parts[:1])
+
+    async def _headers(self, extra: dict[str, str] | None = None):
+        token = await tokens.aget()
+        return {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github.v3+json",
+            **(extra or {}),
+        }
+
+
+def blob_sha(content: str | bytes) -> str:
+    # The id git gives a blob with this content.
+    data = content.encode() if isinstance(content, str) else content
+    return sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def _tree_entry(path: str, content: str | None):
+    entry = {"path": path, "mode": "100644", "type": "blob"}
+    if content is None:
+        entry["sha"] = None
+    else:
+        entry["content"] = content
+    return entry
@@ -23,10 +23,19 @@ class CreateRepoRequest:
 class GetRepoRequest:
     repo: str
     sha: str
+    # Only elements whose address is listed here or matches one of the glob
+    # patterns (e.g. "resource.google_storage_bucket.*"); both when both set.
+    addresses: list[str] | None = None
+    match: list[str] | None = None
+    # Page size; the next page is requested with the X-Next-Cursor header of
+    # the previous response.
+    limit: int | None = None
+    cursor: str | None = None
 
 @dataclass
 class SetContentRequest:
     repo: str
     branch: str
     elements: list[dict[str, Any]]
+    batch: bool = True
 
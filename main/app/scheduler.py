@@ -0,0 +1,174 @@
+import asyncio
+import random
+from collections import deque
+from threading import Lock
+from time import time
+
+import httpx
+
+# Methods that can be replayed after a failure that may have reached GitHub.
+# Rate-limited requests were never processed, so those are retried whatever
+# the method.
+IDEMPOTENT = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+RETRY_STATUSES = {502, 503, 504}
+# GitHub asks for at least a minute when a secondary rate limit response
+# doesn't say how long to wait.
+SECONDARY_RATE_LIMIT_WAIT = 60.0
+
+
+class RateLimitScheduler:
+    # Admission control for one installation's GitHub quota, shared by every
+    # client in the process. Each request needs a slot and a unit of budget:
+    #
+    # - the budget is GitHub's X-RateLimit-Remaining, spent locally as
+    #   requests go out and refreshed from every response; once it runs out
+    #   requests wait for X-RateLimit-Reset.
+    # - the number of slots adapts AIMD-style: +1 per window of successful
+    #   responses, halved on every 403/429 rate-limit response, which also
+    #   holds back all requests until its Retry-After has passed.
+    #
+    # Requests all come from the server's event loop, where waiters are
+    # woken directly. The thread lock is for stats(), which Quart calls from
+    # a worker thread.
+    def __init__(
+        self,
+        max_concurrency: int,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.window = float(max_concurrency)
+        self.in_flight = 0
+        self.limit: int | None = None
+        self.remaining: int | None = None
+        self.reset = 0.0
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._lock = Lock()
+
+    async def acquire(self):
+        while True:
+            with self._lock:
+                delay = self._delay(time())
+                if delay == 0 and self.in_flight < int(self.window):
+                    self.in_flight += 1
+                    self.requests += 1
+                    if self.remaining is not None:
+                        self.remaining -= 1
+                    return
+                if delay == 0:
+                    waiter = asyncio.get_running_loop().create_future()
+                    self._waiters.append(waiter)
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    try:
+                        self._waiters.remove(waiter)
+                    except ValueError:
+                        # Woken already; pass the slot on.
+                        self._wake_next()
+                raise
+
+    def release(self, r: httpx.Response | None = None):
+        with self._lock:
+            self.in_flight -= 1
+            if r is not None:
+                self._observe(r)
+            self._wake_next()
+
+    def retry_delay(self, method: str, r: httpx.Response | None, attempt: int):
+        # Seconds to back off before retrying, or None if the request
+        # shouldn't be retried. Rate-limited requests additionally wait in
+        # acquire() until the limit has passed.
+        if r is None or r.status_code in RETRY_STATUSES:
+            if method not in IDEMPOTENT:
+                return None
+        elif not _throttled(r):
+            return None
+        with self._lock:
+            self.retries += 1
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "waiting": len(self._waiters),
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "reset": self.reset,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "retries": self.retries,
+            }
+
+    def _delay(self, now: float):
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.remaining is not None and self.remaining <= 0 and self.reset > now:
+            return self.reset - now
+        return 0
+
+    def _observe(self, r: httpx.Response):
+        headers = r.headers
+        if "X-RateLimit-Remaining" in headers:
+            # Requests still in flight will each spend one more.
+            self.remaining = int(headers["X-RateLimit-Remaining"]) - self.in_flight
+            self.limit = int(headers.get("X-RateLimit-Limit", self.limit or 0))
+            self.reset = float(headers.get("X-RateLimit-Reset", self.reset))
+        if _throttled(r):
+            self.throttled += 1
+            self.window = max(1.0, self.window / 2)
+            self.blocked_until = max(self.blocked_until, time() + _retry_after(r))
+        elif r.status_code < 500:
+            self.window = min(self.max_concurrency, self.window + 1 / self.window)
+
+    def _wake_next(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+
+_schedulers: dict[str, RateLimitScheduler] = {}
+_schedulers_lock = Lock()
+
+
+def scheduler_for(installation_id: str, **kwargs) -> RateLimitScheduler:
+    # Quotas are per installation, so is the scheduler.
+    with _schedulers_lock:
+        if installation_id not in _schedulers:
+            _schedulers[installation_id] = RateLimitScheduler(**kwargs)
+        return _schedulers[installation_id]
+
+
+def _throttled(r: httpx.Response):
+    if r.status_code == 429:
+        return True
+    if r.status_code != 403:
+        return False
+    if "Retry-After" in r.headers or r.headers.get("X-RateLimit-Remaining") == "0":
+        return True
+    try:
+        return "rate limit" in r.text.lower()
+    except httpx.ResponseNotRead:
+        return False
+
+
+def _retry_after(r: httpx.Response):
+    if "Retry-After" in r.headers:
+        return float(r.headers["Retry-After"])
+    if r.headers.get("X-RateLimit-Remaining") == "0":
+        return max(float(r.headers.get("X-RateLimit-Reset", 0)) - time(), 0)
+    return SECONDARY_RATE_LIMIT_WAIT
@@ -1,98 +1,197 @@
-import os
-from io import BytesIO
-from contextlib import contextmanager
-from shutil import rmtree, make_archive
-from uuid import uuid4
-from zipfile import ZipFile
-
-from flask import Flask, jsonify, request
+import json
+from dataclasses import asdict
+from hashlib import sha256
+
+from flask import Flask, Response, jsonify, request
 from werkzeug.exceptions import HTTPException
-from google.cloud import storage
 
-from app.terraform import Terraform, TerraformError
-from app.env import TMP_DIR, PLAN_BUCKET
+from app import metrics, runs, serializer
+from app.capacity import admit
+from app.summary import SummaryCache, select
+from app.jobs import QUEUED, JobRunner, MemoryJobStore, SQLiteJobStore
+from app.locks import GCSLocks
+from app.github import resolve_ref
+from app.env import (
+    PLAN_BUCKET,
+    JOB_BACKEND,
+    JOB_CONCURRENCY,
+    JOB_DB,
+    LOCK_BACKEND,
+    LOCK_BUCKET,
+    METRICS,
+    SUMMARY_CACHE_BYTES,
+)
 from app.model import (
     ApplyRequest,
     AutoApplyRequest,
+    BatchPlanRequest,
     PlanRequest,
     ValidationError,
     from_json,
 )
-from app.github import get_repo_zip
 
 
 app = Flask(__name__)
-gcs = storage.Client()
+app.json = serializer.JSONProvider(app)
+jobs = JobRunner(
+    SQLiteJobStore(JOB_DB) if JOB_BACKEND == "sqlite" else MemoryJobStore(),
+    handlers={
+        "plan": runs.plan,
+        "apply": runs.apply,
+        "auto-apply": runs.auto_apply,
+    },
+    concurrency=JOB_CONCURRENCY,
+    worker_stats=runs.stats,
+    locks=GCSLocks(runs.gcs, LOCK_BUCKET) if LOCK_BACKEND == "gcs" else None,
+    share={"plan": runs.share_plan},
+    admit=admit,
+)
+summaries = SummaryCache(SUMMARY_CACHE_BYTES)
+
+
+@app.before_request
+def start_request():
+    metrics.begin(request.headers.get("X-Request-ID"))
+
+
+@app.after_request
+def finish_request(response: Response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    response.headers.update(metrics.finish(request.method, route, response.status_code))
+    return response
 
 
 @app.route("/plan", methods=["POST"])
 def plan():
-    with transient_directory(TMP_DIR) as td:
-        req = from_json(PlanRequest, request.json)
-        tfdir = os.path.join(td, "tf")
-        write_configuration(tfdir, req.repo, req.ref)
-        tf = Terraform(
-            tfdir,
-            repo=req.repo,
-            sha=req.ref,
-            workspace=req.workspace,
-            plan_id=req.plan_id,
-            **req.meta,
-        )
-        # TODO: decrypt vars
-        tf.init(req.workspace)
-        tf.plan(vars=req.vars, refresh_only=req.refresh_only, destroy=req.destroy)
-        rmtree(os.path.join(tfdir, ".terraform/providers"), ignore_errors=True)
-        archive = make_archive(tfdir, "zip", tfdir)
-        blob = gcs.bucket(PLAN_BUCKET).blob(req.plan_id)
-        blob.upload_from_filename(archive)
-    return jsonify(
-        message="Successfully created plan",
-        plan_id=req.plan_id,
-        repo=req.repo,
-        ref=req.ref,
+    req = from_json(PlanRequest, request.json)
+    req.sha = resolve_ref(req.repo, req.ref)
+    if req.base_ref:
+        req.base_sha = resolve_ref(req.repo, req.base_ref)
+    job = jobs.submit(
+        "plan",
+        asdict(req),
+        lock_key=_lock_key(req.repo, req.workspace),
+        coalesce_key=_coalesce_key(req),
     )
+    return jsonify(job_id=job["id"], status=job["status"], plan_id=req.plan_id), 202
+
+
+@app.route("/plan/batch", methods=["POST"])
+def plan_batch():
+    batch = from_json(BatchPlanRequest, request.json)
+    if not isinstance(batch.plans, list) or not batch.plans:
+        raise ValidationError("plans must be a non-empty list")
+    if not all(isinstance(plan, dict) for plan in batch.plans):
+        raise ValidationError("plans must be objects")
+    metas = [batch.meta, *(plan.get("meta", {}) for plan in batch.plans)]
+    if not all(isinstance(meta, dict) for meta in metas):
+        raise ValidationError("meta must be an object")
+    reqs = [
+        from_json(PlanRequest, {**plan, "meta": {**batch.meta, **plan.get("meta", {})}})
+        for plan in batch.plans
+    ]
+    if len({req.plan_id for req in reqs}) != len(reqs):
+        raise ValidationError("plan_id must be unique within a batch")
+    # Each ref is resolved once, so every plan for it runs the same commit
+    # and the job workers share one download of its archive.
+    shas: dict[tuple[str, str], str] = {}
+    for req in reqs:
+        for ref in filter(None, (req.ref, req.base_ref)):
+            if (req.repo, ref) not in shas:
+                shas[req.repo, ref] = resolve_ref(req.repo, ref)
+        req.sha = shas[req.repo, req.ref]
+        req.base_sha = shas[req.repo, req.base_ref] if req.base_ref else None
+    submitted = {
+        jobs.submit(
+            "plan",
+            asdict(req),
+            lock_key=_lock_key(req.repo, req.workspace),
+            coalesce_key=_coalesce_key(req),
+        )["id"]: req.plan_id
+        for req in reqs
+    }
+
+    def results():
+        # A line per plan as soon as it is queued, then another once it has
+        # finished, in the order plans finish. The jobs keep running if the
+        # client goes away and can still be looked up by job_id.
+        for job_id, plan_id in submitted.items():
+            yield _ndjson(job_id=job_id, plan_id=plan_id, status=QUEUED)
+        for job in jobs.wait(list(submitted)):
+            yield _ndjson(
+                job_id=job["id"],
+                plan_id=submitted[job["id"]],
+                status=job["status"],
+                result=job.get("result"),
+                error=job.get("error"),
+            )
+
+    return Response(results(), mimetype="application/x-ndjson")
+
+
+@app.route("/plan/<plan_id>/summary", methods=["GET"])
+def plan_summary(plan_id: str):
+    entry = summaries.get(runs.gcs.bucket(PLAN_BUCKET), plan_id)
+    if entry is None:
+        return jsonify(message="Plan summary not found", plan_id=plan_id), 404
+    generation, data = entry
+    # ?action=delete&action=replace narrows the changes down.
+    actions = request.args.getlist("action")
+    if actions:
+        data = serializer.dumps(select(serializer.loads(data), actions))
+    response = Response(data, mimetype="application/json")
+    response.set_etag(f"{plan_id}-{generation}-{','.join(sorted(actions))}")
+    return response.make_conditional(request)
 
 
 @app.route("/apply", methods=["POST"])
 def apply():
     req = from_json(ApplyRequest, request.json)
-    blob = gcs.bucket(PLAN_BUCKET).get_blob(req.plan_id)
+    blob = runs.gcs.bucket(PLAN_BUCKET).get_blob(req.plan_id)
     if not blob:
         return jsonify(message="Plan not found", plan_id=req.plan_id), 404
-    with transient_directory(TMP_DIR) as td:
-        tfdir = os.path.join(td, "tf")
-        archive = f"{tfdir}.zip"
-        blob.download_to_filename(archive)
-        with ZipFile(archive) as zf:
-            zf.extractall(tfdir)
-        tf = Terraform(tfdir, plan_id=req.plan_id, **req.meta)
-        tf.init()
-        tf.apply()
-    return jsonify(message="Successfully applied plan", plan_id=req.plan_id)
+    meta = blob.metadata or {}
+    lock_key = _lock_key(meta["repo"], meta["workspace"]) if "repo" in meta else None
+    job = jobs.submit("apply", asdict(req), lock_key=lock_key)
+    return jsonify(job_id=job["id"], status=job["status"], plan_id=req.plan_id), 202
 
 
 @app.route("/auto-apply", methods=["POST"])
 def auto_apply():
     req = from_json(AutoApplyRequest, request.json)
-    with transient_directory(TMP_DIR) as td:
-        tfdir = os.path.join(td, "tf")
-        write_configuration(tfdir, req.repo, req.ref)
-        tf = Terraform(
-            tfdir,
-            repo=req.repo,
-            sha=req.ref,
-            workspace=req.workspace,
-            **req.meta,
-        )
-        tf.init(req.workspace)
-        tf.auto_apply(vars=req.vars, refresh_only=req.refresh_only, destroy=req.destroy)
-    return jsonify(message="Successfully applied")
-
-
-@app.errorhandler(TerraformError)
-def handle_terraform_error(e: TerraformError):
-    return jsonify(message="Terraform error"), 400
+    job = jobs.submit(
+        "auto-apply", asdict(req), lock_key=_lock_key(req.repo, req.workspace)
+    )
+    return jsonify(job_id=job["id"], status=job["status"]), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify(message="Job not found", job_id=job_id), 404
+    return jsonify(job)
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify(message="Job not found", job_id=job_id), 404
+    return jsonify(job)
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(jobs=jobs.stats(), summaries=summaries.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    # Includes what job workers measured, as of the last job each finished.
+    if not METRICS:
+        return jsonify(message="Metrics are disabled"), 404
+    return Response(metrics.histograms.render(), content_type=metrics.CONTENT_TYPE)
 
 
 @app.errorhandler(ValidationError)
@@ -105,22 +204,24 @@ def handle_http_error(e: HTTPException):
     return jsonify(message=str(e)), e.response.status_code if e.response else 500
 
 
-@contextmanager
-def transient_directory(root_dir):
-    d = os.path.join(root_dir, uuid4().hex)
-    os.makedirs(d)
-    try:
-        yield d
-    finally:
-        rmtree(d)
-
-
-def write_configuration(path: str, repo: str, ref: str):
-    os.makedirs(path)
-    r = get_repo_zip(repo, ref)
-    with ZipFile(BytesIO(r.content)) as zf:
-        for member in zf.infolist():
-            if member.is_dir():
-                continue
-            member.filename = os.path.basename(member.filename)
-            zf.extract(member, path=path)
+def _ndjson(**fields):
+    return serializer.dumps(fields, app.json.default) + "\n"
+
+
+def _lock_key(repo: str, workspace: str):
+    return f"{repo}/{workspace}"
+
+
+def _coalesce_key(req: PlanRequest):
+    # Two plans are interchangeable when they run the same commit against the
+    # same workspace with the same inputs; plan_id and meta don't matter.
+    identity = [
+        req.repo,
+        req.sha,
+        req.base_sha,
+        req.workspace,
+        req.vars,
+        req.refresh_only,
+        req.destroy,
+    ]
+    return sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
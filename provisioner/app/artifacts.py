@@ -0,0 +1,193 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+from typing import Any
+from uuid import uuid4
+
+import zstandard
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+from . import serializer
+from .env import ARTIFACT_PART_BYTES, ARTIFACT_WORKERS, ARTIFACT_ZSTD_LEVEL
+
+# A plan artifact is a small JSON manifest, stored under the plan_id, that
+# maps every file of the planned directory to a zstd-compressed blob under
+# blobs/ named by the sha256 of its content. Config, modules and lock files
+# rarely change between plans, so most blobs are already in the bucket and
+# only the plan file is new.
+MANIFEST_TYPE = "application/vnd.blueform.plan-manifest+json"
+BLOB_PREFIX = "blobs/"
+# Provider binaries are relinked from the shared plugin cache by init.
+EXCLUDE = (".terraform/providers",)
+# GCS composes at most 32 objects at a time.
+MAX_PARTS = 32
+
+# Ranges of large blobs; separate from the per-file pools so a file task
+# can wait on its parts without starving them.
+_parts = ThreadPoolExecutor(ARTIFACT_WORKERS, thread_name_prefix="artifact-part")
+
+
+def upload(
+    bucket: storage.Bucket, name: str, directory: str, metadata: dict[str, str]
+) -> dict[str, Any]:
+    start = perf_counter()
+    paths = _walk(directory)
+    with ThreadPoolExecutor(ARTIFACT_WORKERS) as pool:
+        results = list(pool.map(lambda p: _upload_file(bucket, directory, p), paths))
+    manifest = {"version": 1, "files": {}}
+    uploaded_bytes = deduplicated = 0
+    for path, entry, uploaded in results:
+        manifest["files"][path] = entry
+        uploaded_bytes += uploaded
+        deduplicated += not uploaded
+    blob = bucket.blob(name)
+    blob.metadata = metadata
+    blob.upload_from_string(serializer.dumps(manifest), content_type=MANIFEST_TYPE)
+    entries = manifest["files"].values()
+    return {
+        "files": len(entries),
+        "bytes": sum(e["size"] for e in entries),
+        "stored_bytes": sum(e["stored"] for e in entries),
+        "uploaded_bytes": uploaded_bytes,
+        "deduplicated": deduplicated,
+        "seconds": round(perf_counter() - start, 3),
+    }
+
+
+def download(blob: storage.Blob, directory: str) -> dict[str, Any]:
+    # `blob` is the manifest.
+    start = perf_counter()
+    manifest = serializer.loads(blob.download_as_bytes())
+    bucket = blob.bucket
+    by_digest: dict[str, list[tuple[str, dict[str, Any]]]] = {}
+    for path, entry in manifest["files"].items():
+        by_digest.setdefault(entry["sha256"], []).append((path, entry))
+    with ThreadPoolExecutor(ARTIFACT_WORKERS) as pool:
+        downloaded = sum(
+            pool.map(
+                lambda files: _download_blob(bucket, directory, files),
+                by_digest.values(),
+            )
+        )
+    return {
+        "files": len(manifest["files"]),
+        "downloaded_bytes": downloaded,
+        "seconds": round(perf_counter() - start, 3),
+    }
+
+
+def is_manifest(blob: storage.Blob):
+    return blob.content_type == MANIFEST_TYPE
+
+
+def _walk(directory: str):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        rel = os.path.relpath(root, directory)
+        dirs[:] = [d for d in dirs if os.path.normpath(os.path.join(rel, d)) not in EXCLUDE]
+        for name in files:
+            path = os.path.normpath(os.path.join(rel, name))
+            if os.path.isfile(os.path.join(directory, path)):
+                paths.append(path)
+    return sorted(paths)
+
+
+def _upload_file(bucket: storage.Bucket, directory: str, path: str):
+    full = os.path.join(directory, path)
+    digest = hashlib.sha256()
+    with open(full, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    st = os.stat(full)
+    entry = {"sha256": digest.hexdigest(), "size": st.st_size, "mode": st.st_mode & 0o777}
+    name = f"{BLOB_PREFIX}{entry['sha256']}.zst"
+    existing = bucket.get_blob(name)
+    if existing is not None:
+        return path, {**entry, "stored": existing.size}, 0
+    with NamedTemporaryFile() as tmp:
+        with open(full, "rb") as f:
+            zstandard.ZstdCompressor(level=ARTIFACT_ZSTD_LEVEL).copy_stream(f, tmp)
+        tmp.flush()
+        stored = tmp.tell()
+        try:
+            if stored > ARTIFACT_PART_BYTES:
+                _composite_upload(bucket, name, tmp.name, stored)
+            else:
+                bucket.blob(name).upload_from_filename(tmp.name, if_generation_match=0)
+        except PreconditionFailed:
+            # Another plan uploaded the same content first.
+            pass
+    return path, {**entry, "stored": stored}, stored
+
+
+def _composite_upload(bucket: storage.Bucket, name: str, filename: str, size: int):
+    # Parts are uploaded side by side and composed into the final object.
+    # Part names are unique to this upload, so concurrent uploads of the
+    # same blob don't overwrite or delete each other's parts.
+    part_size = max(ARTIFACT_PART_BYTES, -(-size // MAX_PARTS))
+    ranges = [(i, min(part_size, size - i)) for i in range(0, size, part_size)]
+    upload = uuid4().hex
+    parts = [bucket.blob(f"{name}.{upload}.part{n}") for n in range(len(ranges))]
+
+    def upload_part(part: storage.Blob, offset: int, length: int):
+        with open(filename, "rb") as f:
+            f.seek(offset)
+            part.upload_from_file(f, size=length)
+
+    try:
+        for future in [
+            _parts.submit(upload_part, part, offset, length)
+            for part, (offset, length) in zip(parts, ranges)
+        ]:
+            future.result()
+        try:
+            bucket.blob(name).compose(parts, if_generation_match=0)
+        except (NotFound, PreconditionFailed):
+            # Another plan composed the same content first.
+            if bucket.get_blob(name) is None:
+                raise
+    finally:
+        for part in parts:
+            try:
+                part.delete()
+            except NotFound:
+                pass
+
+
+def _download_blob(
+    bucket: storage.Bucket, directory: str, files: list[tuple[str, dict[str, Any]]]
+):
+    # Identical files share a blob; it is fetched once and decompressed into
+    # each of them.
+    entry = files[0][1]
+    blob = bucket.blob(f"{BLOB_PREFIX}{entry['sha256']}.zst")
+    with NamedTemporaryFile() as tmp:
+        if entry["stored"] > ARTIFACT_PART_BYTES:
+            _ranged_download(blob, tmp.name, entry["stored"])
+        else:
+            blob.download_to_file(tmp)
+        for path, entry in files:
+            full = os.path.join(directory, path)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            tmp.seek(0)
+            with open(full, "wb") as f:
+                zstandard.ZstdDecompressor().copy_stream(tmp, f)
+            os.chmod(full, entry["mode"])
+    return entry["stored"]
+
+
+def _ranged_download(blob: storage.Blob, filename: str, size: int):
+    part_size = max(ARTIFACT_PART_BYTES, -(-size // MAX_PARTS))
+
+    def download_part(offset: int):
+        with open(filename, "r+b") as f:
+            f.seek(offset)
+            blob.download_to_file(f, start=offset, end=min(offset + part_size, size) - 1)
+
+    with open(filename, "wb") as f:
+        f.truncate(size)
+    for future in [_parts.submit(download_part, o) for o in range(0, size, part_size)]:
+        future.result()
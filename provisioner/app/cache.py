@@ -0,0 +1,185 @@
+import fcntl
+import os
+import re
+from contextlib import contextmanager
+from hashlib import sha256
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+from typing import BinaryIO, Callable
+
+LOCK_STRIPES = 64
+_HASH = re.compile(r"[0-9a-f]{64}")
+
+
+class ArchiveCache:
+    # Zipballs keyed by "{repo}@{commit sha}". The content behind a commit
+    # never changes, so entries are never invalidated, only evicted: a small
+    # in-memory LRU in front of a larger on-disk LRU, both bounded in bytes.
+    # Concurrent misses for the same key share a single download, which streams
+    # straight into the cache directory so archives are never held in memory
+    # unless they fit the memory tier. The directory is shared by the job
+    # worker processes: a download holds a lock file that other processes
+    # wait on, and archives another process stored are picked up from disk.
+    def __init__(
+        self, directory: str, max_memory_bytes: int, max_disk_bytes: int
+    ) -> None:
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self._inflight: dict[str, Future] = {}
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def open(self, key: str, fetch: Callable[[BinaryIO], None]) -> BinaryIO:
+        # Entries are kept by a hash of their key, since keys hold the repo
+        # name the caller sent and must not decide where files are written.
+        name = sha256(key.encode()).hexdigest()
+        waited = False
+        while True:
+            with self._lock:
+                f = self._lookup(name, count=not waited)
+                if f is not None:
+                    return f
+                future = self._inflight.get(name)
+                leader = future is None
+                if leader:
+                    future = self._inflight[name] = Future()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+            if not leader:
+                # Look the entry up again once the leader has stored it.
+                future.result()
+                waited = True
+                continue
+            tmp = f"{self._path(name)}.{os.getpid()}.{id(future)}.tmp"
+            try:
+                with self._file_lock(name):
+                    fetched = not os.path.exists(self._path(name))
+                    if fetched:
+                        with open(tmp, "wb") as f:
+                            fetch(f)
+                        os.replace(tmp, self._path(name))
+                with self._lock:
+                    if fetched:
+                        self._store(name)
+                    else:
+                        self.misses -= 1
+                        self.coalesced += 1
+                    f = self._lookup(name, count=False)
+                    del self._inflight[name]
+            except BaseException as e:
+                with self._lock:
+                    self._inflight.pop(name, None)
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                future.set_exception(e)
+                raise
+            future.set_result(None)
+            return f
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "entries": len(self._disk),
+            }
+
+    def _lookup(self, name: str, count=True) -> BinaryIO | None:
+        if name in self._memory:
+            self._memory.move_to_end(name)
+            self.hits += count
+            return BytesIO(self._memory[name])
+        path = self._path(name)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # Evicted, possibly by another process.
+            if name in self._disk:
+                self._disk_bytes -= self._disk.pop(name)
+            return None
+        if name not in self._disk:
+            # Stored by another process.
+            self._store(name)
+        os.utime(path)
+        self._disk.move_to_end(name)
+        self.disk_hits += count
+        if self._disk[name] <= self.max_memory_bytes:
+            self._remember(name, f.read())
+            f.seek(0)
+        return f
+
+    def _store(self, name: str):
+        size = os.path.getsize(self._path(name))
+        if name not in self._disk:
+            self._disk[name] = size
+            self._disk_bytes += size
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            evicted, evicted_size = self._disk.popitem(last=False)
+            self._disk_bytes -= evicted_size
+            self.evictions += 1
+            try:
+                os.remove(self._path(evicted))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, name: str, data: bytes):
+        self._memory[name] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _load(self):
+        # Pick up archives left by a previous process, oldest first.
+        entries = []
+        for filename in os.listdir(self.directory):
+            name = filename.removesuffix(".zip")
+            path = os.path.join(self.directory, filename)
+            if name != filename and _HASH.fullmatch(name):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, name, stat.st_size))
+            elif name != filename:
+                # Named after its key, by an earlier version.
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+
+    @contextmanager
+    def _file_lock(self, name: str):
+        # Striped so lock files don't pile up next to evicted archives.
+        stripe = int(name, 16) % LOCK_STRIPES
+        with open(os.path.join(self.directory, f".{stripe}.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _path(self, name: str):
+        return os.path.join(self.directory, f"{name}.zip")
+
@@ -0,0 +1,48 @@
+import os
+
+from .env import JOB_CPU_OVERCOMMIT, JOB_MEMORY_BYTES
+
+
+def admit(running: int) -> bool:
+    # Another job starts while there is a CPU for it and room for a typical
+    # run's memory. Terraform spends most of a run waiting on provider APIs,
+    # hence the overcommit. Memory is read as it is now, so jobs that just
+    # started and haven't grown yet aren't accounted for.
+    if running >= cpus() * JOB_CPU_OVERCOMMIT:
+        return False
+    available = available_memory()
+    return available is None or available >= JOB_MEMORY_BYTES
+
+
+def cpus() -> float:
+    # The container's CPU quota when it has one (cgroup v2), otherwise the
+    # CPUs this process may run on.
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+
+def available_memory() -> int | None:
+    # Headroom under the container's memory limit when it has one (cgroup
+    # v2), otherwise what the kernel reports as available.
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            with open("/sys/fs/cgroup/memory.current") as f:
+                return int(limit) - int(f.read())
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
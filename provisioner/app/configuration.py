@@ -0,0 +1,61 @@
+import os
+import zlib
+from collections.abc import Mapping
+from shutil import copyfileobj
+from typing import BinaryIO, Iterator
+from zipfile import ZipFile, ZipInfo
+
+# Read size when checksumming a file already in a working directory.
+CHUNK_BYTES = 1 << 20
+
+
+class Configuration(Mapping[str, bytes]):
+    # A commit's files by name, read from its archive one at a time when
+    # asked for, so memory doesn't grow with the size of the repo. The
+    # configuration is flat, so directories in the archive are dropped.
+    def __init__(self, archive: BinaryIO) -> None:
+        self._archive = archive
+        self._zip = ZipFile(archive)
+        self._members: dict[str, ZipInfo] = {
+            os.path.basename(member.filename): member
+            for member in self._zip.infolist()
+            if not member.is_dir()
+        }
+
+    def __getitem__(self, name: str) -> bytes:
+        return self._zip.read(self._members[name])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._members)
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def same(self, name: str, path: str) -> bool:
+        # Whether the file at `path` already holds `name`, by size and the
+        # CRC-32 the archive records, without decompressing anything.
+        member = self._members[name]
+        try:
+            if os.path.getsize(path) != member.file_size:
+                return False
+            crc = 0
+            with open(path, "rb") as f:
+                while chunk := f.read(CHUNK_BYTES):
+                    crc = zlib.crc32(chunk, crc)
+        except FileNotFoundError:
+            return False
+        return crc == member.CRC
+
+    def extract(self, name: str, path: str):
+        with self._zip.open(self._members[name]) as src, open(path, "wb") as dst:
+            copyfileobj(src, dst, CHUNK_BYTES)
+
+    def close(self):
+        self._zip.close()
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,4 +1,4 @@
-from os import environ
+from os import environ, path
 
 TMP_DIR = environ["TMP_DIR"]
 TF_EXE = environ["TF_EXE"]
@@ -7,3 +7,37 @@ GITHUB_ORG = environ["GITHUB_ORG"]
 GITHUB_APP_ID = environ["GITHUB_APP_ID"]
 GITHUB_APP_INSTALLATION_ID = environ["GITHUB_APP_INSTALLATION_ID"]
 GITHUB_APP_PRIVATE_KEY = environ["GITHUB_APP_PRIVATE_KEY"]
+GITHUB_API_URL = environ.get("GITHUB_API_URL", "https://api.github.com")
+GITHUB_MAX_CONNECTIONS = int(environ.get("GITHUB_MAX_CONNECTIONS", "16"))
+GITHUB_TIMEOUT = float(environ.get("GITHUB_TIMEOUT", "60"))
+ARCHIVE_CACHE_DIR = environ.get("ARCHIVE_CACHE_DIR", path.join(TMP_DIR, "archives"))
+ARCHIVE_CACHE_MEMORY_BYTES = int(environ.get("ARCHIVE_CACHE_MEMORY_BYTES", 64 << 20))
+ARCHIVE_CACHE_DISK_BYTES = int(environ.get("ARCHIVE_CACHE_DISK_BYTES", 1 << 30))
+TF_PLUGIN_CACHE_DIR = environ.get(
+    "TF_PLUGIN_CACHE_DIR", path.join(TMP_DIR, "plugin-cache")
+)
+TF_PROVIDER_MIRROR = environ.get("TF_PROVIDER_MIRROR")
+JOB_BACKEND = environ.get("JOB_BACKEND", "memory")
+JOB_DB = environ.get("JOB_DB", path.join(TMP_DIR, "jobs.sqlite3"))
+JOB_CONCURRENCY = int(environ.get("JOB_CONCURRENCY", "2"))
+LOCK_BACKEND = environ.get("LOCK_BACKEND", "memory")
+LOCK_BUCKET = environ.get("LOCK_BUCKET", PLAN_BUCKET)
+OUTPUT_SINK = environ.get("OUTPUT_SINK", "firestore")
+OUTPUT_BATCH_SIZE = int(environ.get("OUTPUT_BATCH_SIZE", "500"))
+OUTPUT_FLUSH_SECONDS = float(environ.get("OUTPUT_FLUSH_SECONDS", "0.5"))
+OUTPUT_MAX_PENDING = int(environ.get("OUTPUT_MAX_PENDING", "5000"))
+TF_RUN_TIMEOUT = float(environ.get("TF_RUN_TIMEOUT", "3600"))
+TF_TERMINATE_GRACE = float(environ.get("TF_TERMINATE_GRACE", "30"))
+ARTIFACT_WORKERS = int(environ.get("ARTIFACT_WORKERS", "8"))
+ARTIFACT_PART_BYTES = int(environ.get("ARTIFACT_PART_BYTES", 32 << 20))
+ARTIFACT_ZSTD_LEVEL = int(environ.get("ARTIFACT_ZSTD_LEVEL", "3"))
+WORKDIR_POOL_DIR = environ.get("WORKDIR_POOL_DIR", path.join(TMP_DIR, "workdirs"))
+WORKDIR_POOL_BYTES = int(environ.get("WORKDIR_POOL_BYTES", 2 << 30))
+WORKDIR_POOL_MAX_AGE = float(environ.get("WORKDIR_POOL_MAX_AGE", 24 * 3600))
+WORKSPACE_CACHE_TTL = float(environ.get("WORKSPACE_CACHE_TTL", "300"))
+JOB_CPU_OVERCOMMIT = float(environ.get("JOB_CPU_OVERCOMMIT", "2"))
+JOB_MEMORY_BYTES = int(environ.get("JOB_MEMORY_BYTES", 512 << 20))
+SUMMARY_CACHE_BYTES = int(environ.get("SUMMARY_CACHE_BYTES", 64 << 20))
+TARGET_MAX_FRACTION = float(environ.get("TARGET_MAX_FRACTION", "0.5"))
+METRICS = environ.get("METRICS", "0") == "1"
+JSON_BACKEND = environ.get("JSON_BACKEND", "auto")
@@ -1,47 +1,186 @@
+import atexit
+import re
 from time import time
+from typing import BinaryIO
+from datetime import datetime
+from threading import Lock, Thread
 
 import requests 
 import jwt
+from requests.adapters import HTTPAdapter
 
+from .metrics import span
 from .env import (
+    GITHUB_API_URL,
     GITHUB_ORG,
     GITHUB_APP_ID,
     GITHUB_APP_PRIVATE_KEY,
     GITHUB_APP_INSTALLATION_ID,
+    GITHUB_MAX_CONNECTIONS,
+    GITHUB_TIMEOUT,
 )
 
-BASE_URL = "https://api.github.com"
+BASE_URL = GITHUB_API_URL
 
-def get_repo_zip(repo: str, ref: str):
-    token = _get_access_token()
-    r = requests.get(
-        f"{BASE_URL}/repos/{GITHUB_ORG}/{repo}/zipball/{ref}",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/vnd.github.v3+json",
-        },
-    )
+# One keep-alive pool per process, shared by every request thread.
+session = requests.Session()
+session.mount(
+    "https://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=GITHUB_MAX_CONNECTIONS),
+)
+atexit.register(session.close)
+
+# Installation tokens live for an hour. Callers keep using the cached token
+# until it is within EXPIRY_MARGIN seconds of expiring; once it is within
+# REFRESH_MARGIN a single background refresh is started so requests never
+# wait on the round-trip in the steady state.
+REFRESH_MARGIN = 600
+EXPIRY_MARGIN = 60
+
+COMMIT_SHA = re.compile(r"[0-9a-f]{40}")
+
+# (etag, sha) of the last lookup of each "{repo}@{ref}"; resolving a ref that
+# hasn't moved is then a 304, which doesn't count against the rate limit.
+_refs: dict[str, tuple[str, str]] = {}
+_refs_lock = Lock()
+
+
+class InstallationTokenProvider:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._lock = Lock()
+        self._refresh_lock = Lock()
+
+    def get(self) -> str:
+        token = self._cached()
+        if token is not None:
+            return token
+        with self._refresh_lock:
+            # Whoever held the lock before us may already have refreshed.
+            token = self._cached(count=False)
+            if token is not None:
+                return token
+            with self._lock:
+                self.misses += 1
+            return self._refresh()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "expires_in": max(0, int(self._expires_at - time())),
+            }
+
+    def _cached(self, count=True) -> str | None:
+        now = time()
+        with self._lock:
+            if self._token is None or now >= self._expires_at - EXPIRY_MARGIN:
+                return None
+            if count:
+                self.hits += 1
+            stale = now >= self._expires_at - REFRESH_MARGIN and not self._refreshing
+            if stale:
+                self._refreshing = True
+            token = self._token
+        if stale:
+            Thread(target=self._refresh_in_background, daemon=True).start()
+        return token
+
+    def _refresh_in_background(self):
+        try:
+            with self._refresh_lock:
+                if time() < self._expires_at - REFRESH_MARGIN:
+                    return
+                self._refresh()
+        except Exception as e:
+            # The current token is still valid; the next caller retries.
+            print("GITHUB token refresh failed:", e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh(self) -> str:
+        with span("github_token"):
+            return self._mint()
+
+    def _mint(self) -> str:
+        now = int(time())
+        app_jwt = jwt.encode(
+            {
+                "iat": now - 60,
+                "exp": now + 60,
+                "iss": GITHUB_APP_ID,
+            },
+            GITHUB_APP_PRIVATE_KEY,
+            algorithm="RS256",
+        )
+        r = session.post(
+            f"{BASE_URL}/app/installations/{GITHUB_APP_INSTALLATION_ID}/access_tokens",
+            headers={
+                "Accept": "application/vnd.github+json",
+                "Authorization": f"Bearer {app_jwt}",
+                "X-GitHub-Api-Version": "2022-11-28",
+            },
+            timeout=GITHUB_TIMEOUT,
+        )
+        r.raise_for_status()
+        body = r.json()
+        expires_at = datetime.strptime(body["expires_at"], "%Y-%m-%dT%H:%M:%S%z")
+        with self._lock:
+            self._token = body["token"]
+            self._expires_at = expires_at.timestamp()
+            self.refreshes += 1
+        return body["token"]
+
+
+tokens = InstallationTokenProvider()
+
+
+def resolve_ref(repo: str, ref: str) -> str:
+    if COMMIT_SHA.fullmatch(ref):
+        return ref
+    headers = {
+        "Authorization": f"Bearer {tokens.get()}",
+        "Accept": "application/vnd.github.sha",
+    }
+    with _refs_lock:
+        cached = _refs.get(f"{repo}@{ref}")
+    if cached:
+        headers["If-None-Match"] = cached[0]
+    with span("github_request", method="GET", endpoint="commits"):
+        r = session.get(
+            f"{BASE_URL}/repos/{GITHUB_ORG}/{repo}/commits/{ref}",
+            headers=headers,
+            timeout=GITHUB_TIMEOUT,
+        )
+    if r.status_code == 304 and cached:
+        return cached[1]
     r.raise_for_status()
-    return r
+    sha = r.text.strip()
+    if r.headers.get("ETag"):
+        with _refs_lock:
+            _refs[f"{repo}@{ref}"] = (r.headers["ETag"], sha)
+    return sha
 
 
-def _get_access_token() -> str:
-    now = int(time())
-    app_jwt = jwt.encode(
-        {
-            "iat": now - 60,
-            "exp": now + 60,
-            "iss": GITHUB_APP_ID,
-        },
-        GITHUB_APP_PRIVATE_KEY,
-        algorithm="RS256",
-    )
-    r = requests.post(
-        f"{BASE_URL}/app/installations/{GITHUB_APP_INSTALLATION_ID}/access_tokens",
+def download_repo_zip(repo: str, ref: str, f: BinaryIO):
+    token = tokens.get()
+    with span("github_zipball"), session.get(
+        f"{BASE_URL}/repos/{GITHUB_ORG}/{repo}/zipball/{ref}",
         headers={
-            "Accept": "application/vnd.github+json",
-            "Authorization": f"Bearer {app_jwt}",
-            "X-GitHub-Api-Version": "2022-11-28",
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/vnd.github.v3+json",
         },
-    )
-    return r.json()["token"]
+        timeout=GITHUB_TIMEOUT,
+        stream=True,
+    ) as r:
+        r.raise_for_status()
+        for chunk in r.iter_content(chunk_size=1 << 16):
+            f.write(chunk)
@@ -0,0 +1,604 @@
+import os
+import signal
+import sqlite3
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from contextlib import closing
+from datetime import datetime
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Iterator
+from uuid import uuid4
+from zoneinfo import ZoneInfo
+
+from . import metrics, serializer
+from .locks import LockBackend
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# How often to retry keys held by another instance.
+LOCK_POLL_SECONDS = 5
+# How often to ask `admit` again while it holds jobs back.
+ADMIT_POLL_SECONDS = 1
+
+Handler = Callable[[dict[str, Any]], dict[str, Any]]
+# Turns the result of a job into the result for an identical job that was
+# coalesced into it.
+Share = Callable[[dict[str, Any], dict[str, Any]], dict[str, Any]]
+# Whether another job may start while `running` jobs are running.
+Admit = Callable[[int], bool]
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    # Job records double as the queue: queued() lists what still has to run,
+    # in submission order, and transition() lets exactly one runner claim a
+    # job even when several processes share the store.
+    def create(self, job: dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        raise NotImplementedError
+
+    def transition(self, job_id: str, current: str, status: str) -> bool:
+        raise NotImplementedError
+
+    def queued(self) -> list[dict[str, Any]]:
+        raise NotImplementedError
+
+
+class MemoryJobStore(JobStore):
+    def __init__(self) -> None:
+        self._jobs: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, job: dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields, updated=_now())
+
+    def transition(self, job_id: str, current: str, status: str) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != current:
+                return False
+            job.update(status=status, updated=_now())
+            return True
+
+    def queued(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                dict(job)
+                for job in self._jobs.values()
+                if job["status"] == QUEUED and not job.get("coalesced_into")
+            ]
+
+
+class SQLiteJobStore(JobStore):
+    FIELDS = (
+        "id",
+        "kind",
+        "status",
+        "request",
+        "result",
+        "error",
+        "lock_key",
+        "coalesced_into",
+        "created",
+        "updated",
+        "request_id",
+        "runner_pid",
+    )
+    ENCODED = ("request", "result")
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT, status TEXT, request TEXT, "
+            "result TEXT, error TEXT, lock_key TEXT, coalesced_into TEXT, "
+            "created TEXT, updated TEXT, request_id TEXT, runner_pid INTEGER)"
+        )
+        for column in ("request_id TEXT", "runner_pid INTEGER"):
+            try:
+                self._execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                # Created with the column, or already migrated.
+                pass
+        self._fail_orphans()
+
+    def create(self, job: dict[str, Any]) -> None:
+        values = [self._encode(field, job.get(field)) for field in self.FIELDS]
+        self._execute(
+            f"INSERT INTO jobs ({', '.join(self.FIELDS)}) "
+            f"VALUES ({', '.join('?' for _ in self.FIELDS)})",
+            values,
+        )
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        rows = self._execute(
+            f"SELECT {', '.join(self.FIELDS)} FROM jobs WHERE id = ?", [job_id]
+        ).fetchall()
+        return self._decode(rows[0]) if rows else None
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        fields["updated"] = _now()
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        values = [self._encode(field, value) for field, value in fields.items()]
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*values, job_id])
+
+    def transition(self, job_id: str, current: str, status: str) -> bool:
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status = ?",
+            [status, _now(), job_id, current],
+        )
+        return cursor.rowcount == 1
+
+    def queued(self) -> list[dict[str, Any]]:
+        rows = self._execute(
+            f"SELECT {', '.join(self.FIELDS)} FROM jobs "
+            "WHERE status = ? AND coalesced_into IS NULL ORDER BY rowid",
+            [QUEUED],
+        ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def _fail_orphans(self):
+        # Jobs that were running, or waiting on another job's result, in a
+        # server process that is gone will never finish: nothing requeues a
+        # running job, and followers only hear from the process that
+        # coalesced them. Processes still alive may share the database.
+        rows = self._execute(
+            "SELECT id, status, runner_pid FROM jobs "
+            "WHERE status = ? OR (status = ? AND coalesced_into IS NOT NULL)",
+            [RUNNING, QUEUED],
+        ).fetchall()
+        for job_id, status, pid in rows:
+            # Containers hand out the same pids on every start, and this
+            # process hasn't run anything yet.
+            if pid is None or pid == os.getpid() or not _alive(pid):
+                self._execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated = ? "
+                    "WHERE id = ? AND status = ?",
+                    [FAILED, "Interrupted by a server restart", _now(), job_id, status],
+                )
+
+    def _encode(self, field: str, value: Any):
+        return serializer.dumps(value) if field in self.ENCODED else value
+
+    def _decode(self, row: tuple):
+        return {
+            field: serializer.loads(value) if field in self.ENCODED and value else value
+            for field, value in zip(self.FIELDS, row)
+        }
+
+    def _execute(self, sql: str, params: list[Any] | None = None):
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            with db:
+                cursor = db.execute(sql, params or [])
+                # Materialize before the connection closes.
+                return _Result(cursor.fetchall(), cursor.rowcount)
+
+
+class JobRunner:
+    # Runs jobs on a fixed number of worker processes. Each worker is a
+    # long-lived spawned process, so per-process state (GitHub token, archive
+    # cache, GCS client) stays warm between jobs, and a running job can be
+    # cancelled by signalling the one process that owns it.
+    #
+    # Jobs with the same lock_key never run at the same time: a job whose
+    # key is held stays queued, in order, until the holder finishes. A job
+    # submitted with the coalesce_key of a job still in flight does not run
+    # at all; it receives the other job's result through `share`.
+    #
+    # `admit` can hold jobs back below `concurrency` while the machine is
+    # short on CPU or memory; one job is always allowed to run.
+    def __init__(
+        self,
+        store: JobStore,
+        handlers: dict[str, Handler],
+        concurrency: int,
+        worker_stats: Callable[[], dict[str, Any]] | None = None,
+        locks: LockBackend | None = None,
+        share: dict[str, Share] | None = None,
+        admit: Admit | None = None,
+    ) -> None:
+        self.store = store
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.worker_stats = worker_stats
+        self.locks = locks
+        self.share = share or {}
+        self.admit = admit
+        self._queue: deque[tuple[str, str | None]] = deque()
+        self._held: set[str] = set()
+        self._inflight: dict[str, str] = {}
+        self._followers: dict[str, list[str]] = {}
+        self._cancelling: set[str] = set()
+        self._active = 0
+        self._cond = threading.Condition()
+        self._done = threading.Condition()
+        self._workers: list[_Worker] = []
+
+    def submit(
+        self,
+        kind: str,
+        request: dict[str, Any],
+        lock_key: str | None = None,
+        coalesce_key: str | None = None,
+    ) -> dict[str, Any]:
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        now = _now()
+        job = {
+            "id": uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "request": request,
+            "result": None,
+            "error": None,
+            "lock_key": lock_key,
+            "coalesced_into": None,
+            "created": now,
+            "updated": now,
+            # The request that submitted the job, for following it into the
+            # worker's logs and output.
+            "request_id": metrics.request_id.get(),
+            # The server process that owns the job, see _fail_orphans.
+            "runner_pid": os.getpid(),
+        }
+        with self._cond:
+            self._start()
+            primary = self._inflight.get(coalesce_key) if coalesce_key else None
+            if primary is not None and kind in self.share:
+                job["coalesced_into"] = primary
+                self.store.create(job)
+                self._followers[primary].append(job["id"])
+                return job
+            self.store.create(job)
+            if coalesce_key:
+                self._inflight[coalesce_key] = job["id"]
+                self._followers[job["id"]] = []
+            self._queue.append((job["id"], lock_key))
+            self._cond.notify()
+        return job
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        return self.store.get(job_id)
+
+    def wait(self, job_ids: list[str]) -> Iterator[dict[str, Any]]:
+        # Yields each job once it has finished, in the order they finish.
+        pending = list(job_ids)
+        while pending:
+            with self._done:
+                finished = []
+                for job_id in pending:
+                    job = self.store.get(job_id)
+                    if job is None:
+                        job = {"id": job_id, "status": FAILED, "error": "Job not found"}
+                    if job["status"] in FINISHED:
+                        finished.append(job)
+                if not finished:
+                    # Polled as well, in case a job is finished elsewhere.
+                    self._done.wait(LOCK_POLL_SECONDS)
+                    continue
+            for job in finished:
+                pending.remove(job["id"])
+                yield job
+
+    def cancel(self, job_id: str) -> dict[str, Any] | None:
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        if self.store.transition(job_id, QUEUED, CANCELLED):
+            with self._cond:
+                for item in self._queue:
+                    if item[0] == job_id:
+                        self._queue.remove(item)
+                        break
+                self._finish(job_id, None, CANCELLED, None)
+        else:
+            self._cancelling.add(job_id)
+            for worker in self._workers:
+                worker.cancel(job_id)
+        return self.store.get(job_id)
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "queued": queued,
+            "running": self._active,
+            "locked": sorted(self._held),
+            "concurrency": self.concurrency,
+            "workers": [worker.stats for worker in self._workers if worker.stats],
+        }
+
+    def _start(self):
+        # Workers are spawned on first use, so importing the app (including
+        # from inside a worker) never forks anything.
+        if self._workers:
+            return
+        self._queue.extend((job["id"], job["lock_key"]) for job in self.store.queued())
+        self._workers = [_Worker(self) for _ in range(self.concurrency)]
+        for worker in self._workers:
+            worker.start()
+
+    def _next(self) -> tuple[str, str | None]:
+        with self._cond:
+            while True:
+                admitted = not self._active or not self.admit or self.admit(self._active)
+                if self._queue and not admitted:
+                    # Resources free up without anyone notifying.
+                    self._cond.wait(ADMIT_POLL_SECONDS)
+                    continue
+                for item in list(self._queue):
+                    job_id, key = item
+                    if key is not None and not self._acquire(key):
+                        continue
+                    self._queue.remove(item)
+                    if self.store.transition(job_id, QUEUED, RUNNING):
+                        self._active += 1
+                        # Possibly queued by a process that has since stopped.
+                        self.store.update(job_id, runner_pid=os.getpid())
+                        return item
+                    if key is not None:
+                        self._release(key)
+                # Only keys held elsewhere need polling; local releases notify.
+                self._cond.wait(LOCK_POLL_SECONDS if self._queue else None)
+
+    def _finish(
+        self, job_id: str, held: str | None, status: str, value: Any, ran: bool = False
+    ):
+        with self._cond:
+            if ran:
+                self._active -= 1
+            if held is not None:
+                self._release(held)
+            followers = self._followers.pop(job_id, [])
+            coalesce_key = next(
+                (key for key, primary in self._inflight.items() if primary == job_id),
+                None,
+            )
+            if coalesce_key is not None:
+                del self._inflight[coalesce_key]
+            if status == CANCELLED:
+                followers = [
+                    follower
+                    for follower in followers
+                    if self.store.get(follower)["status"] == QUEUED
+                ]
+                if followers:
+                    # Someone else still wants this run: promote a follower.
+                    promoted, followers = followers[0], followers[1:]
+                    self.store.update(promoted, coalesced_into=None)
+                    for follower in followers:
+                        self.store.update(follower, coalesced_into=promoted)
+                    self._followers[promoted] = followers
+                    if coalesce_key is not None:
+                        self._inflight[coalesce_key] = promoted
+                    lock_key = self.store.get(promoted)["lock_key"]
+                    self._queue.append((promoted, lock_key))
+                    followers = []
+            self._cond.notify_all()
+        for follower in followers:
+            self._share(follower, status, value)
+        with self._done:
+            self._done.notify_all()
+
+    def _share(self, follower: str, status: str, value: Any):
+        if not self.store.transition(follower, QUEUED, RUNNING):
+            return
+        if status != SUCCEEDED:
+            self.store.update(follower, status=status, error=value)
+            return
+        job = self.store.get(follower)
+        try:
+            result = self.share[job["kind"]](value, job["request"])
+        except Exception as e:
+            traceback.print_exc()
+            self.store.update(follower, status=FAILED, error=str(e))
+            return
+        self.store.update(follower, status=SUCCEEDED, result=result)
+
+    def _acquire(self, key: str) -> bool:
+        if key in self._held:
+            return False
+        if self.locks is not None and not self.locks.try_acquire(key):
+            return False
+        self._held.add(key)
+        return True
+
+    def _release(self, key: str):
+        self._held.discard(key)
+        if self.locks is not None:
+            try:
+                self.locks.release(key)
+            except Exception:
+                traceback.print_exc()
+
+
+class _Worker:
+    def __init__(self, runner: JobRunner) -> None:
+        self.runner = runner
+        self.current: str | None = None
+        self.stats: dict[str, Any] | None = None
+        self._process: multiprocessing.process.BaseProcess | None = None
+        self._conn: Connection | None = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def cancel(self, job_id: str):
+        with self._lock:
+            if self.current == job_id and self._process is not None:
+                os.kill(self._process.pid, signal.SIGUSR1)
+
+    def _loop(self):
+        while True:
+            job_id, key = self.runner._next()
+            try:
+                status, value = self._run(job_id)
+            except Exception as e:
+                # Whatever went wrong, the job must not stay running: it
+                # fails, and its key and followers are released below.
+                traceback.print_exc()
+                status, value = FAILED, f"Job worker failed: {e}"
+                self._discard()
+                self.runner._cancelling.discard(job_id)
+                try:
+                    self.runner.store.update(job_id, status=status, error=value)
+                except Exception:
+                    traceback.print_exc()
+            self.runner._finish(job_id, key, status, value, ran=True)
+
+    def _run(self, job_id: str) -> tuple[str, Any]:
+        job = self.runner.store.get(job_id)
+        try:
+            if self._process is None or not self._process.is_alive():
+                self._spawn()
+            with self._lock:
+                self.current = job_id
+            if job_id in self.runner._cancelling:
+                status, value, stats = CANCELLED, "Cancelled", None
+            else:
+                metrics.observe("job_queue", _age(job["created"]), kind=job["kind"])
+                self._conn.send((job["kind"], job["request"], job.get("request_id")))
+                status, value, stats, measured = self._conn.recv()
+                try:
+                    metrics.histograms.merge(measured)
+                except Exception:
+                    # Lost measurements aren't worth failing the job.
+                    traceback.print_exc()
+        except (EOFError, OSError):
+            status, value, stats = FAILED, "Job worker exited unexpectedly", None
+            with self._lock:
+                self._process = None
+        # From submission to finish, time spent queued included.
+        metrics.observe("job", _age(job["created"]), kind=job["kind"], status=status)
+        with self._lock:
+            self.current = None
+        self.runner._cancelling.discard(job_id)
+        if stats:
+            self.stats = stats
+        if status == SUCCEEDED:
+            self.runner.store.update(job_id, status=status, result=value)
+        else:
+            self.runner.store.update(job_id, status=status, error=value)
+        return status, value
+
+    def _discard(self):
+        # After an unexpected error the pipe may be out of step with the
+        # process, so the next job gets a new one.
+        with self._lock:
+            self.current = None
+            process, self._process = self._process, None
+        if process is not None and process.is_alive():
+            process.kill()
+
+    def _spawn(self):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self._process = context.Process(
+            target=_serve,
+            args=(child, self.runner.handlers, self.runner.worker_stats),
+            daemon=True,
+        )
+        self._process.start()
+        child.close()
+        # Wait until the cancel handler is installed before handing out work.
+        self._conn.recv()
+
+
+class _Result:
+    def __init__(self, rows: list[tuple], rowcount: int) -> None:
+        self.rows = rows
+        self.rowcount = rowcount
+
+    def fetchall(self):
+        return self.rows
+
+
+_running = False
+
+
+def _serve(
+    conn: Connection,
+    handlers: dict[str, Handler],
+    worker_stats: Callable[[], dict[str, Any]] | None,
+):
+    global _running
+    signal.signal(signal.SIGUSR1, _cancel)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn.send("ready")
+    while True:
+        try:
+            kind, request, request_id = conn.recv()
+        except EOFError:
+            return
+        metrics.request_id.set(request_id)
+        print(f"running {kind} job for request {request_id}")
+        try:
+            _running = True
+            try:
+                outcome = (SUCCEEDED, handlers[kind](request))
+            finally:
+                _running = False
+        except JobCancelled:
+            outcome = (CANCELLED, "Cancelled")
+        except Exception as e:
+            traceback.print_exc()
+            outcome = (FAILED, str(e) or type(e).__name__)
+        conn.send(
+            (
+                *outcome,
+                worker_stats() if worker_stats else None,
+                # Only what this job added; the server keeps the totals.
+                metrics.histograms.drain(),
+            )
+        )
+
+
+def _cancel(signum, frame):
+    if _running:
+        raise JobCancelled()
+
+
+def _alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Someone else's process.
+        pass
+    return True
+
+
+def _now():
+    return datetime.utcnow().replace(tzinfo=ZoneInfo("UTC")).isoformat()
+
+
+def _age(timestamp: str):
+    # Seconds since a _now() timestamp.
+    return (datetime.fromisoformat(_now()) - datetime.fromisoformat(timestamp)).total_seconds()
@@ -0,0 +1,98 @@
+import json
+import traceback
+from socket import gethostname
+from os import getpid
+from threading import Lock, Thread
+from time import sleep, time
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from google.cloud import storage
+
+
+class LockBackend:
+    # Cross-process exclusion for a (repo, workspace) key. The job runner
+    # already serializes keys within a process; a backend only has to stop
+    # other instances from running the same key at the same time.
+    def try_acquire(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def release(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class GCSLocks(LockBackend):
+    # One object per held key, created with if_generation_match=0 so only
+    # one instance can win. Held leases are rewritten every ttl/3, each write
+    # a new generation with a new creation time, so a lease whose creation
+    # is more than `ttl` ago belongs to an instance that stopped and is
+    # taken over. Every write and the delete on release are conditional on
+    # the generation this instance last wrote, so an instance that lost its
+    # lease can't touch the new holder's.
+    def __init__(
+        self, client: storage.Client, bucket: str, prefix: str = "locks/", ttl: float = 900
+    ) -> None:
+        self.bucket = client.bucket(bucket)
+        self.prefix = prefix
+        self.ttl = ttl
+        self.owner = f"{gethostname()}:{getpid()}"
+        # Generation of each lease held.
+        self._held: dict[str, int] = {}
+        self._lock = Lock()
+        self._renewer: Thread | None = None
+
+    def try_acquire(self, key: str) -> bool:
+        blob = self.bucket.blob(self.prefix + key)
+        try:
+            blob.upload_from_string(self._lease(), if_generation_match=0)
+        except PreconditionFailed:
+            try:
+                blob.reload()
+                if blob.time_created.timestamp() + self.ttl > time():
+                    return False
+                blob.delete(if_generation_match=blob.generation)
+                blob.upload_from_string(self._lease(), if_generation_match=0)
+            except (NotFound, PreconditionFailed):
+                return False
+        with self._lock:
+            self._held[key] = blob.generation
+            if self._renewer is None:
+                self._renewer = Thread(target=self._renew, daemon=True)
+                self._renewer.start()
+        return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            generation = self._held.pop(key, None)
+            if generation is None:
+                return
+            try:
+                self.bucket.blob(self.prefix + key).delete(if_generation_match=generation)
+            except (NotFound, PreconditionFailed):
+                # Expired and taken over; the lease is someone else's now.
+                pass
+
+    def _renew(self):
+        while True:
+            sleep(self.ttl / 3)
+            with self._lock:
+                keys = list(self._held)
+            for key in keys:
+                # Under the lock, so a release can't delete the generation
+                # being replaced.
+                with self._lock:
+                    generation = self._held.get(key)
+                    if generation is None:
+                        continue
+                    blob = self.bucket.blob(self.prefix + key)
+                    try:
+                        blob.upload_from_string(self._lease(), if_generation_match=generation)
+                        self._held[key] = blob.generation
+                    except (NotFound, PreconditionFailed):
+                        print(f"Lost the lease on {key} to another instance")
+                        del self._held[key]
+                    except Exception:
+                        # Retried next round, well within the ttl.
+                        traceback.print_exc()
+
+    def _lease(self):
+        return json.dumps({"owner": self.owner, "acquired": time()})
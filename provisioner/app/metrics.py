@@ -0,0 +1,163 @@
+import re
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from uuid import uuid4
+
+from .env import METRICS
+
+# Upper bounds, in seconds, of the buckets every duration is counted in;
+# wide enough for a GitHub call and an hour-long apply alike.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+PREFIX = "blueform"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Request ids accepted from callers; anything else is replaced.
+REQUEST_ID = re.compile(r"[\w.:-]{1,128}")
+
+# Set for the duration of a request, and of any job it submitted.
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+# (start, spans finished so far) of the current request, for Server-Timing.
+_request: ContextVar[tuple[float, list[tuple[str, float]]] | None] = ContextVar(
+    "request", default=None
+)
+
+# (name, sorted labels)
+Key = tuple[str, tuple[tuple[str, str], ...]]
+
+
+class Histograms:
+    # Durations by name and labels. Each series is its per-bucket counts
+    # (not cumulative) followed by the sum, so series from job worker
+    # processes can be added into the server's.
+    def __init__(self) -> None:
+        self._series: dict[Key, list[float]] = {}
+        self._lock = Lock()
+
+    def observe(self, name: str, seconds: float, labels: dict[str, str]):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(BUCKETS) + 2)
+            series[bisect_left(BUCKETS, seconds)] += 1
+            series[-1] += seconds
+
+    def drain(self) -> list[tuple[Key, list[float]]]:
+        # Everything observed since the last drain.
+        with self._lock:
+            drained, self._series = list(self._series.items()), {}
+        return drained
+
+    def merge(self, drained: list[tuple[Key, list[float]]]):
+        with self._lock:
+            for key, counts in drained:
+                series = self._series.setdefault(key, [0] * len(counts))
+                for i, count in enumerate(counts):
+                    series[i] += count
+
+    def render(self) -> str:
+        # Prometheus text exposition format, a {PREFIX}_{name}_seconds
+        # histogram per name.
+        with self._lock:
+            series = sorted((key, list(counts)) for key, counts in self._series.items())
+        lines = []
+        family = None
+        for (name, labels), counts in series:
+            metric = f"{PREFIX}_{name}_seconds"
+            if metric != family:
+                family = metric
+                lines.append(f"# TYPE {metric} histogram")
+            total = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), counts):
+                total += count
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{metric}_bucket{_labels(labels, le=le)} {total}")
+            lines.append(f"{metric}_sum{_labels(labels)} {counts[-1]:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+
+histograms = Histograms()
+
+
+def span(name: str, **labels: str):
+    # Times a `with` block into the `name` histogram and, inside a request,
+    # its Server-Timing header. Does nothing unless METRICS is set.
+    return _Span(name, labels) if METRICS else _DISABLED
+
+
+class _Span:
+    def __init__(self, name: str, labels: dict[str, str]) -> None:
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        observe(self.name, perf_counter() - self.start, **self.labels)
+
+
+_DISABLED = nullcontext()
+
+
+def observe(name: str, seconds: float, **labels: str):
+    if not METRICS:
+        return
+    histograms.observe(name, seconds, labels)
+    current = _request.get()
+    if current is not None:
+        current[1].append((name, seconds))
+
+
+def begin(incoming: str | None) -> str:
+    # Starts a request and returns its id: the caller's X-Request-ID when it
+    # sent a usable one, so a request can be followed across services.
+    rid = incoming if incoming and REQUEST_ID.fullmatch(incoming) else uuid4().hex
+    request_id.set(rid)
+    _request.set((perf_counter(), []) if METRICS else None)
+    return rid
+
+
+def finish(method: str, route: str, status: int) -> dict[str, str]:
+    # Ends the current request; returns the headers to add to its response.
+    # Spans that finish while a streamed body is sent miss the header but
+    # are still counted.
+    headers = {"X-Request-ID": request_id.get() or ""}
+    current = _request.get()
+    if current is None:
+        return headers
+    _request.set(None)
+    start, spans = current
+    total = perf_counter() - start
+    histograms.observe(
+        "http_request", total, {"method": method, "route": route, "status": str(status)}
+    )
+    phases: dict[str, list[float]] = {}
+    for name, seconds in spans:
+        phase = phases.setdefault(name, [0, 0.0])
+        phase[0] += 1
+        phase[1] += seconds
+    headers["Server-Timing"] = ", ".join(
+        [
+            *(
+                f'{name};dur={seconds * 1000:.1f};desc="{count}x"'
+                for name, (count, seconds) in phases.items()
+            ),
+            f"total;dur={total * 1000:.1f}",
+        ]
+    )
+    return headers
+
+
+def _labels(labels: tuple[tuple[str, str], ...], **extra: str):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+
+def _escape(value: str):
+    return value.replace("\\", r"\\").replace('"', r'\"').replace("\n", r"\n")
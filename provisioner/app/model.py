@@ -25,6 +25,19 @@ class PlanRequest:
     refresh_only: bool = False
     destroy: bool = False
     meta: dict[str, str] = field(default_factory=dict)
+    # Commit `ref` resolved to when the plan was queued.
+    sha: str | None = None
+    # When set, only what changed since this ref is planned, if that can be
+    # worked out (see targets.py).
+    base_ref: str | None = None
+    base_sha: str | None = None
+
+
+@dataclass
+class BatchPlanRequest:
+    # PlanRequest fields for each plan. `meta` is merged into every plan's.
+    plans: list[dict[str, Any]]
+    meta: dict[str, str] = field(default_factory=dict)
 
 
 @dataclass
@@ -0,0 +1,227 @@
+import os
+from hashlib import sha256
+from contextlib import contextmanager
+from shutil import rmtree
+from typing import Any
+from uuid import uuid4
+from zipfile import ZipFile
+
+from google.cloud import storage
+
+from . import artifacts, summary
+from .metrics import span
+from .targets import plan_targets
+from .terraform import Terraform
+from .cache import ArchiveCache
+from .configuration import Configuration
+from .workdirs import Workdir, WorkdirPool, init_fingerprint
+from .workspaces import workspace_cache
+from .env import (
+    TMP_DIR,
+    PLAN_BUCKET,
+    ARCHIVE_CACHE_DIR,
+    ARCHIVE_CACHE_MEMORY_BYTES,
+    ARCHIVE_CACHE_DISK_BYTES,
+    WORKDIR_POOL_DIR,
+    WORKDIR_POOL_BYTES,
+    WORKDIR_POOL_MAX_AGE,
+)
+from .model import ApplyRequest, AutoApplyRequest, PlanRequest, from_json
+from .github import download_repo_zip, resolve_ref, tokens
+
+# Everything here runs inside job worker processes (see jobs.py), so the
+# clients and caches below are per worker and stay warm across jobs.
+gcs = storage.Client()
+archives = ArchiveCache(
+    ARCHIVE_CACHE_DIR,
+    max_memory_bytes=ARCHIVE_CACHE_MEMORY_BYTES,
+    max_disk_bytes=ARCHIVE_CACHE_DISK_BYTES,
+)
+workdirs = WorkdirPool(
+    WORKDIR_POOL_DIR, max_bytes=WORKDIR_POOL_BYTES, max_age=WORKDIR_POOL_MAX_AGE
+)
+
+
+def plan(data: dict[str, Any]):
+    req = from_json(PlanRequest, data)
+    sha, files = read_configuration(req.repo, req.sha or req.ref)
+    with files, workdirs.lease(workdir_key(req.repo, files)) as wd:
+        tf = Terraform(
+            wd.path,
+            repo=req.repo,
+            sha=sha,
+            workspace=req.workspace,
+            plan_id=req.plan_id,
+            **req.meta,
+        )
+        prepare(tf, wd, files)
+        scope = plan_scope(req, files)
+        # TODO: decrypt vars
+        plan_summary = tf.plan(
+            vars=req.vars,
+            refresh_only=req.refresh_only,
+            destroy=req.destroy,
+            targets=scope["targets"],
+        )
+        plan_summary["scope"] = scope
+        with span("gcs_upload", object="summary"):
+            summary.store(gcs.bucket(PLAN_BUCKET), req.plan_id, plan_summary)
+        with span("gcs_upload", object="plan"):
+            artifact = artifacts.upload(
+                gcs.bucket(PLAN_BUCKET),
+                req.plan_id,
+                wd.path,
+                metadata={
+                    "repo": req.repo,
+                    "workspace": req.workspace,
+                    "sha": sha,
+                    "partial": str(scope["partial"]).lower(),
+                },
+            )
+        print(f"plan artifact: {artifact}")
+    return {
+        "message": "Successfully created plan",
+        "plan_id": req.plan_id,
+        "repo": req.repo,
+        "ref": req.ref,
+        "sha": sha,
+        "init_seconds": tf.timings["init"],
+        "warm": wd.warm,
+        "artifact": artifact,
+        "summary": plan_summary["counts"],
+        "scope": scope,
+    }
+
+
+def share_plan(result: dict[str, Any], data: dict[str, Any]):
+    # An identical plan already ran; give this request its own copy of the
+    # manifest and summary under its plan_id. The blobs the manifest points
+    # to are shared.
+    req = from_json(PlanRequest, data)
+    bucket = gcs.bucket(PLAN_BUCKET)
+    summary.copy(bucket, result["plan_id"], req.plan_id)
+    bucket.copy_blob(bucket.blob(result["plan_id"]), bucket, req.plan_id)
+    return {**result, "plan_id": req.plan_id, "coalesced_with": result["plan_id"]}
+
+
+def apply(data: dict[str, Any]):
+    req = from_json(ApplyRequest, data)
+    blob = gcs.bucket(PLAN_BUCKET).get_blob(req.plan_id)
+    if not blob:
+        raise LookupError(f"Plan not found: {req.plan_id}")
+    with transient_directory(TMP_DIR) as td:
+        tfdir = os.path.join(td, "tf")
+        if artifacts.is_manifest(blob):
+            with span("gcs_download", object="plan"):
+                artifact = artifacts.download(blob, tfdir)
+            print(f"plan artifact: {artifact}")
+        else:
+            # Zipped plans from before the manifest format.
+            archive = f"{tfdir}.zip"
+            with span("gcs_download", object="plan"):
+                blob.download_to_filename(archive)
+            with span("zip_extract"), ZipFile(archive) as zf:
+                zf.extractall(tfdir)
+            artifact = None
+        # The plan belongs to the workspace it was made in.
+        workspace = (blob.metadata or {}).get("workspace")
+        tf = Terraform(tfdir, plan_id=req.plan_id, workspace=workspace, **req.meta)
+        tf.init()
+        tf.apply()
+    return {
+        "message": "Successfully applied plan",
+        "plan_id": req.plan_id,
+        "init_seconds": tf.timings["init"],
+        "artifact": artifact,
+    }
+
+
+def auto_apply(data: dict[str, Any]):
+    req = from_json(AutoApplyRequest, data)
+    sha, files = read_configuration(req.repo, req.ref)
+    with files, workdirs.lease(workdir_key(req.repo, files)) as wd:
+        tf = Terraform(
+            wd.path,
+            repo=req.repo,
+            sha=sha,
+            workspace=req.workspace,
+            **req.meta,
+        )
+        prepare(tf, wd, files)
+        tf.auto_apply(vars=req.vars, refresh_only=req.refresh_only, destroy=req.destroy)
+    return {
+        "message": "Successfully applied",
+        "init_seconds": tf.timings["init"],
+        "warm": wd.warm,
+    }
+
+
+def stats():
+    return {
+        "token": tokens.stats(),
+        "archives": archives.stats(),
+        "workdirs": workdirs.stats(),
+        "workspaces": workspace_cache().stats(),
+    }
+
+
+@contextmanager
+def transient_directory(root_dir):
+    d = os.path.join(root_dir, uuid4().hex)
+    os.makedirs(d)
+    try:
+        yield d
+    finally:
+        rmtree(d)
+
+
+def read_configuration(repo: str, ref: str) -> tuple[str, Configuration]:
+    # The caller closes the configuration.
+    sha = resolve_ref(repo, ref)
+    archive = archives.open(
+        f"{repo}@{sha}", lambda f: download_repo_zip(repo, sha, f)
+    )
+    try:
+        return sha, Configuration(archive)
+    except BaseException:
+        archive.close()
+        raise
+
+
+def plan_scope(req: PlanRequest, files: Configuration):
+    # A partial plan only covers what changed since req.base_ref; its
+    # summary and result say so, and why a full plan ran instead if it did.
+    scope = {"partial": False, "base_sha": req.base_sha, "targets": None, "reason": None}
+    if not req.base_ref:
+        return scope
+    base_sha, base = read_configuration(req.repo, req.base_sha or req.base_ref)
+    scope["base_sha"] = base_sha
+    with base:
+        targets, reason = plan_targets(base, files)
+    if targets is None:
+        print(f"planning everything: {reason}")
+        return {**scope, "reason": reason}
+    print(f"planning {len(targets)} target(s) changed since {base_sha}")
+    return {**scope, "partial": True, "targets": targets}
+
+
+def workdir_key(repo: str, files: Configuration):
+    # Not per workspace: every command selects it through TF_WORKSPACE, so
+    # all of a repo's workspaces share initialized directories.
+    lockfile = sha256(files.get(".terraform.lock.hcl", b"")).hexdigest()
+    return f"{repo}:{lockfile}"
+
+
+def prepare(tf: Terraform, wd: Workdir, files: Configuration):
+    # Brings a pooled directory up to date with `files`. init only runs when
+    # the directory is new or something init depends on changed.
+    with span("zip_extract"):
+        changed = wd.sync(files)
+    fingerprint = init_fingerprint(files)
+    if wd.fingerprint == fingerprint:
+        tf.timings["init"] = 0.0
+        print(f"reusing initialized directory, {len(changed)} file(s) changed")
+        tf.use_workspace()
+        return
+    tf.init()
+    wd.fingerprint = fingerprint
@@ -0,0 +1,107 @@
+import json
+from typing import Any, Callable
+
+from flask.json.provider import DefaultJSONProvider
+
+from .env import JSON_BACKEND
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The two formats everything is written in, byte for byte what the json
+# module writes with these arguments, whichever backend wrote them.
+COMPACT = {"separators": (",", ":"), "sort_keys": True}
+PRETTY = {"indent": 2, "sort_keys": True}
+
+BACKEND = JSON_BACKEND if JSON_BACKEND != "auto" else "orjson" if orjson else "json"
+if BACKEND == "orjson" and orjson is None:
+    raise ImportError("JSON_BACKEND is orjson, but orjson isn't installed")
+if BACKEND not in ("orjson", "json"):
+    raise ValueError(f"Unknown JSON_BACKEND {BACKEND}")
+
+if orjson is not None:
+    # Types the json module hands to `default` go there with orjson too.
+    _COMPACT = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+    )
+    _PRETTY = _COMPACT | orjson.OPT_INDENT_2
+# JSON with every digit turned into 0 and everything but the rest of a
+# number's characters into spaces; checking numbers' shapes in this is
+# far faster than running a regex over the original.
+_NUMBERS = bytes(
+    0x30 if 0x30 <= c <= 0x39 else c if c in b".e-" else 0x20 for c in range(256)
+)
+# orjson reads integers outside 64 bits as floats, where the json module keeps
+# them exact; any run of 19 digits might be one.
+_LONG_NUMBER = b"0" * 19
+
+
+def dumps(obj: Any, default: Callable[[Any], Any] | None = None) -> str:
+    return _dumps(obj, default, pretty=False)
+
+
+def dumps_pretty(obj: Any, default: Callable[[Any], Any] | None = None) -> str:
+    return _dumps(obj, default, pretty=True)
+
+
+def loads(data: str | bytes) -> Any:
+    if BACKEND == "orjson":
+        # Lone surrogates survive the encoding, for orjson to reject.
+        raw = data.encode(errors="surrogatepass") if isinstance(data, str) else data
+        if _LONG_NUMBER not in raw.translate(_NUMBERS):
+            try:
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError:
+                # NaN, Infinity, or really invalid: the json module decides,
+                # and raises its own error if it has to.
+                pass
+    return json.loads(data)
+
+
+def _dumps(obj: Any, default: Callable[[Any], Any] | None, pretty: bool) -> str:
+    # orjson's output is only used when it can't differ from the json
+    # module's; otherwise, or when orjson can't encode the value (integers
+    # past 64 bits, keys that aren't strings), the json module does the work.
+    if BACKEND == "orjson":
+        try:
+            data = orjson.dumps(obj, default=default, option=_PRETTY if pretty else _COMPACT)
+        except orjson.JSONEncodeError:
+            data = None
+        if data is not None and not _diverges(data):
+            return data.decode()
+    return json.dumps(obj, default=default, **(PRETTY if pretty else COMPACT))
+
+
+def _diverges(data: bytes):
+    # Whether the json module could have written `data` differently. It
+    # escapes everything outside printable ASCII and writes NaN and the
+    # infinities literally, where orjson writes null. Strings that merely
+    # look like one of these send the value to the json module, which costs
+    # time but never changes the output.
+    if not data.isascii() or b"\x7f" in data or b"null" in data:
+        return True
+    # Floats orjson may write differently: 1e-05 as 0.00001, 1e-07 as 1e-7
+    # and, depending on its version, 1e+16 as 1e16. Any exponent at all
+    # goes to the json module.
+    numbers = data.translate(_NUMBERS)
+    return b"0.0000" in numbers or b"0e" in numbers
+
+
+class JSONProvider(DefaultJSONProvider):
+    # Flask's provider, with the serializer taking the calls that ask for
+    # one of its formats (jsonify is COMPACT outside debug mode).
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        default = kwargs.pop("default", self.default)
+        if self.ensure_ascii and self.sort_keys:
+            if kwargs == {"separators": COMPACT["separators"]}:
+                return dumps(obj, default)
+            if kwargs == {"indent": PRETTY["indent"]}:
+                return dumps_pretty(obj, default)
+        return super().dumps(obj, default=default, **kwargs)
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return super().loads(s, **kwargs) if kwargs else loads(s)
@@ -0,0 +1,156 @@
+import threading
+from functools import cache
+from queue import Empty, Queue
+from time import monotonic
+from typing import Any
+
+from google.cloud import firestore
+
+from .env import OUTPUT_SINK, OUTPUT_BATCH_SIZE, OUTPUT_FLUSH_SECONDS, OUTPUT_MAX_PENDING
+
+# Firestore rejects batches with more than 500 writes.
+MAX_BATCH_SIZE = 500
+_CLOSE = object()
+
+
+class OutputStream:
+    # Receives the JSON lines of one Terraform command, in order. Every line
+    # is tagged with a `seq` field so readers can restore that order.
+    def __init__(self) -> None:
+        self.seq = 0
+
+    def write(self, output: dict[str, Any]) -> None:
+        self._write({**output, "seq": self.seq})
+        self.seq += 1
+
+    def close(self) -> None:
+        pass
+
+    def _write(self, output: dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OutputSink:
+    def start(self, record: dict[str, Any]) -> OutputStream:
+        raise NotImplementedError
+
+
+class FirestoreSink(OutputSink):
+    # runs/{id} holds the command and its meta, runs/{id}/output/{seq} the
+    # lines. Lines are committed in WriteBatches from a background thread so
+    # Terraform is never waiting on a Firestore round-trip.
+    def __init__(
+        self,
+        client: firestore.Client | None = None,
+        batch_size: int = MAX_BATCH_SIZE,
+        flush_seconds: float = 0.5,
+        max_pending: int = 5000,
+    ) -> None:
+        self.client = client or firestore.Client()
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+
+    def start(self, record: dict[str, Any]) -> OutputStream:
+        ref = self.client.collection("runs").document()
+        ref.set(record)
+        return _FirestoreStream(self, ref)
+
+
+class _FirestoreStream(OutputStream):
+    def __init__(self, sink: FirestoreSink, ref: firestore.DocumentReference) -> None:
+        super().__init__()
+        self.sink = sink
+        self.ref = ref
+        self.error: Exception | None = None
+        # Bounded, so a run that outpaces Firestore blocks in write() instead
+        # of buffering its whole output in memory.
+        self._queue: Queue = Queue(maxsize=sink.max_pending)
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def _write(self, output: dict[str, Any]) -> None:
+        self._queue.put(output)
+
+    def close(self) -> None:
+        # Blocks until everything written so far is committed.
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        if self.error:
+            print(f"Failed to write Terraform output: {self.error}")
+
+    def _flush_loop(self):
+        pending: list[dict[str, Any]] = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Empty:
+                item = None
+            closing = item is _CLOSE
+            if item is not None and not closing:
+                pending.append(item)
+                if deadline is None:
+                    deadline = monotonic() + self.sink.flush_seconds
+            if pending and (
+                closing
+                or len(pending) >= self.sink.batch_size
+                or monotonic() >= deadline
+            ):
+                self._commit(pending)
+                pending = []
+                deadline = None
+            if closing:
+                return
+
+    def _commit(self, outputs: list[dict[str, Any]]):
+        if self.error:
+            return
+        batch = self.sink.client.batch()
+        collection = self.ref.collection("output")
+        for output in outputs:
+            batch.set(collection.document(f"{output['seq']:08d}"), output)
+        try:
+            batch.commit()
+        except Exception as e:
+            # Keep draining so writers never block on a dead consumer.
+            self.error = e
+
+
+class MemorySink(OutputSink):
+    # Keeps runs in memory, for tests and benchmarks.
+    def __init__(self) -> None:
+        self.runs: list[dict[str, Any]] = []
+
+    def start(self, record: dict[str, Any]) -> OutputStream:
+        run = {**record, "output": []}
+        self.runs.append(run)
+        return _MemoryStream(run["output"])
+
+
+class _MemoryStream(OutputStream):
+    def __init__(self, output: list[dict[str, Any]]) -> None:
+        super().__init__()
+        self.output = output
+
+    def _write(self, output: dict[str, Any]) -> None:
+        self.output.append(output)
+
+
+@cache
+def output_sink() -> OutputSink:
+    if OUTPUT_SINK == "memory":
+        return MemorySink()
+    return FirestoreSink(
+        batch_size=OUTPUT_BATCH_SIZE,
+        flush_seconds=OUTPUT_FLUSH_SECONDS,
+        max_pending=OUTPUT_MAX_PENDING,
+    )
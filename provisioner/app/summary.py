@@ -0,0 +1,130 @@
+from collections import Counter, OrderedDict
+from threading import Lock
+from typing import Any
+
+from google.cloud import storage
+
+from . import serializer
+
+# Stored next to the plan's manifest.
+SUFFIX = ".summary.json"
+
+
+class PlanSummary:
+    # Built from the -json UI output of `terraform plan` as it streams past,
+    # so nobody has to run `terraform show -json` or read the run's output
+    # back to find out what a plan changes.
+    def __init__(self) -> None:
+        self.changes: dict[str, dict[str, Any]] = {}
+        self.drift: dict[str, dict[str, Any]] = {}
+        self.counts: dict[str, Any] | None = None
+        self.diagnostics: Counter[str] = Counter()
+
+    def observe(self, line: dict[str, Any]):
+        kind = line.get("type")
+        if kind in ("planned_change", "resource_drift"):
+            change = line.get("change") or {}
+            address = (change.get("resource") or {}).get("addr")
+            if not address:
+                return
+            entry = {"action": change.get("action")}
+            if change.get("reason"):
+                entry["reason"] = change["reason"]
+            if change.get("previous_resource"):
+                entry["previous_address"] = change["previous_resource"].get("addr")
+            (self.changes if kind == "planned_change" else self.drift)[address] = entry
+        elif kind == "change_summary":
+            self.counts = line.get("changes")
+        elif kind == "diagnostic":
+            self.diagnostics[line.get("@level", "info")] += 1
+
+    def result(self) -> dict[str, Any]:
+        return {
+            "version": 1,
+            "counts": self.counts or self._count(),
+            "changes": dict(sorted(self.changes.items())),
+            "drift": dict(sorted(self.drift.items())),
+            # Addresses by action, for "what gets destroyed?" without a scan.
+            "by_action": _by_action(self.changes),
+            "diagnostics": dict(self.diagnostics),
+        }
+
+    def _count(self):
+        # Only used when Terraform didn't report a change_summary.
+        actions = Counter(entry["action"] for entry in self.changes.values())
+        return {
+            "add": actions["create"] + actions["replace"],
+            "change": actions["update"],
+            "remove": actions["delete"] + actions["replace"],
+        }
+
+
+class SummaryCache:
+    # Summaries served by GET /plan/<id>/summary, bounded in bytes. An entry
+    # is only used while the stored object still has the same generation,
+    # which costs a metadata request but never a download.
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[int, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+
+    def get(self, bucket: storage.Bucket, plan_id: str) -> tuple[int, bytes] | None:
+        blob = bucket.get_blob(f"{plan_id}{SUFFIX}")
+        if blob is None:
+            return None
+        with self._lock:
+            cached = self._entries.get(plan_id)
+            if cached is not None and cached[0] == blob.generation:
+                self._entries.move_to_end(plan_id)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        entry = (blob.generation, blob.download_as_bytes(if_generation_match=blob.generation))
+        with self._lock:
+            if plan_id in self._entries:
+                self._bytes -= len(self._entries.pop(plan_id)[1])
+            if len(entry[1]) <= self.max_bytes:
+                self._entries[plan_id] = entry
+                self._bytes += len(entry[1])
+            while self._bytes > self.max_bytes:
+                self._bytes -= len(self._entries.popitem(last=False)[1][1])
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+def store(bucket: storage.Bucket, plan_id: str, summary: dict[str, Any]):
+    bucket.blob(f"{plan_id}{SUFFIX}").upload_from_string(
+        serializer.dumps(summary), content_type="application/json"
+    )
+
+
+def copy(bucket: storage.Bucket, plan_id: str, new_plan_id: str):
+    bucket.copy_blob(bucket.blob(f"{plan_id}{SUFFIX}"), bucket, f"{new_plan_id}{SUFFIX}")
+
+
+def select(summary: dict[str, Any], actions: list[str]) -> dict[str, Any]:
+    # The summary restricted to changes with one of `actions`.
+    changes = {
+        address: entry
+        for address, entry in summary["changes"].items()
+        if entry["action"] in actions
+    }
+    return {**summary, "changes": changes, "by_action": _by_action(changes)}
+
+
+def _by_action(changes: dict[str, dict[str, Any]]):
+    index: dict[str, list[str]] = {}
+    for address, entry in sorted(changes.items()):
+        index.setdefault(entry["action"], []).append(address)
+    return index
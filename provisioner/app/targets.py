@@ -0,0 +1,113 @@
+import re
+from typing import Any, Mapping
+
+from . import serializer
+from .env import TARGET_MAX_FRACTION
+
+# Configuration written by main is one element per file, named after the
+# element's address: resource.aws_instance.web.tf.json holds
+# {"resource": {"aws_instance": {"web": ...}}}. Elements of these kinds can
+# be planned on their own with -target, and Terraform pulls in whatever
+# they depend on.
+TARGETABLE = ("resource", "data", "module")
+# Kinds whose changes only matter through what references them.
+REFERENCED = ("variable", "locals")
+# Anything that looks like a reference; names that aren't elements of the
+# configuration are ignored, so matching too much only ever adds targets.
+REFERENCE = re.compile(
+    r"\b(?:data\.[A-Za-z_][\w-]*\.[A-Za-z_][\w-]*"
+    r"|(?:module|var|local)\.[A-Za-z_][\w-]*"
+    r"|[A-Za-z_][\w-]*\.[A-Za-z_][\w-]*)"
+)
+
+
+def plan_targets(
+    base: Mapping[str, bytes], head: Mapping[str, bytes]
+) -> tuple[list[str] | None, str | None]:
+    # The -target addresses that cover every change between two commits'
+    # configurations, or None and the reason a full plan is needed. The
+    # closure is the changed elements plus everything that references them,
+    # directly or not, since their planned values may change too.
+    changed = sorted(
+        name for name in base.keys() | head.keys() if base.get(name) != head.get(name)
+    )
+    if not changed:
+        return None, "configuration unchanged"
+    if any(name.endswith(".tf") for name in base.keys() | head.keys()):
+        return None, "references in HCL configuration can't be traced"
+    for name in changed:
+        if name.endswith((".tfvars", ".tfvars.json")):
+            return None, f"{name} changed"
+    nodes: dict[str, str] = {}
+    dependents: dict[str, set[str]] = {}
+    for files in (base, head):
+        for name, content in files.items():
+            if not name.endswith(".tf.json"):
+                continue
+            node = _node(name)
+            if node is None:
+                # Provider configurations and the like: if any of them
+                # depends on a change, everything might.
+                node = f"file:{name}"
+            nodes[name] = node
+            try:
+                references = _references(serializer.loads(content))
+            except ValueError:
+                return None, f"{name} isn't valid JSON"
+            for reference in references:
+                dependents.setdefault(reference, set()).add(node)
+    pending = []
+    for name in changed:
+        if not name.endswith(".tf.json"):
+            continue
+        kind = name.split(".")[0]
+        if kind not in TARGETABLE + REFERENCED or nodes[name].startswith("file:"):
+            return None, f"{name} changed"
+        pending.append(nodes[name])
+    closure: set[str] = set()
+    while pending:
+        node = pending.pop()
+        if node in closure:
+            continue
+        closure.add(node)
+        pending.extend(dependents.get(node, ()))
+    for node in closure:
+        if node.startswith("file:"):
+            return None, f"{node[len('file:'):]} depends on the changes"
+    targetable = {node for node in nodes.values() if _targetable(node)}
+    targets = sorted(node for node in closure if _targetable(node))
+    if not targets:
+        return None, "no targetable changes"
+    if len(targets) > len(targetable) * TARGET_MAX_FRACTION:
+        return None, f"{len(targets)} of {len(targetable)} elements affected"
+    return targets, None
+
+
+def _node(filename: str) -> str | None:
+    # The name other elements use to refer to the element in `filename`.
+    keys = filename.removesuffix(".tf.json").split(".")
+    if keys[0] == "resource" and len(keys) == 3:
+        return f"{keys[1]}.{keys[2]}"
+    if keys[0] == "data" and len(keys) == 3:
+        return f"data.{keys[1]}.{keys[2]}"
+    if keys[0] in ("module", "output") and len(keys) == 2:
+        return f"{keys[0]}.{keys[1]}"
+    if keys[0] == "variable" and len(keys) == 2:
+        return f"var.{keys[1]}"
+    if keys[0] == "locals" and len(keys) == 2:
+        return f"local.{keys[1]}"
+    return None
+
+
+def _targetable(node: str):
+    return not node.startswith(("var.", "local.", "output.", "file:"))
+
+
+def _references(value: Any) -> set[str]:
+    if isinstance(value, str):
+        return set(REFERENCE.findall(value))
+    if isinstance(value, dict):
+        return set().union(*map(_references, value.values()))
+    if isinstance(value, list):
+        return set().union(*map(_references, value))
+    return set()
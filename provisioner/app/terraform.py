@@ -1,35 +1,164 @@
+import re
 import json
-from os import path
-from subprocess import Popen, PIPE, run
-from typing import Any, List
+import fcntl
+import threading
+from collections import deque
+from os import environ, getpid, makedirs, path, replace
+from contextlib import contextmanager
+from functools import cache
+from queue import Empty, Queue
+from subprocess import Popen, PIPE, TimeoutExpired
+from time import monotonic, perf_counter
+from typing import IO, Any, Callable, List
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from google.cloud import firestore
-
-from .env import TF_EXE
+from .env import (
+    TF_EXE,
+    TF_PLUGIN_CACHE_DIR,
+    TF_PROVIDER_MIRROR,
+    TF_RUN_TIMEOUT,
+    TF_TERMINATE_GRACE,
+)
+from . import serializer
+from .metrics import request_id, span
+from .summary import PlanSummary
+from .sinks import OutputSink, OutputStream, output_sink
+from .workspaces import WorkspaceCache, gcs_backend, workspace_cache
 
 
 class Terraform:
-    def __init__(self, cwd: str, **meta: Any) -> None:
+    def __init__(
+        self,
+        cwd: str,
+        *,
+        sink: OutputSink | None = None,
+        workspaces: WorkspaceCache | None = None,
+        **meta: Any,
+    ) -> None:
         self.cwd = cwd
         self.planfile = path.join(self.cwd, "tfplan")
         self.meta = meta
-        self.db = firestore.Client()
+        self.sink = sink or output_sink()
+        self.workspaces = workspaces or workspace_cache()
+        self.env = {**environ, "TF_CLI_CONFIG_FILE": _cli_config_file()}
+        # Every command runs in the run's workspace through TF_WORKSPACE, so
+        # nothing depends on what `workspace select` left in .terraform. The
+        # exception is a plan zipped before its workspace was recorded: the
+        # .terraform/environment it ships with is all there is to go by.
+        self.workspace: str | None = meta.get("workspace") or None
+        if self.workspace is None:
+            self.env.pop("TF_WORKSPACE", None)
+        else:
+            self.env["TF_WORKSPACE"] = self.workspace
+        self.timings: dict[str, float] = {}
+
+    def init(self):
+        # A single `terraform init` when the workspace is known to exist.
+        # Only a workspace that is really missing costs a second command to
+        # create it.
+        start = perf_counter()
+        self._select_workspace(init=True)
+        self.timings["init"] = perf_counter() - start
+        print(f"terraform init took {self.timings['init']:.2f}s")
+
+    def use_workspace(self):
+        # For a directory that is already initialized: .terraform doesn't
+        # depend on the workspace, which only has to exist.
+        self._select_workspace(init=False)
 
-    def init(self, workspace: str | None = None):
-        run([TF_EXE, "init"], cwd=self.cwd)
-        if workspace:
+    def _select_workspace(self, init: bool):
+        if self.workspace in (None, "default"):
+            if init:
+                self._init()
+            return
+        # `workspace select` and `workspace new` refuse to run while
+        # TF_WORKSPACE is set, and init fails if it names a workspace that
+        # doesn't exist yet.
+        default = {**self.env, "TF_WORKSPACE": "default"}
+        unset = {k: v for k, v in self.env.items() if k != "TF_WORKSPACE"}
+        backend = gcs_backend(self.cwd)
+        if backend is None:
+            # No way to list workspaces without Terraform.
+            if init:
+                self._init(env=default)
+            try:
+                self._exec("workspace", "select", self.workspace, env=unset)
+            except TerraformError:
+                self._exec("workspace", "new", self.workspace, env=unset)
+            return
+        if self.workspaces.exists(backend, self.workspace):
+            if not init:
+                return
             try:
-                run([TF_EXE, "workspace", "select", workspace], cwd=self.cwd)
+                self._init()
+                return
             except TerraformError:
-                run([TF_EXE, "workspace", "new", workspace], cwd=self.cwd)
+                # Possibly deleted since it was listed.
+                self.workspaces.forget(backend)
+                if self.workspaces.exists(backend, self.workspace):
+                    raise
+        if init:
+            self._init(env=default)
+        try:
+            self._exec("workspace", "new", self.workspace, env=unset)
+        except TerraformError:
+            # Another run may have created it in the meantime.
+            self.workspaces.forget(backend)
+            if not self.workspaces.exists(backend, self.workspace):
+                raise
+        self.workspaces.add(backend, self.workspace)
+
+    def _init(self, env: dict[str, str] | None = None):
+        # Installing providers into the shared cache needs the lock. Once
+        # every provider in the directory's lock file is recorded as
+        # installed, init only links them and runs without it.
+        if _providers_cached(self.cwd):
+            self._exec("init", env=env)
+            return
+        with _plugin_cache_lock():
+            self._exec("init", env=env)
+            _record_providers(self.cwd)
+
+    def _exec(self, *args: str, env: dict[str, str] | None = None):
+        # Runs a command whose output isn't part of the run's output; it is
+        # logged, and the end of stderr goes into the error if it fails.
+        cmd = [TF_EXE, *args]
+        stderr: deque[str] = deque(maxlen=20)
+
+        def on_line(name: str, received: datetime, output: bytes):
+            text = output.decode(errors="replace").rstrip()
+            if text:
+                print(text)
+                if name == "stderr":
+                    stderr.append(text)
+
+        returncode = _run_process(
+            cmd,
+            cwd=self.cwd,
+            env=env or self.env,
+            on_line=on_line,
+            timeout=TF_RUN_TIMEOUT,
+        )
+        if returncode != 0:
+            raise TerraformError(cmd=cmd, detail="\n".join(stderr))
 
     def plan(
-        self, vars: dict[str, Any] | None = None, refresh_only=False, destroy=False
+        self,
+        vars: dict[str, Any] | None = None,
+        refresh_only=False,
+        destroy=False,
+        targets: list[str] | None = None,
     ):
+        # Returns the plan's summary, see summary.py. With `targets`, only
+        # those addresses and what they depend on are refreshed and planned.
         args = _get_args(vars, refresh_only, destroy)
-        self.run("plan", "-json", *args, f"-out={self.planfile}")
+        args.extend(f"-target={target}" for target in targets or [])
+        summary = PlanSummary()
+        self.run(
+            "plan", "-json", *args, f"-out={self.planfile}", on_output=summary.observe
+        )
+        return summary.result()
 
     def apply(self):
         self.run("apply", "-json", self.planfile)
@@ -40,42 +169,213 @@ class Terraform:
         args = _get_args(vars, refresh_only, destroy)
         self.run("apply", "-json", "-auto-approve", *args)
 
-    def run(self, *args: str):
+    def run(
+        self, *args: str, on_output: Callable[[dict[str, Any]], None] | None = None
+    ):
         cmd = [TF_EXE, *args]
-        ref = self.db.collection('runs').document()
-        ref.set({
+        stream = self.sink.start({
             "timestamp": datetime.utcnow().replace(tzinfo=ZoneInfo("UTC")),
             "args": args,
-            "meta": self.meta
+            "meta": self.meta,
+            "request_id": request_id.get(),
         })
-        with Popen(cmd, stdout=PIPE, stderr=PIPE, cwd=self.cwd) as process:
-            if process.stdout:
-                for line in process.stdout:
-                    _handle_output(ref, args, line)
-            if process.stderr:
-                for line in process.stderr:
-                    _handle_output(ref, args, line)
-        if process.returncode != 0:
+        with stream:
+            returncode = _run_process(
+                cmd,
+                cwd=self.cwd,
+                env=self.env,
+                on_line=lambda *line: _handle_output(stream, args, on_output, *line),
+                timeout=TF_RUN_TIMEOUT,
+            )
+        if returncode != 0:
             raise TerraformError(cmd=cmd)
 
-    def _write_output(self, ref: firestore.DocumentReference, output: Any):
-        ref.collection('output').document().set(output)
+
+class TerraformError(Exception):
+    def __init__(
+        self,
+        cmd: List[str],
+        reason="Error occured when executing Terraform command",
+        detail: str | None = None,
+    ) -> None:
+        message = f"{reason}: {' '.join(cmd)}"
+        super().__init__(f"{message}\n{detail}" if detail else message)
 
 
+class TerraformTimeout(TerraformError):
+    def __init__(self, cmd: List[str], timeout: float) -> None:
+        super().__init__(cmd, f"Terraform command timed out after {timeout:g}s")
 
-class TerraformError(Exception):
-    def __init__(self, cmd: List[str]) -> None:
-        super().__init__(
-            f"Error occured when executing Terraform command: {' '.join(cmd)}"
-        )
 
-def _handle_output(ref: firestore.DocumentReference, args: tuple[str, ...], output: bytes):
+def _handle_output(
+    stream: OutputStream,
+    args: tuple[str, ...],
+    on_output: Callable[[dict[str, Any]], None] | None,
+    name: str,
+    received: datetime,
+    output: bytes,
+):
+    text = output.decode(errors="replace").rstrip()
+    if not text:
+        return
     if "-json" in args:
-        parsed = json.loads(output)
-        print(parsed['@message'])
-        ref.collection('output').document().set(parsed)
+        try:
+            parsed = serializer.loads(text)
+        except ValueError:
+            parsed = None
+        if not isinstance(parsed, dict):
+            # Terraform still writes some things (crashes, provider panics)
+            # as plain text, usually on stderr.
+            parsed = {"@level": "error" if name == "stderr" else "info", "@message": text}
+        print(parsed.get("@message", text))
+        stream.write({**parsed, "stream": name, "received": received})
+        if on_output is not None:
+            on_output(parsed)
     else:
-        print(output.decode())
+        print(text)
+
+
+def _run_process(
+    cmd: List[str],
+    cwd: str,
+    env: dict[str, str],
+    on_line: Callable[[str, datetime, bytes], None],
+    timeout: float | None = None,
+) -> int:
+    # Both pipes are drained by their own thread so neither can fill up and
+    # stall Terraform; lines are handed to on_line on the calling thread in
+    # the order they arrived. The process is terminated, then killed, if it
+    # runs past `timeout` or the caller is interrupted (e.g. a job cancel).
+    lines: Queue = Queue()
+    with span("terraform", command=cmd[1]), Popen(
+        cmd, stdout=PIPE, stderr=PIPE, cwd=cwd, env=env
+    ) as process:
+        pipes = {"stdout": process.stdout, "stderr": process.stderr}
+        for name, pipe in pipes.items():
+            threading.Thread(target=_drain, args=(name, pipe, lines), daemon=True).start()
+        deadline = monotonic() + timeout if timeout else None
+        try:
+            open_pipes = len(pipes)
+            while open_pipes:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TerraformTimeout(cmd, timeout)
+                try:
+                    line = lines.get(timeout=remaining)
+                except Empty:
+                    continue
+                if line is None:
+                    open_pipes -= 1
+                else:
+                    on_line(*line)
+            try:
+                process.wait(None if deadline is None else max(deadline - monotonic(), 0))
+            except TimeoutExpired:
+                raise TerraformTimeout(cmd, timeout)
+        except BaseException:
+            _terminate(process)
+            raise
+    return process.returncode
+
+
+def _drain(name: str, pipe: IO[bytes], lines: Queue):
+    try:
+        for line in pipe:
+            lines.put((name, datetime.utcnow().replace(tzinfo=ZoneInfo("UTC")), line))
+    except (OSError, ValueError):
+        # The pipe was closed under us after the process was terminated.
+        pass
+    finally:
+        lines.put(None)
+
+
+def _terminate(process: Popen):
+    # SIGTERM lets Terraform stop gracefully and release the state lock.
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(TF_TERMINATE_GRACE)
+    except TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+@cache
+def _cli_config_file():
+    # Providers come from the mirror laid out by get_providers.py and
+    # unzip_providers.py when one is configured, and are then linked out of
+    # a cache shared by every run, so init never downloads a provider twice.
+    config = path.join(TF_PLUGIN_CACHE_DIR, "terraform.rc")
+    makedirs(TF_PLUGIN_CACHE_DIR, exist_ok=True)
+    lines = [
+        f"plugin_cache_dir = {json.dumps(TF_PLUGIN_CACHE_DIR)}",
+        "plugin_cache_may_break_dependency_lock_file = true",
+    ]
+    if TF_PROVIDER_MIRROR:
+        lines += [
+            "provider_installation {",
+            "  filesystem_mirror {",
+            f"    path = {json.dumps(TF_PROVIDER_MIRROR)}",
+            "  }",
+            "  direct {}",
+            "}",
+        ]
+    tmp = f"{config}.{getpid()}"
+    with open(tmp, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    replace(tmp, config)
+    return config
+
+
+@contextmanager
+def _plugin_cache_lock():
+    # Terraform does not guarantee the plugin cache is safe for concurrent
+    # installs, so provider installs into it take turns. With the mirror in
+    # place an install only links providers and the lock is held briefly.
+    with open(path.join(TF_PLUGIN_CACHE_DIR, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_LOCKED_PROVIDER = re.compile(r'provider\s+"([^"]+)"\s*\{\s*version\s*=\s*"([^"]+)"')
+
+
+def _providers_cached(cwd: str):
+    # Whether every provider in the directory's lock file was installed into
+    # the cache by an earlier init, so this one only has to link them.
+    # Without a lock file, which init writes unless the repo has one, there
+    # is no telling.
+    providers = _locked_providers(cwd)
+    return bool(providers) and providers <= _installed_providers()
+
+
+def _record_providers(cwd: str):
+    # Called with the plugin cache lock held, once init has installed them.
+    new = _locked_providers(cwd) - _installed_providers()
+    with open(path.join(TF_PLUGIN_CACHE_DIR, "installed"), "a") as f:
+        f.writelines(f"{provider}\n" for provider in sorted(new))
+
+
+def _installed_providers() -> set[str]:
+    try:
+        with open(path.join(TF_PLUGIN_CACHE_DIR, "installed")) as f:
+            return set(f.read().splitlines())
+    except FileNotFoundError:
+        return set()
+
+
+def _locked_providers(cwd: str) -> set[str]:
+    # "{source address} {version}" of each provider in .terraform.lock.hcl.
+    try:
+        with open(path.join(cwd, ".terraform.lock.hcl")) as f:
+            content = f.read()
+    except FileNotFoundError:
+        return set()
+    return {f"{source} {version}" for source, version in _LOCKED_PROVIDER.findall(content)}
 
 
 def _get_args(
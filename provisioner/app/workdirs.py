@@ -0,0 +1,256 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from hashlib import sha256
+from shutil import rmtree
+from threading import Lock
+from time import time
+from typing import Iterator, Mapping
+from uuid import uuid4
+
+from . import serializer
+from .configuration import Configuration
+
+# Left alone when syncing configuration: init writes the lock file when the
+# repo doesn't have one, and owns .terraform.
+KEEP = (".terraform", ".terraform.lock.hcl")
+
+
+class Workdir:
+    def __init__(self, path: str, state: dict | None) -> None:
+        self.path = path
+        self.warm = state is not None
+        # Identifies the configuration the directory was last initialized
+        # for; see init_fingerprint.
+        self.fingerprint: str | None = state["fingerprint"] if state else None
+
+    def sync(self, files: Configuration) -> list[str]:
+        # Make the top level of the directory hold exactly `files`, extracting
+        # only what differs, one file at a time. Returns the names that were
+        # written or removed.
+        os.makedirs(self.path, exist_ok=True)
+        changed = []
+        for name in os.listdir(self.path):
+            full = os.path.join(self.path, name)
+            if name in files or name in KEEP or not os.path.isfile(full):
+                continue
+            os.remove(full)
+            changed.append(name)
+        for name in files:
+            full = os.path.join(self.path, name)
+            if files.same(name, full):
+                continue
+            files.extract(name, full)
+            changed.append(name)
+        return sorted(changed)
+
+
+class WorkdirPool:
+    # Initialized Terraform working directories, kept between runs and keyed
+    # by (repo, lock file hash) so the next run for the same key
+    # only rewrites the files that changed and, usually, skips init.
+    #
+    # The pool lives on disk and is shared by every job worker process. Each
+    # entry is {key hash}-{id}/ holding the working directory (tf/), a lease
+    # file that is flock'ed while a run uses the entry, and state.json, which
+    # is only written when a run finishes cleanly and removed when the next
+    # one starts. An entry without state.json was left by a crashed or failed
+    # run and starts over from an empty directory. Idle entries are evicted
+    # least recently used first once the pool exceeds max_bytes, and when
+    # they haven't been used for max_age seconds; entries under lease are
+    # never touched.
+    def __init__(self, directory: str, max_bytes: int, max_age: float) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.leases = 0
+        self.warm = 0
+        self.discarded = 0
+        self.evictions = 0
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def lease(self, key: str) -> Iterator[Workdir]:
+        entry, lease = self._acquire(_hash(key))
+        try:
+            state = _read_state(entry)
+            if state is None:
+                # Never finished a run: nothing in it can be trusted.
+                rmtree(os.path.join(entry, "tf"), ignore_errors=True)
+            else:
+                os.remove(os.path.join(entry, "state.json"))
+            workdir = Workdir(os.path.join(entry, "tf"), state)
+            with self._lock:
+                self.leases += 1
+                self.warm += workdir.warm
+            try:
+                yield workdir
+            except BaseException:
+                with self._lock:
+                    self.discarded += 1
+                self._remove(entry)
+                raise
+            _write_state(
+                entry,
+                {
+                    "key": key,
+                    "fingerprint": workdir.fingerprint,
+                    "used": time(),
+                    "bytes": _size(entry),
+                },
+            )
+        finally:
+            lease.close()
+        self.evict()
+
+    def evict(self):
+        now = time()
+        entries = []
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.startswith("."):
+                # Half-created or half-removed by a process that died.
+                self._remove_idle(entry)
+                continue
+            state = _read_state(entry)
+            entries.append((state["used"] if state else 0, entry, state))
+        total = sum(state["bytes"] for _, _, state in entries if state)
+        for used, entry, state in sorted(entries, key=lambda e: e[0]):
+            if state is not None and total <= self.max_bytes and used + self.max_age > now:
+                break
+            if self._remove_idle(entry):
+                total -= state["bytes"] if state else 0
+                with self._lock:
+                    self.evictions += 1
+
+    def stats(self):
+        entries = [
+            _read_state(os.path.join(self.directory, name))
+            for name in os.listdir(self.directory)
+            if not name.startswith(".")
+        ]
+        with self._lock:
+            return {
+                "leases": self.leases,
+                "warm": self.warm,
+                "hit_rate": self.warm / self.leases if self.leases else 0.0,
+                "discarded": self.discarded,
+                "evictions": self.evictions,
+                "entries": len(entries),
+                "bytes": sum(state["bytes"] for state in entries if state),
+            }
+
+    def _acquire(self, prefix: str):
+        # Most recently used idle entry for the key, or a new one.
+        candidates = []
+        for name in os.listdir(self.directory):
+            if name.startswith(f"{prefix}-"):
+                entry = os.path.join(self.directory, name)
+                state = _read_state(entry)
+                candidates.append((state["used"] if state else 0, entry))
+        for _, entry in sorted(candidates, reverse=True):
+            lease = _try_lease(entry)
+            if lease is not None:
+                return entry, lease
+        # Created under a hidden name and locked before it is visible, so no
+        # other process can lease it half-made.
+        staging = os.path.join(self.directory, f".new-{uuid4().hex}")
+        os.makedirs(staging)
+        lease = _try_lease(staging)
+        entry = os.path.join(self.directory, f"{prefix}-{uuid4().hex}")
+        os.rename(staging, entry)
+        return entry, lease
+
+    def _remove_idle(self, entry: str):
+        lease = _try_lease(entry)
+        if lease is None:
+            return False
+        try:
+            self._remove(entry)
+        finally:
+            lease.close()
+        return True
+
+    def _remove(self, entry: str):
+        # Renamed away first so no one leases it while it is being deleted.
+        trash = os.path.join(self.directory, f".trash-{uuid4().hex}")
+        try:
+            os.rename(entry, trash)
+        except FileNotFoundError:
+            return
+        rmtree(trash, ignore_errors=True)
+
+
+def init_fingerprint(files: Mapping[str, bytes]) -> str:
+    # What `terraform init` depends on: module sources, the terraform block
+    # (backend, required providers), provider configurations and which
+    # providers the resources use. Editing resource arguments doesn't change
+    # it, so the directory can be planned again without another init.
+    # Anything that isn't JSON is taken whole.
+    inputs = []
+    for name in sorted(files):
+        content = files[name]
+        try:
+            config = serializer.loads(content) if name.endswith(".tf.json") else None
+        except ValueError:
+            config = None
+        if not isinstance(config, dict):
+            inputs.append([name, sha256(content).hexdigest()])
+            continue
+        inputs.append(
+            {block: config[block] for block in ("module", "terraform", "provider") if block in config}
+        )
+        for block in ("resource", "data"):
+            for type_, resources in (config.get(block) or {}).items():
+                inputs.append(type_.split("_")[0])
+                for resource in resources.values() if isinstance(resources, dict) else []:
+                    if isinstance(resource, dict) and "provider" in resource:
+                        inputs.append(resource["provider"])
+    return sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _try_lease(entry: str):
+    try:
+        f = open(os.path.join(entry, "lease"), "a")
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    if os.fstat(f.fileno()).st_nlink == 0:
+        # Removed between open and flock.
+        f.close()
+        return None
+    return f
+
+
+def _read_state(entry: str) -> dict | None:
+    try:
+        with open(os.path.join(entry, "state.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, NotADirectoryError, ValueError):
+        return None
+
+
+def _write_state(entry: str, state: dict):
+    tmp = os.path.join(entry, "state.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, os.path.join(entry, "state.json"))
+
+
+def _size(entry: str):
+    # Providers are links into the plugin cache and aren't counted.
+    total = 0
+    for root, _, files in os.walk(entry):
+        for name in files:
+            total += os.lstat(os.path.join(root, name)).st_size
+    return total
+
+
+def _hash(key: str):
+    return sha256(key.encode()).hexdigest()[:16]
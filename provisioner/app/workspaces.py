@@ -0,0 +1,91 @@
+import json
+import os
+from functools import cache
+from threading import Lock
+from time import monotonic
+
+from google.cloud import storage
+
+from .env import WORKSPACE_CACHE_TTL
+
+# (bucket, prefix) of a gcs backend.
+Backend = tuple[str, str]
+
+
+class WorkspaceCache:
+    # Workspaces that exist per gcs backend, listed from the state bucket
+    # rather than by running `terraform workspace list`: the backend keeps
+    # each workspace's state at {prefix}/{workspace}.tfstate. Workspaces are
+    # rarely deleted, so a listing is trusted for `ttl` seconds and a name
+    # that isn't in it triggers a fresh listing before it is treated as
+    # missing.
+    def __init__(self, client: storage.Client, ttl: float) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.hits = 0
+        self.listings = 0
+        self._known: dict[Backend, tuple[float, set[str]]] = {}
+        self._lock = Lock()
+
+    def exists(self, backend: Backend, workspace: str) -> bool:
+        with self._lock:
+            listed, names = self._known.get(backend, (0.0, set()))
+            if workspace in names and listed + self.ttl > monotonic():
+                self.hits += 1
+                return True
+        return workspace in self._list(backend)
+
+    def add(self, backend: Backend, workspace: str):
+        with self._lock:
+            if backend in self._known:
+                self._known[backend][1].add(workspace)
+
+    def forget(self, backend: Backend):
+        with self._lock:
+            self._known.pop(backend, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backends": len(self._known),
+                "hits": self.hits,
+                "listings": self.listings,
+            }
+
+    def _list(self, backend: Backend) -> set[str]:
+        bucket, prefix = backend
+        prefix = f"{prefix.rstrip('/')}/" if prefix else ""
+        names = {"default"}
+        for blob in self.client.list_blobs(bucket, prefix=prefix):
+            name = blob.name[len(prefix) :]
+            if name.endswith(".tfstate") and "/" not in name:
+                names.add(name[: -len(".tfstate")])
+        with self._lock:
+            self.listings += 1
+            self._known[backend] = (monotonic(), names)
+        return names
+
+
+@cache
+def workspace_cache() -> WorkspaceCache:
+    return WorkspaceCache(storage.Client(), ttl=WORKSPACE_CACHE_TTL)
+
+
+def gcs_backend(directory: str) -> Backend | None:
+    # The backend block main writes to terraform.backend.gcs.tf.json, or
+    # None when the configuration uses some other backend.
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".tf.json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            continue
+        blocks = config.get("terraform") if isinstance(config, dict) else None
+        # JSON configuration may spell a block as a list of blocks.
+        for block in blocks if isinstance(blocks, list) else [blocks or {}]:
+            gcs = (block.get("backend") or {}).get("gcs")
+            if isinstance(gcs, dict) and "bucket" in gcs:
+                return gcs["bucket"], gcs.get("prefix", "")
+    return None
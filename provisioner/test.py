@@ -33,6 +33,11 @@ def apply():
     print_response(r)
 
 
+def job(job_id: str):
+    r = requests.get(url + f"/jobs/{job_id}")
+    print_response(r)
+
+
 def print_response(r):
     print(json.dumps(r.json(), indent=2, sort_keys=True))
 